@@ -0,0 +1,339 @@
+'''
+Codigo para aumento de dados: variantes das manobras originais (espelhamento, posicao e aproamento iniciais, ruido de sensores
+e target deslocado) com as variaveis de treinamento recalculadas de forma vetorizada
+Uso: python Augment_Data.py [--variants 100] [--out ../Output/Aumentado/] [--seed 0]
+'''
+
+'''
+Importacao das bibliotecas a serem utilizadas
+'''
+import pandas as pd
+import numpy as np
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import Data_Filter as df_lib
+
+
+'''
+Variaveis globais
+'''
+log_names = ["time_stamp", "x", "y", "zz", "vx", "vy", "vzz", "rudder", "propeller"]  # Mesma ordem de spec.columns
+default_sensor_std = {"position": 0.5, "heading": 0.2, "velocity": 0.02, "yaw_rate": 0.01}  # Desvio padrao do ruido
+
+
+'''
+Classe para armazenamento de uma manobra original ja filtrada, base das variantes
+'''
+class BaseCase:
+    # Construtor da classe
+    # Entrada:
+    #   key: nome do caso nos arquivos compilados (CasoXX)
+    #   case_num: numero global do caso
+    #   ship: objeto Ship da embarcacao
+    #   channel: objeto Channel com a geometria pre-calculada do canal
+    #   target: coordenada cartesiana do target
+    #   arrays: dicionario com os vetores de log_names (comando de maquina ja discretizado)
+    # Saida:
+    #   None
+    def __init__(self, key, case_num, ship, channel, target, arrays):
+        self.key = key
+        self.case_num = case_num
+        self.ship = ship
+        self.channel = channel
+        self.target = target
+        self.arrays = arrays
+        self.samples = len(arrays["time_stamp"])
+
+
+'''
+Classe para geracao vetorizada das variantes de uma manobra
+'''
+class TrajectoryAugmenter:
+    # Construtor da classe
+    # Entrada:
+    #   flag_lateral: True para distancias bombordo e boreste, False para distancia a linha central
+    #   position_std: desvio padrao do deslocamento da posicao inicial (m)
+    #   heading_std: desvio padrao do desvio do aproamento inicial (graus)
+    #   decay: constante de tempo do decaimento dos desvios iniciais (s)
+    #   sensor_std: dicionario com o desvio padrao do ruido de position, heading, velocity e yaw_rate
+    #   target_std: desvio padrao do deslocamento do target (m)
+    #   mirror_prob: probabilidade de espelhar a manobra em relacao a linha central
+    #   seed: semente do gerador aleatorio
+    # Saida:
+    #   None
+    def __init__(self, flag_lateral=False, position_std=5.0, heading_std=2.0, decay=120.0, sensor_std=None,
+                 target_std=25.0, mirror_prob=0.5, seed=None):
+        self.flag_lateral = flag_lateral
+        self.position_std = position_std
+        self.heading_std = heading_std
+        self.decay = decay
+        self.sensor_std = dict(default_sensor_std, **(sensor_std or {}))
+        self.target_std = target_std
+        self.mirror_prob = mirror_prob
+        self.rng = np.random.default_rng(seed)
+
+        # Colunas na mesma ordem dos arquivos de treinamento
+        if flag_lateral == True:
+            distances = ["distance_port", "distance_starboard", "distance_target"]
+        else:
+            distances = ["distance_midline", "distance_target"]
+        self.names = ["time_stamp", "zz", "vx", "vy", "vzz", "rudder_demanded", "propeller_demanded"] + distances + ["cog", "sog", "local_cog"]
+
+    # Metodo para espelhamento da manobra em relacao a linha central de cada secao
+    # Entrada:
+    #   case: objeto BaseCase
+    # Saida:
+    #   Dicionario com os vetores espelhados (bombordo e boreste trocados)
+    def mirror(self, case):
+        arrays = case.arrays
+        channel = case.channel
+        x, y, zz = arrays["x"], arrays["y"], arrays["zz"]
+        section = channel.section_array(x, y)
+        a, b, c = channel.mid_normal  # Normais unitarias
+        dml = channel.dist_midline_array(section, x, y)
+
+        # Reflexao do aproamento pela direcao da linha central, no mesmo ramo do angulo original
+        reflected = 2 * channel.seg_angle[section] - zz
+        mirrored = dict(arrays)
+        mirrored["x"] = x - 2 * dml * a[section]
+        mirrored["y"] = y - 2 * dml * b[section]
+        mirrored["zz"] = zz + (reflected - zz + 180) % 360 - 180
+        mirrored["vy"] = -arrays["vy"]
+        mirrored["vzz"] = -arrays["vzz"]
+        mirrored["rudder"] = -arrays["rudder"]
+        return mirrored
+
+    # Metodo para geracao de um lote de variantes
+    # Entrada:
+    #   case: objeto BaseCase
+    #   variants: quantidade de variantes
+    # Saida:
+    #   Dicionario com as colunas de self.names em matrizes (variantes x amostras)
+    def augment(self, case, variants):
+        rng = self.rng
+        n = case.samples
+        shape = (variants, n)
+
+        # Espelhamento sorteado por variante
+        flip = (rng.random(variants) < self.mirror_prob)[:, None]
+        base = case.arrays
+        mirrored = self.mirror(case) if flip.any() else base
+        state = {name: np.where(flip, mirrored[name], base[name]) for name in ["x", "y", "zz", "vy", "vzz", "rudder"]}
+
+        # Desvio da posicao e do aproamento iniciais com decaimento exponencial ao longo da manobra
+        t = base["time_stamp"]
+        weight = np.exp(-(t - t[0]) / self.decay)
+        x = state["x"] + rng.normal(0, self.position_std, (variants, 1)) * weight
+        y = state["y"] + rng.normal(0, self.position_std, (variants, 1)) * weight
+        zz = state["zz"] + rng.normal(0, self.heading_std, (variants, 1)) * weight
+
+        # Ruido dos sensores em cada amostra
+        std = self.sensor_std
+        x = x + rng.normal(0, std["position"], shape)
+        y = y + rng.normal(0, std["position"], shape)
+        zz = zz + rng.normal(0, std["heading"], shape)
+        vx = base["vx"] + rng.normal(0, std["velocity"], shape)
+        vy = state["vy"] + rng.normal(0, std["velocity"], shape)
+        vzz = state["vzz"] + rng.normal(0, std["yaw_rate"], shape)
+
+        # Recalculo das variaveis de treinamento em um unico vetor
+        ship = case.ship
+        channel = case.channel
+        flat = [v.ravel() for v in (x, y, zz, vx, vy)]
+        if self.flag_lateral == True:
+            dpb, dsb, _ = ship.calc_dist_lateral_array(*flat[:3], channel, case.target, check_heading=False)
+            distances = [dpb.reshape(shape), dsb.reshape(shape)]
+        else:
+            dml, _ = ship.calc_dist_midline_array(*flat[:3], channel, case.target, check_heading=False)
+            distances = [dml.reshape(shape)]
+        cog, sog, local_cog = ship.calc_cog_sog_array(*flat[:3], channel, flat[3], flat[4])
+
+        # Target deslocado por variante
+        target_x = case.target.x + rng.normal(0, self.target_std, (variants, 1))
+        target_y = case.target.y + rng.normal(0, self.target_std, (variants, 1))
+        distances.append(np.hypot(x - target_x, y - target_y))
+
+        values = [np.broadcast_to(t, shape), zz, vx, vy, vzz, state["rudder"], np.broadcast_to(base["propeller"], shape)]
+        values += distances + [cog.reshape(shape), sog.reshape(shape), local_cog.reshape(shape)]
+        return dict(zip(self.names, values))
+
+    # Metodo para geracao de um lote de variantes em formato de tabela
+    # Entrada:
+    #   case: objeto BaseCase
+    #   variants: quantidade de variantes
+    #   first_variant: numero da primeira variante do lote
+    # Saida:
+    #   DataFrame com as colunas case e variant seguidas das colunas de treinamento
+    def frame(self, case, variants, first_variant=0):
+        columns = self.augment(case, variants)
+        data = {"case": np.full(variants * case.samples, case.case_num),
+                "variant": np.repeat(np.arange(first_variant, first_variant + variants), case.samples)}
+        data.update({name: values.ravel() for name, values in columns.items()})
+        return pd.DataFrame(data)
+
+
+'''
+Metodos de leitura das manobras originais
+'''
+# Leitura e filtragem de uma manobra original (mesma sequencia de Data_Filter.process_case)
+# Entrada:
+#   config: objeto DatasetConfig
+#   spec: objeto CaseSpec do caso
+# Saida:
+#   case: objeto BaseCase (None em caso de falha)
+#   errors: lista com as mensagens de erro do caso
+def load_base_case(config, spec):
+    previous_control = df_lib.err_control
+    control = df_lib.ErrorPrint(echo=False)
+    df_lib.err_control = control
+    try:
+        for text in spec.errors:
+            control.eprint(text)
+        try:
+            ship = df_lib.Ship(spec.ship_fullname, df_lib.P3D_file(spec.path_p3d, config.p3d_cache_path).find_dimensions(), spec.velocity)
+            df = df_lib.read_simulation_log(spec.path_case, spec.columns,
+                                            lambda chunk: df_lib.filter_trajectory(chunk, spec.buoys, spec.target, ship), config.chunksize)
+            arrays = {name: df[col].values.astype(float) for name, col in zip(log_names, spec.columns)}
+            # Mesmo perfil de velocidade dos arquivos de treinamento (perfil alternativo para comando oscilatorio)
+            ship = df_lib.case_ship(config, spec, ship, arrays["time_stamp"], arrays["propeller"])
+            arrays["propeller"] = ship.discrete_level_array(arrays["propeller"])
+            if arrays["propeller"].dtype.kind == "f":  # Mesmas amostras sem comando removidas dos arquivos de treinamento
+                keep = ~np.isnan(arrays["propeller"])
+                arrays = {name: values[keep] for name, values in arrays.items()}
+                arrays["propeller"] = arrays["propeller"].astype(int)
+            case = BaseCase(spec.key, spec.case_num, ship, spec.channel, spec.target, arrays)
+        except Exception as e:
+            control.eprint("Falha na leitura do caso - " + repr(e))
+            case = None
+    finally:
+        df_lib.err_control = previous_control
+    return case, control.get_messages()
+
+
+# Execucao isolada da leitura de um caso
+# Entrada:
+#   item: tupla (configuracao, spec)
+# Saida:
+#   Tupla (BaseCase ou None, lista de erros)
+def _load_item(item):
+    return load_base_case(*item)
+
+
+# Leitura de todas as manobras originais da configuracao
+# Entrada:
+#   config: objeto DatasetConfig
+#   workers: quantidade de processos em paralelo (1 para execucao sequencial)
+# Saida:
+#   Lista de objetos BaseCase lidos com sucesso
+def load_base_cases(config, workers=None):
+    specs, folder_errors = config.plan()
+    for folder, errors in zip(config.folders, folder_errors):
+        for text in errors:
+            df_lib.err_control.eprint(folder["path"] + ": " + text)
+    specs = [spec for spec in specs if spec.file is not None]
+    items = [(config, spec) for spec in specs]
+    if workers == 1:
+        results = [_load_item(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_load_item, items))
+
+    cases = []
+    for spec, (case, errors) in zip(specs, results):
+        for text in errors:
+            df_lib.err_control.eprint(spec.key + ": " + text)
+        if case is not None and case.samples > 0:
+            cases.append(case)
+    return cases
+
+
+'''
+Metodos de geracao
+'''
+# Gerador preguicoso de blocos de variantes, para consumo direto no treinamento
+# Entrada:
+#   cases: lista de objetos BaseCase
+#   augmenter: objeto TrajectoryAugmenter
+#   variants: quantidade de variantes por caso
+#   chunk_rows: quantidade aproximada de linhas por bloco
+# Saida:
+#   Gerador de DataFrames (um caso por bloco, lotes de variantes consecutivas)
+def augment_cases(cases, augmenter, variants, chunk_rows=1000000):
+    for case in cases:
+        batch = max(1, chunk_rows // case.samples)
+        for first in range(0, variants, batch):
+            yield augmenter.frame(case, min(batch, variants - first), first)
+
+
+# Escrita dos blocos em arquivos .npz numerados (lidos por Data_Filter.load_case_npz)
+# Entrada:
+#   frames: iteravel de DataFrames
+#   out_path: diretorio de saida
+#   metadata: dicionario com os parametros da geracao
+# Saida:
+#   rows: quantidade total de linhas escritas
+#   paths: lista com os arquivos escritos
+def write_chunks(frames, out_path, metadata):
+    if not os.path.exists(out_path):
+        os.makedirs(out_path)
+    rows = 0
+    paths = []
+    for i, frame in enumerate(frames):
+        path = os.path.join(out_path, "part_" + str(i).zfill(5) + ".npz")
+        df_lib.write_case_npz(path, frame, metadata)
+        rows = rows + len(frame)
+        paths.append(path)
+    return rows, paths
+
+
+'''
+Metodo principal
+'''
+def main(config_path=None, variants=100, out_path=None, chunk_rows=1000000, seed=None, workers=None, position_std=5.0,
+         heading_std=2.0, decay=120.0, target_std=25.0, mirror_prob=0.5, sensor_scale=1.0):
+    df_lib.err_control = df_lib.ErrorPrint()
+    config = df_lib.DatasetConfig(config_path if config_path is not None else df_lib.default_config_path())
+    if out_path is None:
+        out_path = config.out_path + "Aumentado/"
+
+    cases = load_base_cases(config, workers)
+    if len(cases) == 0:
+        df_lib.err_control.eprint("Nenhum caso lido para o aumento de dados")
+        return None
+
+    sensor_std = {name: std * sensor_scale for name, std in default_sensor_std.items()}
+    augmenter = TrajectoryAugmenter(config.flag_lateral, position_std, heading_std, decay, sensor_std, target_std, mirror_prob, seed)
+    metadata = {"cases": [case.key for case in cases], "variants": variants, "seed": seed, "position_std": position_std,
+                "heading_std": heading_std, "decay": decay, "sensor_std": sensor_std, "target_std": target_std,
+                "mirror_prob": mirror_prob}
+
+    start = time.perf_counter()
+    rows, paths = write_chunks(augment_cases(cases, augmenter, variants, chunk_rows), out_path, metadata)
+    seconds = time.perf_counter() - start
+
+    print("Casos: " + str(len(cases)) + ", variantes por caso: " + str(variants))
+    print("Amostras geradas: " + str(rows) + " em " + str(len(paths)) + " arquivos (%.1f s, %.2f milhoes de amostras por minuto)" %
+          (seconds, rows / seconds * 60 / 1e6 if seconds > 0 else 0))
+    print("Arquivos salvos em " + out_path)
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera variantes das manobras originais para aumento dos dados de treinamento")
+    parser.add_argument("--config", default=None, help="arquivo yaml com a configuracao dos casos (padrao: dataset.yaml ao lado do script)")
+    parser.add_argument("--variants", type=int, default=100, help="quantidade de variantes por caso")
+    parser.add_argument("--out", default=None, help="diretorio de saida dos arquivos .npz (padrao: Aumentado/ em out_path)")
+    parser.add_argument("--chunk-rows", type=int, default=1000000, help="quantidade aproximada de linhas por arquivo")
+    parser.add_argument("--seed", type=int, default=None, help="semente do gerador aleatorio")
+    parser.add_argument("--workers", type=int, default=None, help="quantidade de processos na leitura dos casos (1 para execucao sequencial)")
+    parser.add_argument("--position-std", type=float, default=5.0, help="desvio padrao da posicao inicial (m)")
+    parser.add_argument("--heading-std", type=float, default=2.0, help="desvio padrao do aproamento inicial (graus)")
+    parser.add_argument("--decay", type=float, default=120.0, help="constante de tempo do decaimento dos desvios iniciais (s)")
+    parser.add_argument("--target-std", type=float, default=25.0, help="desvio padrao do deslocamento do target (m)")
+    parser.add_argument("--mirror", type=float, default=0.5, help="probabilidade de espelhar a manobra em relacao a linha central")
+    parser.add_argument("--sensor-scale", type=float, default=1.0, help="fator aplicado ao desvio padrao do ruido dos sensores (0 sem ruido)")
+    args = parser.parse_args()
+    main(args.config, args.variants, args.out, args.chunk_rows, args.seed, args.workers, args.position_std, args.heading_std,
+         args.decay, args.target_std, args.mirror, args.sensor_scale)
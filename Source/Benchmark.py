@@ -0,0 +1,258 @@
+'''
+Codigo para medicao do desempenho de cada etapa do processamento de Data_Filter.py
+Uso: python Benchmark.py [--sizes 10000 100000 1000000] [--outputs] [--save atual.json] [--compare base.json]
+'''
+
+'''
+Importacao das bibliotecas a serem utilizadas
+'''
+import pandas as pd
+import numpy as np
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import Data_Filter as df_lib
+
+
+'''
+Variaveis globais
+'''
+# Canal de Suape_2017/RT e embarcacao Suezmax usados nas trajetorias sinteticas
+bench_buoys = [df_lib.Point(11722.4553, 5583.4462), df_lib.Point(11771.3626, 5379.2566), df_lib.Point(9189.9177, 4969.4907),
+               df_lib.Point(9237.9939, 4765.5281), df_lib.Point(6895.1451, 4417.3749), df_lib.Point(6954.9285, 4225.9083),
+               df_lib.Point(5540.617, 4088.186), df_lib.Point(5809.4056, 3767.7633)]
+bench_target = df_lib.Point(5790.0505, 3944.9947)
+bench_dim = [50.0, 25.0, 274.0]
+bench_velocity = [0, 28.77, 32.88, 57.54, 65.76]
+bench_columns = ["time_stamp", "x", "y", "zz", "vx", "vy", "vzz", "rudder_demanded_orientation_0", "propeller_demanded_rpm_0"]
+
+
+'''
+Metodos de geracao dos dados
+'''
+# Trajetoria sintetica de entrada no canal com a mesma estrutura dos logs do simulador
+# Entrada:
+#   rows: quantidade de amostras
+#   extra: quantidade de colunas nao utilizadas no log (os logs reais possuem dezenas)
+#   seed: semente do gerador aleatorio
+# Saida:
+#   DataFrame com as colunas do log
+def synthetic_trajectory(rows, extra=20, seed=0):
+    rng = np.random.default_rng(seed)
+    s = np.linspace(0, 1, rows)
+    mid_x = np.array([(bench_buoys[i].x + bench_buoys[i + 1].x) / 2 for i in range(0, len(bench_buoys), 2)])
+    mid_y = np.array([(bench_buoys[i].y + bench_buoys[i + 1].y) / 2 for i in range(0, len(bench_buoys), 2)])
+    x = mid_x[0] - 150 - s * (mid_x[0] - 150 - bench_target.x - 50)
+    y = np.interp(-x, -mid_x, mid_y) + 20 * np.sin(s * 20) + rng.normal(0, 1, rows)
+    zz = -165 + 5 * np.sin(s * 7)
+    zz = np.where(rng.uniform(size=rows) < 0.01, zz + 360, zz)  # Angulos positivos tambem aparecem nos logs
+    cols = {"time_stamp": 300 + np.arange(rows) * 0.1, "x": x, "y": y, "zz": zz,
+            "vx": 4 + 0.5 * np.sin(s * 3), "vy": 0.2 * np.sin(s * 11), "vzz": 0.05 * np.cos(s * 5),
+            "rudder_demanded_orientation_0": np.round(0.3 * np.sin(s * 13), 2),
+            "propeller_demanded_rpm_0": np.where(s < 0.3, 57.54, np.where(s < 0.8, 32.88, 0.0)) + rng.normal(0, 0.5, rows)}
+    for i in range(extra):
+        cols["extra_" + str(i)] = rng.normal(size=rows)
+    return pd.DataFrame(cols)
+
+
+# Escrita da trajetoria no formato dos logs do simulador (duas linhas de cabecalho e colunas separadas por espaco)
+# Entrada:
+#   path: caminho do arquivo
+#   df: DataFrame com as colunas do log
+# Saida:
+#   None
+def write_log(path, df):
+    with open(path, "w") as f:
+        f.write("Benchmark\nTrajetoria sintetica\n")
+        df.to_csv(f, sep=" ", index=False, float_format="%.4f")
+
+
+'''
+Metodos de medicao
+'''
+# Medicao do tempo de uma etapa (melhor de varias repeticoes) e do pico de memoria alocada (tracemalloc, em uma execucao separada)
+# Entrada:
+#   func: funcao sem argumentos da etapa
+#   repeat: quantidade de repeticoes para o tempo
+# Saida:
+#   seconds: menor tempo de execucao
+#   peak: pico de memoria alocada em bytes
+#   result: retorno da funcao
+def measure(func, repeat):
+    seconds = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        seconds = min(seconds, time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return seconds, peak, result
+
+
+# Etapas do processamento de um caso sobre um log sintetico
+# Entrada:
+#   rows: quantidade de amostras
+#   tmp_dir: diretorio para os arquivos temporarios
+#   repeat: quantidade de repeticoes de cada etapa
+# Saida:
+#   Lista de dicionarios com o resultado de cada etapa
+def bench_synthetic(rows, tmp_dir, repeat):
+    path_log = os.path.join(tmp_dir, "smh_bench.txt")
+    write_log(path_log, synthetic_trajectory(rows))
+
+    channel = df_lib.Channel(bench_buoys)
+    ship = df_lib.Ship("Suezmax", bench_dim, df_lib.Velocity(*bench_velocity))
+    results = []
+
+    def record(stage, func, n=rows):
+        seconds, peak, result = measure(func, repeat)
+        results.append({"source": "synthetic", "rows": rows, "stage": stage, "seconds": seconds,
+                        "rows_per_second": n / seconds if seconds > 0 else float("inf"), "peak_mb": peak / 2 ** 20})
+        return result
+
+    df = record("ingest", lambda: df_lib.read_simulation_log(path_log, bench_columns))
+    df = record("filter", lambda: df_lib.filter_trajectory(df, bench_buoys, bench_target, ship))
+    x, y, zz = df["x"].values, df["y"].values, df["zz"].values
+    n = len(df)
+    dml, dtg = record("dist_midline", lambda: ship.calc_dist_midline_array(x, y, zz, channel, bench_target), n)
+    record("dist_lateral", lambda: ship.calc_dist_lateral_array(x, y, zz, channel, bench_target), n)
+    polyline = df_lib.PolylineChannel(bench_buoys)
+    record("dist_polyline", lambda: ship.calc_dist_midline_array(x, y, zz, polyline, bench_target), n)
+    cog, sog, local_cog = record("cog_sog", lambda: ship.calc_cog_sog_array(x, y, zz, channel, df["vx"].values, df["vy"].values), n)
+    level = record("discretize", lambda: ship.corresp_vel_array(ship.discrete_level_array(df["propeller_demanded_rpm_0"].values)), n)
+
+    out = df.drop(columns=["x", "y"])
+    out["distance_midline"], out["distance_target"] = dml, dtg
+    out["cog"], out["sog"], out["local_cog"] = cog, sog, local_cog
+    out["propeller_demanded_rpm_0"] = level
+    out = out.round({"distance_midline": 3, "distance_target": 3, "cog": 3, "sog": 3, "local_cog": 3})
+    record("plot", lambda: bench_plots(out, tmp_dir), n)
+    record("write", lambda: out.to_csv(os.path.join(tmp_dir, "train_bench.txt"), index=False, sep=" "), n)
+    return results
+
+
+# Etapas de leitura, graficos e escrita sobre os arquivos de treinamento ja gerados
+# Entrada:
+#   path: diretorio com os arquivos de treinamento (ex.: ../Output/Compilado/)
+#   tmp_dir: diretorio para os arquivos temporarios
+#   repeat: quantidade de repeticoes de cada etapa
+# Saida:
+#   Lista de dicionarios com o resultado de cada etapa
+def bench_outputs(path, tmp_dir, repeat):
+    files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith(".txt"))
+    frames = [df_lib.read_training_file(f) for f in files]
+    rows = sum(len(df) for df in frames)
+    results = []
+
+    def record(stage, func):
+        seconds, peak, result = measure(func, repeat)
+        results.append({"source": "outputs", "rows": rows, "stage": stage, "seconds": seconds,
+                        "rows_per_second": rows / seconds if seconds > 0 else float("inf"), "peak_mb": peak / 2 ** 20})
+
+    record("ingest", lambda: [df_lib.read_training_file(f) for f in files])
+    record("plot", lambda: [bench_plots(df, tmp_dir) for df in frames])
+    record("write", lambda: [df.to_csv(os.path.join(tmp_dir, "train_bench.txt"), index=False, sep=" ") for df in frames])
+    return results
+
+
+# Graficos de um caso com as mesmas series de process_case
+# Entrada:
+#   df: DataFrame com os dados de treinamento
+#   tmp_dir: diretorio para as imagens
+# Saida:
+#   None
+def bench_plots(df, tmp_dir):
+    plots = []
+    for col in df.columns[1:]:
+        x, y = df_lib.PlotRenderer.downsample(df["time_stamp"].values, df[col].values)
+        plots.append((os.path.join(tmp_dir, "bench.png"), x, y, "Tempo(s)", col, col))
+    df_lib.render_plots(plots)
+
+
+'''
+Metodos de relatorio
+'''
+# Impressao dos resultados em tabela
+# Entrada:
+#   results: lista de resultados das etapas
+# Saida:
+#   None
+def print_results(results):
+    print("%-10s %10s %-13s %12s %16s %10s" % ("origem", "linhas", "etapa", "tempo(s)", "linhas/s", "pico(MB)"))
+    for r in results:
+        print("%-10s %10d %-13s %12.5f %16.0f %10.1f" % (r["source"], r["rows"], r["stage"], r["seconds"], r["rows_per_second"], r["peak_mb"]))
+
+
+# Comparacao com uma execucao anterior salva em json
+# Entrada:
+#   results: lista de resultados das etapas
+#   path: caminho do json da execucao de referencia
+#   threshold: aumento relativo de tempo considerado regressao (0.1 = 10%)
+# Saida:
+#   Quantidade de etapas com regressao
+def compare_results(results, path, threshold):
+    with open(path) as f:
+        reference = {(r["source"], r["rows"], r["stage"]): r for r in json.load(f)["results"]}
+    regressions = 0
+    print("\nComparacao com " + path + ":")
+    print("%-10s %10s %-13s %12s %12s %9s" % ("origem", "linhas", "etapa", "ref(s)", "atual(s)", "razao"))
+    for r in results:
+        ref = reference.get((r["source"], r["rows"], r["stage"]))
+        if ref is None:
+            continue
+        ratio = r["seconds"] / ref["seconds"] if ref["seconds"] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  *** REGRESSAO ***"
+            regressions = regressions + 1
+        print("%-10s %10d %-13s %12.5f %12.5f %9.2f%s" % (r["source"], r["rows"], r["stage"], ref["seconds"], r["seconds"], ratio, flag))
+    return regressions
+
+
+'''
+Metodo principal
+'''
+def main(sizes, outputs=None, repeat=3, save=None, compare=None, threshold=0.1):
+    df_lib.err_control = df_lib.ErrorPrint()
+    tmp_dir = tempfile.mkdtemp(prefix="bench_data_filter_")
+    try:
+        results = []
+        for rows in sizes:
+            results.extend(bench_synthetic(rows, tmp_dir, repeat))
+        if outputs is not None:
+            results.extend(bench_outputs(outputs, tmp_dir, repeat))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    print_results(results)
+    if save is not None:
+        env = {"python": platform.python_version(), "numpy": np.__version__, "pandas": pd.__version__,
+               "machine": platform.machine(), "system": platform.system()}
+        with open(save, "w") as f:
+            json.dump({"environment": env, "repeat": repeat, "results": results}, f, indent=4)
+    regressions = 0
+    if compare is not None:
+        regressions = compare_results(results, compare, threshold)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mede o tempo e a memoria de cada etapa do processamento de Data_Filter.py")
+    parser.add_argument("--sizes", type=int, nargs="*", default=[10 ** 4, 10 ** 5, 10 ** 6],
+                        help="quantidade de amostras das trajetorias sinteticas (ate 10^7)")
+    parser.add_argument("--outputs", nargs="?", const="../Output/Compilado/", default=None,
+                        help="mede tambem a leitura, graficos e escrita dos arquivos de treinamento ja gerados")
+    parser.add_argument("--repeat", type=int, default=3, help="repeticoes de cada etapa (usa o menor tempo)")
+    parser.add_argument("--save", default=None, help="salva os resultados em json")
+    parser.add_argument("--compare", default=None, help="json de uma execucao anterior para comparacao")
+    parser.add_argument("--threshold", type=float, default=0.1, help="aumento relativo de tempo considerado regressao")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.sizes, args.outputs, args.repeat, args.save, args.compare, args.threshold) > 0 else 0)
@@ -7,52 +7,158 @@ Codigo para gerar os arquivos de treinamento da rede neural de controle de embar
 Importacao das bibliotecas a serem utilizadas
 '''
 import pandas as pd
+import numpy as np
 import math as m
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import re
+import time
+import contextlib
+import cProfile
+import pstats
+import tracemalloc
+import bisect
 import os
+import argparse
+import hashlib
+import json
+import pickle
+import yaml
+import struct
+import zipfile
+import copy
+import locale
+import queue
+import socket
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 '''
 Variaveis globais
 '''
 err_control = None  # Contagem de erros na execucao
+fingerprint_version = 3  # Versao da assinatura dos casos: alterar invalida o manifesto e os intermediarios guardados
 
 
 '''
 Classe para suporte de arquivos .p3d
 '''
 class P3D_file:
+    # Cache das dimensoes ja extraidas, compartilhado por todos os arquivos do processo
+    memory_cache = {}  # Chave: caminho|mtime|tamanho do arquivo
+
+    # Padroes das dimensoes da embarcacao dentro do bloco VESSEL, na ordem em que aparecem
+    dim_patterns = [re.compile(r"BEAM = (\d+.\d+)"), re.compile(r"HEIGHT = (\d+.\d+)"), re.compile(r"LENGTH = (\d+.\d+)")]
+
     # Construtor da classe
     # Entrada:
     #   path: string com o diretorio do arquivo p3d/nome do arquivo.p3d
+    #   cache_path: pasta do cache em disco das dimensoes, um arquivo json por p3d (None para usar apenas o cache em memoria)
     # Saida:
     #   None
-    def __init__(self, path):
+    def __init__(self, path, cache_path=None):
         self.path = path
+        self.cache_path = cache_path
 
     # Metodo para extracao das dimensoes da embarcao do arquivo
     # Entrada:
-    #   None
+    #   control: objeto ErrorPrint que recebe os erros (None para o controle global)
     # Saida:
     #   beam: largura da embarcacao
     #   height: altura da embarcacao
     #   length: comprimento da embarcacao
-    def find_dimensions(self):
+    def find_dimensions(self, control=None):
         global err_control
+        if control is None:
+            control = err_control
+
+        # Consulta o cache pela identificacao do arquivo
+        stat = os.stat(self.path)
+        key = os.path.abspath(self.path) + "|" + str(stat.st_mtime_ns) + "|" + str(stat.st_size)
+        dim = P3D_file.memory_cache.get(key)
+        if dim is None:
+            dim = self._read_disk_cache(key)
+
+        if dim is None:
+            dim = self._parse_dimensions()
+            if dim is None:  # Padrao nao encontrado
+                control.eprint("Dimensoes da embarcacao nao encontradas")
+                return [-1, -1, -1]
+            P3D_file.memory_cache[key] = dim
+            self._write_disk_cache(key, dim)
+
+        beam, height, length = dim
+        return beam, height, length
+
+    # Metodo para leitura linha a linha do bloco VESSEL ate encontrar BEAM, HEIGHT e LENGTH
+    # Entrada:
+    #   None
+    # Saida:
+    #   Lista [beam, height, length] ou None se o padrao nao for encontrado
+    def _parse_dimensions(self):
+        dim = []
+        in_vessel = False
+        with open(self.path, encoding="latin-1") as p3d_file:
+            for line in p3d_file:
+                if not in_vessel:
+                    pos = line.find("VESSEL")
+                    if pos < 0:
+                        continue
+                    in_vessel = True
+                    line = line[pos + len("VESSEL"):]
+                # Procura as dimensoes na ordem, podendo haver mais de uma na mesma linha
+                while len(dim) < 3:
+                    match = P3D_file.dim_patterns[len(dim)].search(line)
+                    if match is None:
+                        break
+                    dim.append(float(match.group(1)))
+                    line = line[match.end():]
+                if len(dim) == 3:
+                    return dim
+        return None
+
+    # Metodo para o arquivo de cache em disco de um p3d
+    # Entrada:
+    #   key: identificacao do arquivo p3d
+    # Saida:
+    #   String com o caminho do arquivo de cache
+    def _disk_cache_file(self, key):
+        return os.path.join(self.cache_path, hashlib.sha1(key.encode()).hexdigest() + ".json")
 
-        # Uso de regex para padrao dos parametros da embarcacao no arquivo p3d
-        regex = re.compile("VESSEL[\s\S\n]*?(?<=BEAM = )(\d+.\d+)[\s\S\n]*?(?<=HEIGHT = )(\d+.\d+)[\s\S\n]*?(?<=LENGTH = )(\d+.\d+)")
-        p3d_file = open(self.path)
-        dim = regex.findall(p3d_file.read())
-
-        if len(dim[0]) != 3:  # Padrao de regex nao encontrado
-            err_control.eprint("Dimensoes da embarcacao nao encontradas")
-            return [-1, -1, -1]
-        else:  # Separacao dos dados encontrados
-            beam = float(dim[0][0])
-            height = float(dim[0][1])
-            length = float(dim[0][2])
-            return beam, height, length
+    # Metodo para leitura do cache em disco
+    # Entrada:
+    #   key: identificacao do arquivo p3d
+    # Saida:
+    #   Lista [beam, height, length] ou None se nao houver cache valido
+    def _read_disk_cache(self, key):
+        if self.cache_path is None:
+            return None
+        try:
+            with open(self._disk_cache_file(key)) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cache.get("key") != key:
+            return None
+        P3D_file.memory_cache[key] = cache["dim"]
+        return cache["dim"]
+
+    # Metodo para gravacao do cache em disco de um p3d
+    # Obs.: um arquivo por p3d com substituicao atomica, sem perda de entradas entre processos em paralelo
+    # Entrada:
+    #   key: identificacao do arquivo p3d
+    #   dim: lista [beam, height, length]
+    # Saida:
+    #   None
+    def _write_disk_cache(self, key, dim):
+        if self.cache_path is None:
+            return
+        os.makedirs(self.cache_path, exist_ok=True)
+        path = self._disk_cache_file(key)
+        tmp_path = path + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key": key, "dim": dim}, f, indent=4)
+        os.replace(tmp_path, path)
 
 
 '''
@@ -72,10 +178,279 @@ class Point:
         self.angle = m.degrees(m.atan2(y, x))
 
 
+'''
+Classe para geometria pre-calculada de um canal de acesso definido por pares de boias
+'''
+class Channel:
+    # Construtor da classe
+    # Entrada:
+    #   buoys: vetor com as posicoes das boias aos pares, da entrada para a saida do canal
+    # Saida:
+    #   None
+    def __init__(self, buoys):
+        global err_control
+        self.buoys = buoys
+        self.num_pairs = len(buoys) // 2
+        bx = np.array([b.x for b in buoys], dtype=float)
+        by = np.array([b.y for b in buoys], dtype=float)
+
+        # Pontos medios de cada par de boias e limites das secoes em x
+        self.mid_x = (bx[0::2] + bx[1::2]) / 2
+        self.mid_y = (by[0::2] + by[1::2]) / 2
+        if np.any(np.diff(self.mid_x) >= 0):
+            err_control.eprint("Limites das secoes do canal fora de ordem")
+        self.sorted_limits = self.mid_x[::-1]  # Ordem crescente para busca binaria
+
+        # Segmentos da linha central de cada secao (par k ate par k + 1)
+        x1, y1 = self.mid_x[:-1], self.mid_y[:-1]
+        x2, y2 = self.mid_x[1:], self.mid_y[1:]
+        self.seg_angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+        self.line_angle = np.degrees(np.arctan((y2 - y1) / (x2 - x1))) - 180
+
+        # Normais das linhas de cada secao: central, margem a boreste (boias pares) e margem a bombordo (boias impares)
+        self.mid_normal = self._line_normal(x1, y1, x2, y2, 1)
+        self.star_normal = self._line_normal(bx[0:-2:2], by[0:-2:2], bx[2::2], by[2::2], -1)
+        self.port_normal = self._line_normal(bx[1:-2:2], by[1:-2:2], bx[3::2], by[3::2], 1)
+
+    # Metodo para definicao da secao do canal de um vetor de posicoes por busca binaria
+    # Entrada:
+    #   x: vetor com as coordenadas x dos pontos
+    #   y: vetor com as coordenadas y dos pontos (nao utilizado, canal monotono em x)
+    # Saida:
+    #   Vetor com o indice da secao de cada ponto (0 na entrada ate num_pairs - 2 no target)
+    def section_array(self, x, y=None):
+        passed = self.num_pairs - np.searchsorted(self.sorted_limits, x, side="right")  # Quantidade de limites com x menor
+        return np.where(passed == 0, 0, np.minimum(passed - 1, self.num_pairs - 2))  # Desconsidera se passa do target
+
+    # Metodo para definicao da direcao da embarcacao em relacao a linha media
+    # Entrada:
+    #   section: vetor com a secao do canal da embarcacao
+    #   angle: vetor com os angulos de aproamento em graus
+    # Saida:
+    #   Vetor com -1 para bombordo, 0 na mesma direcao e 1 para estibordo
+    def direction_array(self, section, angle):
+        return np.sign(self.line_angle[section] - angle).astype(int)
+
+    # Metodos para distancia com sinal ate a linha central e as margens de cada secao
+    # Entrada:
+    #   section: vetor com a secao do canal de cada ponto
+    #   x: vetor com as coordenadas x dos pontos
+    #   y: vetor com as coordenadas y dos pontos
+    # Saida:
+    #   Vetor de distancias, negativas quando o ponto passou da linha
+    def dist_midline_array(self, section, x, y):
+        return self._dist_normal(self.mid_normal, section, x, y)
+
+    def dist_starboard_array(self, section, x, y):
+        return self._dist_normal(self.star_normal, section, x, y)
+
+    def dist_port_array(self, section, x, y):
+        return self._dist_normal(self.port_normal, section, x, y)
+
+    # Metodo para calculo da normal unitaria de linhas definidas por dois pontos
+    # Entrada:
+    #   x1, y1: coordenadas do primeiro ponto das linhas
+    #   x2, y2: coordenadas do segundo ponto das linhas
+    #   type: -1 para relacao estibordo e 1 para relacao bombordo (mesma convencao de Ship._dist_line_point)
+    # Saida:
+    #   Coeficientes (a, b, c) tal que a distancia com sinal e a * x + b * y + c
+    def _line_normal(self, x1, y1, x2, y2, type):
+        y_diff = y2 - y1
+        x_diff = x2 - x1
+        scale = -type * np.sign(x_diff) / np.sqrt(y_diff ** 2 + x_diff ** 2)
+        return y_diff * scale, -x_diff * scale, (x2 * y1 - y2 * x1) * scale
+
+    # Metodo para aplicacao das normais de cada secao
+    # Entrada:
+    #   normal: coeficientes (a, b, c) das linhas de cada secao
+    #   section: vetor com a secao do canal de cada ponto
+    #   x: vetor com as coordenadas x dos pontos
+    #   y: vetor com as coordenadas y dos pontos
+    # Saida:
+    #   Vetor de distancias com sinal
+    def _dist_normal(self, normal, section, x, y):
+        a, b, c = normal
+        return a[section] * x + b[section] * y + c[section]
+
+
+'''
+Classe para suporte de canais com boias em qualquer orientacao (poligonal arbitraria), com indice espacial em grade
+'''
+class PolylineChannel(Channel):
+    # Construtor da classe
+    # Entrada:
+    #   buoys: vetor com as posicoes das boias aos pares (boreste, bombordo), da entrada para a saida do canal
+    #   cell_size: lado das celulas da grade em metros (None para a maior largura do canal)
+    # Saida:
+    #   None
+    def __init__(self, buoys, cell_size=None):
+        self.buoys = buoys
+        self.num_pairs = len(buoys) // 2
+        bx = np.array([b.x for b in buoys], dtype=float)
+        by = np.array([b.y for b in buoys], dtype=float)
+
+        # Pontos medios de cada par de boias e segmentos da linha central de cada secao (par k ate par k + 1)
+        self.mid_x = (bx[0::2] + bx[1::2]) / 2
+        self.mid_y = (by[0::2] + by[1::2]) / 2
+        x1, y1 = self.mid_x[:-1], self.mid_y[:-1]
+        x2, y2 = self.mid_x[1:], self.mid_y[1:]
+        self.seg_angle = np.degrees(np.arctan2(y2 - y1, x2 - x1))
+        self.line_angle = self.seg_angle  # Direcao de navegacao de cada secao
+
+        # Normais com sinal em relacao ao sentido de navegacao (nao depende da orientacao em x)
+        self.mid_normal = self._line_normal(x1, y1, x2, y2, 1)
+        self.star_normal = self._line_normal(bx[0:-2:2], by[0:-2:2], bx[2::2], by[2::2], -1)
+        self.port_normal = self._line_normal(bx[1:-2:2], by[1:-2:2], bx[3::2], by[3::2], 1)
+
+        # Segmentos da linha central para a busca da secao mais proxima
+        self._x1, self._y1 = x1, y1
+        self._dx, self._dy = x2 - x1, y2 - y1
+        self._len2 = np.maximum(self._dx ** 2 + self._dy ** 2, 1e-12)
+        self._seg_list = list(zip(x1.tolist(), y1.tolist(), self._dx.tolist(), self._dy.tolist(), self._len2.tolist()))
+
+        # Raio de busca: pontos mais proximos que a maior largura do canal sao resolvidos pela grade
+        self.margin = float(np.max(np.hypot(bx[0::2] - bx[1::2], by[0::2] - by[1::2])))
+        self._build_grid(self.margin if cell_size is None else cell_size)
+
+    # Metodo para definicao da secao do canal de um vetor de posicoes (segmento mais proximo da linha central)
+    # Entrada:
+    #   x: vetor com as coordenadas x dos pontos
+    #   y: vetor com as coordenadas y dos pontos
+    # Saida:
+    #   Vetor com o indice da secao de cada ponto (0 na entrada ate num_pairs - 2 no target)
+    def section_array(self, x, y=None):
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        n = len(x)
+
+        # Segmentos candidatos da celula de cada ponto
+        cx = np.floor((x - self._grid_x0) / self._cell).astype(np.int64)
+        cy = np.floor((y - self._grid_y0) / self._cell).astype(np.int64)
+        valid = (cx >= 0) & (cx < self._nx) & (cy >= 0) & (cy < self._ny)
+        cell = np.where(valid, cy * self._nx + cx, 0)
+        start = self._cell_start[cell]
+        count = np.where(valid, self._cell_start[cell + 1] - start, 0)
+        pidx = np.repeat(np.arange(n), count)
+        offset = np.arange(len(pidx)) - np.repeat(np.cumsum(count) - count, count)
+        seg = self._cell_seg[np.repeat(start, count) + offset]
+        d2 = self._seg_dist2(seg, x[pidx], y[pidx])
+
+        # Menor distancia por ponto, candidatos contiguos por ponto (empate resolvido pela secao anterior)
+        best_seg = np.zeros(n, dtype=np.int64)
+        best_d2 = np.full(n, np.inf)
+        if len(pidx) > 0:
+            has = np.flatnonzero(count > 0)
+            group_min = np.minimum.reduceat(d2, (np.cumsum(count) - count)[has])
+            best_d2[has] = group_min
+            hit = np.flatnonzero(d2 == best_d2[pidx])
+            first = hit[np.r_[True, pidx[hit][1:] != pidx[hit][:-1]]]
+            best_seg[pidx[first]] = seg[first]
+
+        # Pontos fora do raio de busca (ex.: antes da entrada do canal) usam todos os segmentos
+        miss = np.flatnonzero(best_d2 > self.margin ** 2)
+        segs = np.arange(len(self._len2))
+        for i in range(0, len(miss), 4096):
+            block = miss[i:i + 4096]
+            d2 = self._seg_dist2(segs[None, :], x[block, None], y[block, None])
+            best_seg[block] = np.argmin(d2, axis=1)
+        return best_seg
+
+    # Metodo para definicao da secao de um ponto a partir da secao anterior (cursor para processamento amostra a amostra)
+    # Entrada:
+    #   x, y: coordenadas do ponto
+    #   hint: secao do ponto anterior
+    # Saida:
+    #   Secao do canal do ponto
+    def section_point(self, x, y, hint):
+        last = len(self._seg_list) - 1
+        section = min(max(hint, 0), last)
+        dist = self._seg_dist2_point(section, x, y)
+        # Trajetoria continua: desce para o segmento vizinho mais proximo ate o minimo local
+        while True:
+            prev_dist = self._seg_dist2_point(section - 1, x, y) if section > 0 else m.inf
+            next_dist = self._seg_dist2_point(section + 1, x, y) if section < last else m.inf
+            if prev_dist <= dist:  # Empate resolvido pela secao anterior, como em section_array
+                section, dist = section - 1, prev_dist
+            elif next_dist < dist:
+                section, dist = section + 1, next_dist
+            else:
+                break
+        if dist > self.margin ** 2:  # Longe do canal: minimo local pode nao ser o global
+            return int(self.section_array([x], [y])[0])
+        return section
+
+    # Metodo para definicao da direcao da embarcacao em relacao a linha media
+    # Entrada:
+    #   section: vetor com a secao do canal da embarcacao
+    #   angle: vetor com os angulos de aproamento em graus
+    # Saida:
+    #   Vetor com -1 para bombordo, 0 na mesma direcao e 1 para estibordo
+    def direction_array(self, section, angle):
+        return np.sign((self.line_angle[section] - angle + 180) % 360 - 180).astype(int)
+
+    # Metodo para calculo da normal unitaria de linhas definidas por dois pontos, com sinal pelo sentido de navegacao
+    # Entrada:
+    #   x1, y1: coordenadas do primeiro ponto das linhas
+    #   x2, y2: coordenadas do segundo ponto das linhas
+    #   type: -1 para relacao estibordo e 1 para relacao bombordo
+    # Saida:
+    #   Coeficientes (a, b, c) tal que a distancia com sinal e a * x + b * y + c
+    def _line_normal(self, x1, y1, x2, y2, type):
+        y_diff = y2 - y1
+        x_diff = x2 - x1
+        scale = type / np.sqrt(y_diff ** 2 + x_diff ** 2)
+        return y_diff * scale, -x_diff * scale, (x2 * y1 - y2 * x1) * scale
+
+    # Metodo para construcao da grade: cada celula guarda os segmentos a menos de um raio de busca
+    # Entrada:
+    #   cell: lado das celulas em metros
+    # Saida:
+    #   None
+    def _build_grid(self, cell):
+        x2, y2 = self._x1 + self._dx, self._y1 + self._dy
+        xmin = np.minimum(self._x1, x2) - self.margin
+        xmax = np.maximum(self._x1, x2) + self.margin
+        ymin = np.minimum(self._y1, y2) - self.margin
+        ymax = np.maximum(self._y1, y2) + self.margin
+        self._cell = float(cell)
+        self._grid_x0, self._grid_y0 = xmin.min(), ymin.min()
+        self._nx = int(np.floor((xmax.max() - self._grid_x0) / cell)) + 1
+        self._ny = int(np.floor((ymax.max() - self._grid_y0) / cell)) + 1
+
+        cells = [[] for _ in range(self._nx * self._ny)]
+        for k in range(len(self._len2)):
+            ix0, ix1 = int((xmin[k] - self._grid_x0) // cell), int((xmax[k] - self._grid_x0) // cell)
+            iy0, iy1 = int((ymin[k] - self._grid_y0) // cell), int((ymax[k] - self._grid_y0) // cell)
+            for iy in range(iy0, iy1 + 1):
+                for ix in range(ix0, ix1 + 1):
+                    cells[iy * self._nx + ix].append(k)
+        self._cell_start = np.cumsum([0] + [len(c) for c in cells]).astype(np.int64)
+        self._cell_seg = np.array([k for c in cells for k in c], dtype=np.int64)
+
+    # Metodo para distancia ao quadrado entre pontos e segmentos da linha central
+    # Entrada:
+    #   seg: vetor com o indice dos segmentos
+    #   px, py: vetores com as coordenadas dos pontos
+    # Saida:
+    #   Vetor com as distancias ao quadrado
+    def _seg_dist2(self, seg, px, py):
+        x1, y1, dx, dy = self._x1[seg], self._y1[seg], self._dx[seg], self._dy[seg]
+        t = np.clip(((px - x1) * dx + (py - y1) * dy) / self._len2[seg], 0, 1)
+        return (px - x1 - t * dx) ** 2 + (py - y1 - t * dy) ** 2
+
+    def _seg_dist2_point(self, seg, px, py):
+        x1, y1, dx, dy, len2 = self._seg_list[seg]
+        t = min(max(((px - x1) * dx + (py - y1) * dy) / len2, 0.0), 1.0)
+        return (px - x1 - t * dx) ** 2 + (py - y1 - t * dy) ** 2
+
+
 '''
 Classe para suporte de velocidades das embarcacoes
 '''
 class Velocity:
+    # Comandos de maquina: 0 parado, 1 muito devagar, 2 devagar, 3 meia forca e 4 toda forca e seus respectivos opostos na outra direcao
+    labels = np.arange(-4, 5)
+
     # Construtor da classe
     # Entrada:
     #   stop: valor em rpm para comando de stop velocity
@@ -101,6 +476,11 @@ class Velocity:
         self.rhalf = rhalf if rhalf != 0 else -half
         self.rfull = rfull if rfull != 0 else -full
 
+        # Limites dos comandos e tabela de rpm por comando (indice = comando + 4) para as operacoes vetorizadas
+        self.bin_edges = np.array(self.discrete_range(), dtype=float)
+        self.rpm_table = np.array([self.rfull, self.rhalf, self.rslow, self.rdead_slow, self.stop,
+                                   self.dead_slow, self.slow, self.half, self.full], dtype=float)
+
     # Metodo para definir os limites das velocidades nos respectivos comandos de maquina
     # Entrada:
     #   None
@@ -150,6 +530,47 @@ class Velocity:
 
         return val
 
+    # Metodo vetorizado para discretizacao das velocidades nos comandos de maquina (intervalos fechados a esquerda)
+    # Entrada:
+    #   values: vetor com as velocidades da embarcacao
+    #   control: objeto ErrorPrint que recebe os erros (None para o controle global)
+    # Saida:
+    #   Vetor com os comandos de maquina entre -4 ate 4 (vetor de float com nan nas amostras sem velocidade)
+    def discrete_level_array(self, values, control=None):
+        global err_control
+        if control is None:
+            control = err_control
+        values = np.asarray(values, dtype=float)
+        missing = np.isnan(values)
+        pos = np.searchsorted(self.bin_edges, values, side="right") - 1
+
+        # Valores fora dos limites sao saturados no comando mais proximo e reportados de uma vez
+        out = ~missing & ((pos < 0) | (pos > len(self.labels) - 1))
+        if np.any(out):
+            control.eprint("Velocidade fora dos limites de discretizacao - " + str(np.count_nonzero(out)) + " amostras")
+        levels = self.labels[np.clip(pos, 0, len(self.labels) - 1)]
+
+        # Amostras sem velocidade reportadas separadamente e mantidas sem comando (nao saturadas em toda forca)
+        if np.any(missing):
+            control.eprint("Velocidade sem valor (nan) - " + str(np.count_nonzero(missing)) + " amostras")
+            levels = levels.astype(float)
+            levels[missing] = np.nan
+        return levels
+
+    # Metodo vetorizado para retornar a velocidade correspondente aos comandos de maquina
+    # Entrada:
+    #   idx: vetor com os comandos de maquina entre -4 ate 4 (nan para amostras sem comando)
+    # Saida:
+    #   Vetor com os valores correspondentes em rpm (nan para amostras sem comando)
+    def discrete_value_array(self, idx):
+        idx = np.asarray(idx)
+        if idx.dtype.kind == "f":
+            missing = np.isnan(idx)
+            values = np.full(idx.shape, np.nan)
+            values[~missing] = self.rpm_table[idx[~missing].astype(int) - self.labels[0]]
+            return values
+        return self.rpm_table[idx - self.labels[0]]
+
 
 '''
 Classe para suporte de embarcacoes
@@ -185,6 +606,18 @@ class Ship:
     def corresp_vel(self, idx):
         return self.velocity.discrete_value(idx)
 
+    # Metodos vetorizados equivalentes a discretizacao por discrete_velocity e a corresp_vel
+    # Entrada:
+    #   values: vetor com as velocidades da embarcacao / idx: vetor com os comandos de maquina
+    #   control: objeto ErrorPrint que recebe os erros (None para o controle global)
+    # Saida:
+    #   Vetor com os comandos de maquina / vetor com os valores correspondentes em rpm
+    def discrete_level_array(self, values, control=None):
+        return self.velocity.discrete_level_array(values, control)
+
+    def corresp_vel_array(self, idx):
+        return self.velocity.discrete_value_array(idx)
+
     # Metodo para calculo de distancias da embarcacao ate as margens e target
     # Entrada:
     #   center: coordenada cartesiana do centro da embarcacao
@@ -297,6 +730,116 @@ class Ship:
 
         return pd.Series([cog, sog, local_cog])
 
+    # Metodo vetorizado para calculo de distancias da embarcacao ate as margens e target (equivalente a calc_dist_lateral)
+    # Entrada:
+    #   x: vetor com as coordenadas x do centro da embarcacao
+    #   y: vetor com as coordenadas y do centro da embarcacao
+    #   angle: vetor com os angulos de aproamento da embarcacao em graus
+    #   channel: objeto Channel com a geometria pre-calculada do canal
+    #   target: coordenada cartesiana do target
+    #   check_heading: False para nao registrar as amostras em direcao de saida (dados sinteticos)
+    # Saida:
+    #   dpb: vetor de distancias a bombordo
+    #   dsb: vetor de distancias a boreste
+    #   dtg: vetor de distancias ao target
+    def calc_dist_lateral_array(self, x, y, angle, channel, target, check_heading=True):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        angle = np.asarray(angle, dtype=float)
+        cos = np.cos(np.radians(angle))
+        sin = np.sin(np.radians(angle))
+
+        # Coordenadas medias frontal e traseira
+        front_x = x + self.length / 2 * cos
+        back_x = x - self.length / 2 * cos
+
+        # Coordenadas dos vertices - considera a embarcacao um retangulo
+        front_sb_x = x + self.length / 2 * cos + self.beam / 2 * sin
+        front_sb_y = y + self.length / 2 * sin - self.beam / 2 * cos
+        front_pb_x = x + self.length / 2 * cos - self.beam / 2 * sin
+        front_pb_y = y + self.length / 2 * sin + self.beam / 2 * cos
+        back_sb_x = x - self.length / 2 * cos + self.beam / 2 * sin
+        back_sb_y = y - self.length / 2 * sin - self.beam / 2 * cos
+        back_pb_x = x - self.length / 2 * cos - self.beam / 2 * sin
+        back_pb_y = y - self.length / 2 * sin + self.beam / 2 * cos
+
+        # Determina em qual secao de boias esta o ponto medio frontal e traseiro
+        section_front = channel.section_array(front_x, y + self.length / 2 * sin)
+        section_back = channel.section_array(back_x, y - self.length / 2 * sin)
+
+        # Determina a direcao da embarcacao em relacao a linha media
+        direction = channel.direction_array(section_front, angle)
+
+        # Virado a bombordo usa o vertice frontal a bombordo, caso contrario o traseiro
+        port = direction == -1
+        sh_pb_x = np.where(port, front_pb_x, back_pb_x)
+        sh_pb_y = np.where(port, front_pb_y, back_pb_y)
+        sh_sb_x = np.where(port, back_sb_x, front_sb_x)
+        sh_sb_y = np.where(port, back_sb_y, front_sb_y)
+        section_pb = np.where(port, section_front, section_back)
+        section_sb = np.where(port, section_back, section_front)
+
+        dsb = channel.dist_starboard_array(section_sb, sh_sb_x, sh_sb_y)  # distancia estibordo
+        dpb = channel.dist_port_array(section_pb, sh_pb_x, sh_pb_y)  # distancia bombordo
+        dtg = np.hypot(x - target.x, y - target.y)  # distancia target
+
+        if check_heading:
+            self._check_heading_array(angle)
+
+        return dpb, dsb, dtg
+
+    # Metodo vetorizado para calculo de distancias da embarcacao ate a linha central e target (equivalente a calc_dist_midline)
+    # Entrada:
+    #   x: vetor com as coordenadas x do centro da embarcacao
+    #   y: vetor com as coordenadas y do centro da embarcacao
+    #   angle: vetor com os angulos de aproamento da embarcacao em graus
+    #   channel: objeto Channel com a geometria pre-calculada do canal
+    #   target: coordenada cartesiana do target
+    #   check_heading: False para nao registrar as amostras em direcao de saida (dados sinteticos)
+    # Saida:
+    #   dml: vetor de distancias a linha central
+    #   dtg: vetor de distancias ao target
+    def calc_dist_midline_array(self, x, y, angle, channel, target, check_heading=True):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        angle = np.asarray(angle, dtype=float)
+
+        # Determina em qual secao de boias esta cada ponto
+        section = channel.section_array(x, y)
+
+        dml = channel.dist_midline_array(section, x, y)  # distancia central
+        dtg = np.hypot(x - target.x, y - target.y)  # distancia target
+
+        if check_heading:
+            self._check_heading_array(angle)
+
+        return dml, dtg
+
+    # Metodo vetorizado para calculo de cog e sog (equivalente a calc_cog_sog)
+    # Entrada:
+    #   x: vetor com as coordenadas x do centro da embarcacao
+    #   y: vetor com as coordenadas y do centro da embarcacao
+    #   angle: vetor com os angulos de aproamento da embarcacao em graus
+    #   channel: objeto Channel com a geometria pre-calculada do canal
+    #   vx: vetor de velocidades surge
+    #   vy: vetor de velocidades sway
+    # Saida:
+    #   cog: vetor de angulos da velocidade total
+    #   sog: vetor de modulos da velocidade total
+    #   local_cog: vetor de cog em relacao a linha central da secao
+    def calc_cog_sog_array(self, x, y, angle, channel, vx, vy):
+        angle = np.asarray(angle, dtype=float)
+        vx = np.asarray(vx, dtype=float)
+        vy = np.asarray(vy, dtype=float)
+
+        section = channel.section_array(x, y)
+
+        cog = angle + np.degrees(np.arctan2(vy, vx))
+        sog = np.hypot(vx, vy)
+        local_cog = channel.seg_angle[section] - cog
+
+        return cog, sog, local_cog
+
     # Metodo para definicao entre quais boias esta a embarcacao
     # Entrada:
     #   point: coordenada cartesiana do ponto a ser verificado
@@ -373,6 +916,172 @@ class Ship:
     def _angle_point_point(self, p1, p2):
         return m.degrees(m.atan2(p2.y - p1.y, p2.x - p1.x))
 
+    # Metodo vetorizado para verificar a direcao de entrada no canal (uma mensagem com a quantidade de amostras)
+    # Entrada:
+    #   angle: vetor com os angulos de aproamento em graus
+    # Saida:
+    #   None
+    def _check_heading_array(self, angle):
+        global err_control
+        heading = np.asarray(angle) % 360
+        # Embarcacao contrario a entrada no canal
+        count = np.count_nonzero(~((heading > 135) & (heading < 315)))
+        if count > 0:
+            err_control.eprint("Direcao da embarcacao em saida - " + str(count) + " amostras")
+
+
+'''
+Classe para calculo das variaveis de treinamento amostra a amostra (simulador em tempo real)
+'''
+class OnlineFeatures:
+    # Construtor da classe
+    # Entrada:
+    #   ship: objeto Ship da embarcacao, com o perfil de velocidade do caso (case_ship para comando oscilatorio)
+    #   channel: objeto Channel com a geometria pre-calculada do canal
+    #   target: coordenada cartesiana do target
+    #   flag_lateral: True para distancias bombordo e boreste, False para distancia a linha central
+    # Saida:
+    #   None
+    def __init__(self, ship, channel, target, flag_lateral=False):
+        self.ship = ship
+        self.channel = channel
+        self.target = target
+        self.flag_lateral = flag_lateral
+
+        # Geometria em listas de float para evitar o custo de escalares numpy a cada amostra
+        self._polyline = isinstance(channel, PolylineChannel)
+        self._limits = channel.mid_x.tolist()
+        self._num_pairs = channel.num_pairs
+        self._seg_angle = channel.seg_angle.tolist()
+        self._line_angle = channel.line_angle.tolist()
+        self._mid_normal = [v.tolist() for v in channel.mid_normal]
+        self._star_normal = [v.tolist() for v in channel.star_normal]
+        self._port_normal = [v.tolist() for v in channel.port_normal]
+        self._edges = ship.velocity.bin_edges.tolist()
+        self._half_length = ship.length / 2
+        self._half_beam = ship.beam / 2
+
+        # Limites do canal, os mesmos de filter_trajectory
+        self._x_ini = channel.buoys[1].x - ship.length / 2
+        self._y_ini = channel.buoys[0].y
+        self._x_end = target.x
+        self._y_end = channel.buoys[len(channel.buoys) - 1].y
+
+        # Colunas na mesma ordem dos arquivos de treinamento
+        if flag_lateral == True:
+            distances = ["distance_port", "distance_starboard", "distance_target"]
+        else:
+            distances = ["distance_midline", "distance_target"]
+        self.names = ["time_stamp", "zz", "vx", "vy", "vzz", "rudder_demanded", "propeller_demanded"] + distances + ["cog", "sog", "local_cog"]
+
+        self.reset()
+
+    # Metodo para reiniciar os cursores de secao (nova manobra)
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def reset(self):
+        self._passed = 0  # Quantidade de pares de boias ja ultrapassados pelo centro da embarcacao
+        self._passed_front = 0
+        self._passed_back = 0
+        self.inside = False  # True se a ultima amostra esta na entrada do canal (amostras mantidas no treinamento)
+
+    # Metodo para calculo das variaveis de uma amostra da telemetria
+    # Entrada:
+    #   time_stamp: instante da amostra
+    #   x, y: coordenadas do centro da embarcacao
+    #   zz: angulo de aproamento em graus
+    #   vx, vy, vzz: velocidades surge, sway e yaw
+    #   rudder: comando de leme
+    #   propeller: comando de maquina (rpm ou kn)
+    # Saida:
+    #   Lista com as variaveis na ordem de names
+    def update(self, time_stamp, x, y, zz, vx, vy, vzz, rudder, propeller):
+        heading = zz % 360
+        self.inside = 135 < heading < 315 and not (x > self._x_ini or y > self._y_ini or x < self._x_end or y < self._y_end)
+        if zz > 0:
+            zz = zz - 360
+
+        self._passed, section = self._advance(self._passed, x, y)
+        if self.flag_lateral == True:
+            distances = self._dist_lateral(x, y, zz)
+        else:
+            a, b, c = self._mid_normal
+            distances = [a[section] * x + b[section] * y + c[section]]
+        distances.append(m.hypot(x - self.target.x, y - self.target.y))
+
+        cog = zz + m.degrees(m.atan2(vy, vx))
+        sog = m.hypot(vx, vy)
+        local_cog = self._seg_angle[section] - cog
+
+        return [time_stamp, zz, vx, vy, vzz, rudder, self._discrete_level(propeller)] + distances + [cog, sog, local_cog]
+
+    # Metodo para atualizacao de um cursor de secao (equivalente a Channel.section_array)
+    # Entrada:
+    #   passed: quantidade de pares de boias ultrapassados na amostra anterior (secao anterior em PolylineChannel)
+    #   x, y: coordenadas do ponto
+    # Saida:
+    #   passed: quantidade de pares de boias ultrapassados (secao em PolylineChannel)
+    #   section: secao do canal do ponto
+    def _advance(self, passed, x, y):
+        if self._polyline:
+            section = self.channel.section_point(x, y, passed)
+            return section, section
+        # Trajetoria continua: o cursor anda no maximo algumas posicoes por amostra
+        while passed < self._num_pairs and self._limits[passed] > x:
+            passed = passed + 1
+        while passed > 0 and self._limits[passed - 1] <= x:
+            passed = passed - 1
+        if passed == 0:
+            return passed, 0
+        return passed, min(passed - 1, self._num_pairs - 2)
+
+    # Metodo para calculo das distancias bombordo e boreste (equivalente a Ship.calc_dist_lateral_array)
+    # Entrada:
+    #   x, y: coordenadas do centro da embarcacao
+    #   zz: angulo de aproamento em graus
+    # Saida:
+    #   Lista com as distancias bombordo e boreste
+    def _dist_lateral(self, x, y, zz):
+        cos = m.cos(m.radians(zz))
+        sin = m.sin(m.radians(zz))
+        lc = self._half_length * cos
+        ls = self._half_length * sin
+        bc = self._half_beam * cos
+        bs = self._half_beam * sin
+
+        self._passed_front, section_front = self._advance(self._passed_front, x + lc, y + ls)
+        self._passed_back, section_back = self._advance(self._passed_back, x - lc, y - ls)
+
+        # Virado a bombordo usa o vertice frontal a bombordo, caso contrario o traseiro
+        diff = self._line_angle[section_front] - zz
+        if self._polyline:
+            diff = (diff + 180) % 360 - 180
+        if diff < 0:
+            pb_x, pb_y, section_pb = x + lc - bs, y + ls + bc, section_front
+            sb_x, sb_y, section_sb = x - lc + bs, y - ls - bc, section_back
+        else:
+            pb_x, pb_y, section_pb = x - lc - bs, y - ls + bc, section_back
+            sb_x, sb_y, section_sb = x + lc + bs, y + ls - bc, section_front
+
+        a, b, c = self._port_normal
+        dpb = a[section_pb] * pb_x + b[section_pb] * pb_y + c[section_pb]
+        a, b, c = self._star_normal
+        dsb = a[section_sb] * sb_x + b[section_sb] * sb_y + c[section_sb]
+        return [dpb, dsb]
+
+    # Metodo para discretizacao do comando de maquina (equivalente a Velocity.discrete_level_array, saturado nos limites)
+    # Entrada:
+    #   value: comando de maquina
+    # Saida:
+    #   Comando de maquina entre -4 ate 4 (nan se o comando nao possui valor)
+    def _discrete_level(self, value):
+        if value != value:
+            return m.nan
+        pos = bisect.bisect_right(self._edges, value) - 1
+        return min(max(pos, 0), len(Velocity.labels) - 1) + int(Velocity.labels[0])
+
 
 '''
 Classe para suporte de controle de erros
@@ -380,12 +1089,15 @@ Classe para suporte de controle de erros
 class ErrorPrint:
     # Construtor da classe
     # Entrada:
-    #   None
+    #   echo: True para imprimir os erros no momento em que ocorrem
     # Saida:
     #   None
-    def __init__(self):
+    def __init__(self, echo=True):
+        self.echo = echo
         self.count_error = 0
         self.global_error = 0
+        self.messages = []
+        self.kinds = {}  # Contagem por tipo de erro (mensagem sem o detalhe apos " - ")
 
     # Padrao de impressao de erro
     # Entrada:
@@ -393,7 +1105,11 @@ class ErrorPrint:
     # Saida:
     #   None
     def eprint(self, text):
-        print("\t\t*** ERRO: " + text + " ***")
+        if self.echo:
+            print("\t\t*** ERRO: " + text + " ***")
+        self.messages.append(text)
+        kind = text.split(" - ", 1)[0]
+        self.kinds[kind] = self.kinds.get(kind, 0) + 1
         self.count_error = self.count_error + 1
         self.global_error = self.global_error + 1
 
@@ -404,6 +1120,8 @@ class ErrorPrint:
     #   None
     def reset(self):
         self.count_error = 0
+        self.messages = []
+        self.kinds = {}
 
     # Contagem de erros do arquivo
     # Entrada:
@@ -421,293 +1139,2300 @@ class ErrorPrint:
     def get_num_global_error(self):
         return self.global_error
 
+    # Mensagens de erro do arquivo
+    # Entrada:
+    #   None
+    # Saida:
+    #   Lista com as mensagens de erro
+    def get_messages(self):
+        return self.messages
+
+    # Contagem por tipo de erro do arquivo
+    # Entrada:
+    #   None
+    # Saida:
+    #   Dicionario com a quantidade de cada tipo de erro
+    def get_kinds(self):
+        return self.kinds
+
 
 '''
-Metodo principal
+Classe para metricas de execucao de um caso: tempo por etapa, contagem de linhas e captura opcional de perfil e memoria
 '''
-def main():
-    # Flag para definir se gera dados por distancia bombordo e boreste ou por linha central
-    flag_lateral = False
-
-    # Intrucoes de uso para novos arquivos
-    # Para adicionar nova pasta do dropbox: adicionar o diretorio dos casos em dt_paths, o nome do arquivo com as informacoes dos casos em dt_cases,
-    # uma lista dos casos a serem testados em dt_num_case e os arquivos de leitura de cada caso em dt_file_dict
-    # Verificar tambem se sera necessario alterar o nome das colunas em param, adicionar velocidades de embarcacoes em ship_velocity e o ponto das boias e do target em list_buoys e list_target
-    dt_root = "C:/Users/AlphaCrucis_Control1/Dropbox/"
-    dt_paths = ["Suape_2017/RT/", "Suape_Aframax/RT/", "Suape_PDZ/FT/Outputs_FT/", "Suape_PDZ/RT/", "Suape_PDZ/RT2/"]
-    dt_cases = ["casos.xlsx", "casos.xlsx", "casos_.xlsx", "casos.xlsx", "casos.xlsx"]
-    dt_pos_path = "Caso"  # Concatenar o numero do caso
-    dt_num_case = [[1, 2, 3, 4, 5, 6, 9, 10, 12, 13, 14, 17, 18, 22, 23, 26, 28],  # Suape_2017/RT
-                   [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16],  # Suape_Aframax/RT
-                   [1, 2, 3, 4],  # Suape_PDZ/FT/Outputs_FT
-                   [1, 2, 3, 4, 5, 9],  # Suape_PDZ/RT
-                   [1, 2]]  # Suape_PDZ/RT2
-    dt_file_dict = [{"Suezmax": "smh_v00004", "Conteneiro": "smh_v00077", "Aframax": "smh_v00036"},  # Caso 28 do Suape_2017 tratado com excecao smh_v00030.txt - Conteneiro
-                    {"Aframax": "smh_v00036", "Suezmax": "smh_v00037"},
-                    {1: "smh_v00004_20170814_102039", 2: "smh_v00004_20170814_103220", 3: "smh_v00004_20170814_114251", 4: "smh_v00004_20170816_175923"},
-                    {1: "smh_v00037_20171009_093846", 2: "smh_v00037_20171009_101104", 3: "smh_v00037_20171009_104723", 4: "smh_v00037_20171009_112202", 5: "smh_v00028_20171009_135920", 9: "smh_v00053_20171010_081234"},
-                    {1: "smh_v00037_20171218_093301", 2: "smh_v00037_20171218_104020"}]
-    dt_file_extension = ".txt"
-    dt_out_path = "../Output/"
-    dt_out_path_compiled = "../Output/Compilado/"
-
-    vel_label = [-4, -3, -2, -1, 0, 1, 2, 3, 4]  # 0 parado, 1 muito devagar, 2 devagar, 3 meia forca e 4 toda forca e seus respectivos opostos na outra direcao
-    param = [["time_stamp", "x", "y", "zz", "vx", "vy", "vzz", "rudder_demanded_orientation_0", "propeller_demanded_rpm_0"],
-             ["time_stamp", "x", "y", "zz", "vx", "vy", "vzz", "rudder_demanded_orientation_0", "propeller_demanded_0"]]
-    simul_data = ["Navio", "Cenário", "Manobra", "Corrente", "Vento", "Onda"]
-    mult_param_data = {"Corrente": 2, "Vento": 2, "Onda": 3}
-    ship_velocity_rpm = {"Aframax": Velocity(0, 19.2, 38.4, 57.6, 76.8),
-                         "Suezmax": Velocity(0, 28.77, 32.88, 57.54, 65.76),
-                         "Suezmax L280B50T17": Velocity(0, 29, 41, 58, 74),
-                         "Conteneiro 336B48": Velocity(0, 31.92, 39.9, 55.86, 63.84),
-                         "Conteneiro L366B51": Velocity(0, 20.4, 40.8, 61.2, 81.6),
-                         "Capesize": Velocity(0, 27.18, 45.3, 63.42, 81.54),
-                         "Capsan L333B48T14.3": Velocity(0, 31.92, 39.9, 55.86, 63.84),  # Novo - igual Conteneiro 336B48
-                         "NewPanamax L366B49T15.2": Velocity(0, 20.4, 40.8, 61.2, 81.6),  # Novo - igual Conteneiro L366B51
-                         }
-    ship_velocity_kn = {"Aframax": Velocity(0, 203.09, 564.14, 1105.71, 1827.8, -121.85, -338.48, -663.42, -1096.68),
-                        "Aframax_Osc": Velocity(0, 95, 200, 400, 800),
-                        "Suezmax": Velocity(0, 730.1, 1051.54, 1431.78, 2366.7, -438.06, -631.12, -858.48, -1420.02),
-                        "Suezmax_2": Velocity(0, 365.42, 515.38, 1461.69, 1892.72, -219.25, -283.91, -877.01, -1135.63)}
-    list_cases_vel_osc = [1, 3, 4, 5]  # Velocidades com comportamento estranho
-    list_buoys = [[Point(11722.4553, 5583.4462), Point(11771.3626, 5379.2566), Point(9189.9177, 4969.4907), Point(9237.9939, 4765.5281),
-                   Point(6895.1451, 4417.3749), Point(6954.9285, 4225.9083), Point(5540.617, 4088.186), Point(5809.4056, 3767.7633)],
-                  [Point(11722.4553, 5583.4462), Point(11771.3626, 5379.2566), Point(9189.9177, 4969.4907), Point(9237.9939, 4765.5281),
-                   Point(6895.1451, 4417.3749), Point(6954.9285, 4225.9083), Point(5540.617, 4088.186), Point(5809.4056, 3767.7633)],
-                  [Point(11722.3589, 5583.1258), Point(11771.2493, 5379.1717), Point(9116.9042, 4962.0775), Point(9182.1188, 4746.3356),
-                   Point(6843.3548, 4413.4023), Point(6932.4013, 4209.7791)],
-                  [Point(11694.9971, 5591.3703), Point(11761.3162, 5347.1197), Point(9127.6203, 4943.6262), Point(9189.0030, 4698.5468),
-                   Point(7175.8933, 4447.2715), Point(7220.9278, 4202.2184)],
-                  [Point(11709.5909, 5544.3389), Point(11753.9045, 5340.5588), Point(9678.4495, 5060.9246), Point(9726.6952, 4851.4281),
-                   Point(8044.8985, 4665.5996), Point(8085.7122, 4459.2627), Point(7173.0433, 4497.6472), Point(7235.8574, 4256.0789)],
-                  ]
-    list_target = [Point(5790.0505, 3944.9947),
-                   Point(5790.0505, 3944.9947),
-                   Point(6889.7808, 4312.0526),
-                   Point(7200.3366, 4321.1497),
-                   Point(7213.6943, 4380.5586)]
-
-    #list_target = [Point(7000.0, 4300.0),
-    #               Point(7000.0, 4300.0),
-    #               Point(7000.0, 4300.0),
-    #               Point(7000.0, 4300.0),
-    #               Point(7000.0, 4300.0)]
-    global err_control
-    case_global_count = 0
-    err_control = ErrorPrint()
-
-    for idx in range(0, len(dt_paths)):
-        # Leitura da planilha de casos
-        path_xlsx = dt_root + dt_paths[idx] + dt_cases[idx]
-        print("Executando na pasta " + dt_paths[idx] + ":")
+class CaseMetrics:
+    # Construtor da classe
+    # Entrada:
+    #   key: nome do caso nos arquivos compilados
+    #   profile_path: arquivo .prof para captura com cProfile (None para nao capturar)
+    #   trace_memory: True para medir o pico de memoria alocada com tracemalloc
+    # Saida:
+    #   None
+    def __init__(self, key, profile_path=None, trace_memory=False):
+        self.key = key
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.stages = {}  # Tempo acumulado de cada etapa em segundos
+        self.rows = {}  # Quantidade de linhas em cada ponto da filtragem
+        self.seconds = 0
+        self.peak_mb = None
+        self.profile_top = None
+        self.validation = None  # Relatorio agregado de TrajectoryValidator
+        self._profiler = None
+        self._start = None
+
+    # Metodo para medicao do tempo de uma etapa (acumulado se a etapa se repete, ex.: leitura em blocos)
+    # Entrada:
+    #   name: nome da etapa
+    # Saida:
+    #   Gerenciador de contexto
+    @contextlib.contextmanager
+    def stage(self, name):
+        t0 = time.perf_counter()
         try:
-            df_case = pd.read_excel(path_xlsx, sheet_name="Plan1")
-        except:
-            err_control.eprint("Planilha de casos nao encontrada")
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0) + time.perf_counter() - t0
 
-        # Limpeza dos dados para obter apenas casos existentes
-        if not df_case[df_case["Caso"].isnull()].empty:
-            end_idx = df_case[df_case["Caso"].isnull()].index.tolist()[0] - 1
-            df_case = df_case.loc[0:end_idx]
-
-        # Itera pelos casos selecionados em cada pasta
-        for num_case in dt_num_case[idx]:
-            case_global_count = case_global_count + 1
-            err_control.reset()
-            print("\tGerando caso " + str(num_case) + "...")
-
-            # Obtem os arquivos de dados com os dados da manobra
-            ship_fullname = df_case[df_case["Caso"] == num_case]["Navio"].to_string(index=False)
-            ship_firstname = ship_fullname.split(' ', 1)[0]
-            if dt_paths[idx] == "Suape_2017/RT/" and num_case == 28:  # Especial pois nao bate com o nome do navio
-                file = "smh_v00030"
-            elif dt_paths[idx] == "Suape_PDZ/FT/Outputs_FT/" or dt_paths[idx] == "Suape_PDZ/RT/" or dt_paths[idx] == "Suape_PDZ/RT2/":  # Casos PDZ
-                file = dt_file_dict[idx].get(num_case)
-            else:  # Casos nao PDZ
-                file = dt_file_dict[idx].get(ship_firstname)
-            path_case = dt_root + dt_paths[idx] + dt_pos_path + str(num_case) + "/" + file + dt_file_extension
-            df = pd.read_csv(path_case, escapechar="%", skiprows=2, delim_whitespace=True)
-            df.rename(columns=lambda x: x.strip(), inplace=True)
-
-            # Adaptacao para colunas ligeiramente diferentes em Aframax/RT
-            if dt_paths[idx] == "Suape_Aframax/RT/":
-                real_param = param[1]
-            else:
-                real_param = param[0]
-            df = df[real_param]
+    # Metodo para contagem de linhas (acumulada se repetida, ex.: leitura em blocos)
+    # Entrada:
+    #   name: ponto da contagem
+    #   value: quantidade de linhas
+    # Saida:
+    #   None
+    def count(self, name, value):
+        self.rows[name] = self.rows.get(name, 0) + int(value)
 
-            # Selecao de boias
-            if len(list_buoys) - 1 < idx:
-                err_control.eprint("Posicao das boias inexistente")
-            else:
-                buoys = list_buoys[idx]
+    # Metodo para inicio da medicao do caso
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profile_path is not None:
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        self._start = time.perf_counter()
+
+    # Metodo para fim da medicao do caso
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def stop(self):
+        self.seconds = time.perf_counter() - self._start
+        if self._profiler is not None:
+            self._profiler.disable()
+            profile_dir = os.path.dirname(self.profile_path)
+            if profile_dir != "" and not os.path.exists(profile_dir):
+                os.makedirs(profile_dir)
+            self._profiler.dump_stats(self.profile_path)
+            stats = pstats.Stats(self._profiler).sort_stats("cumulative")
+            self.profile_top = [{"function": pstats.func_std_string(func), "cumulative_s": stats.stats[func][3]}
+                                for func in stats.fcn_list[:10]]
+            self._profiler = None
+        if self.trace_memory:
+            self.peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+
+    # Metodo para exportar as metricas para o relatorio (dicionario serializavel entre processos)
+    # Entrada:
+    #   None
+    # Saida:
+    #   Dicionario com as metricas do caso
+    def to_dict(self):
+        return {"seconds": self.seconds, "stages": self.stages, "rows": self.rows, "peak_mb": self.peak_mb,
+                "profile": self.profile_path if self.profile_top is not None else None, "profile_top": self.profile_top,
+                "validation": self.validation}
 
-            # Selecao de target
-            if len(list_target) - 1 < idx:
-                err_control.eprint("Posicao do target inexistente")
-            else:
-                target = list_target[idx]
 
-            # Procura as dimensoes do navio no p3d
-            list_paths = []
-            for filep3d in os.listdir(dt_root + dt_paths[idx] + dt_pos_path + str(num_case)):
-                if filep3d.endswith(".p3d"):
-                    if not((dt_paths[idx] == "Suape_2017/RT/" and num_case == 4 and filep3d != "Suez_T172_2Reb_Suape.p3d") or
-                           (dt_paths[idx] == "Suape_PDZ/RT2/" and num_case == 3 and filep3d != "PDZ_CAPESIZE_L301B510T103_1reboc.p3d") or
-                           (dt_paths[idx] == "Suape_PDZ/RT2/" and num_case == 6 and filep3d != "PDZ_Cont_L333B48T143_1reboc.p3d")):
-                        list_paths.append(os.path.join(dt_root + dt_paths[idx] + dt_pos_path + str(num_case), filep3d))
-            if len(list_paths) != 1:
-                err_control.eprint("Multiplicidade de P3D")
-            ship_dim = P3D_file(list_paths[len(list_paths)-1]).find_dimensions()  # Usa o ultimo P3D caso tenha multiplicidade
-
-            # Cria o navio do teste
-            # Seleciona o vetor com o conjunto de velocidades
-            if real_param[8] == "propeller_demanded_rpm_0":
-                ship_velocity = ship_velocity_rpm
-            elif real_param[8] == "propeller_demanded_0":
-                ship_velocity = ship_velocity_kn
-            else:
-                err_control.eprint("Parametro de velocidade nao definido")
-
-            # Seleciona o vetor de velocidades da embarcacao
-            if dt_paths[idx] == "Suape_Aframax/RT/" and (num_case in list_cases_vel_osc):
-                # Tratamento para velocidades oscilatorias em Aframax
-                ship_firstname = "Aframax_Osc"
-            elif dt_paths[idx] == "Suape_Aframax/RT/" and num_case == 11:
-                ship_firstname = "Suezmax_2"
-            vel = ship_velocity.get(ship_firstname)
-            if dt_paths[idx] == "Suape_2017/RT/" and num_case == 28:
-                vel = ship_velocity.get("Conteneiro L366B51")
-            elif vel is None or ship_fullname == "Suezmax L280B50T17":
-                vel = ship_velocity.get(ship_fullname)
-                if vel is None:
-                    err_control.eprint("Navio nao possui velocidade registrada - " + ship_fullname)
-                    vel = ship_velocity.get("Aframax")
-            ship = Ship(ship_fullname, ship_dim, vel)
-
-            # Filtragem dos dados
-            # Terceiro quadrante negativo para estar entrando no porto
-            df = df[((df["zz"] % 360 > 135) & (df["zz"] % 360 < 315))]
-            df["zz"] = df["zz"].apply(lambda x: x - 360 if x > 0 else x)
-            # Estar no meio dos pontos extremos para estar dentro do canal
-            x_ini = buoys[1].x - ship.length / 2
-            y_ini = buoys[0].y
-            x_end = target.x
-            y_end = buoys[len(buoys) - 1].y
-            df.drop(df[((df["x"] > x_ini) | (df["y"] > y_ini) | (df["x"] < x_end) | (df["y"] < y_end))].index, inplace=True)
-
-            # Calcula as distancias e discretiza a velocidade
-            if flag_lateral == True:
-                df[["distance_port", "distance_starboard", "distance_target"]] = df.apply(lambda x: ship.calc_dist_lateral(Point(x["x"], x["y"]), x["zz"], buoys, target), axis=1)
-            else:
-                df[["distance_midline", "distance_target"]] = df.apply(lambda x: ship.calc_dist_midline(Point(x["x"], x["y"]), x["zz"], buoys, target), axis=1)
-            df[["cog", "sog", "local_cog"]] = df.apply(lambda x: ship.calc_cog_sog(Point(x["x"], x["y"]), x["zz"], buoys, x["vx"], x["vy"]), axis=1)
-            df["original_propeller"] = df[real_param[8]]
-            df[real_param[8]] = pd.cut(df[real_param[8]], ship.discrete_velocity(), right=False, labels=vel_label)
-            df[real_param[8]] = df.apply(lambda x: int(x[real_param[8]]), axis=1)
-            df["discrete_propeller"] = df.apply(lambda x: ship.corresp_vel(x[real_param[8]]), axis=1)
-            if flag_lateral == True:
-                df = df.round({"distance_port": 3, "distance_starboard": 3, "distance_target": 3})
-            else:
-                df = df.round({"distance_midline": 3, "distance_target": 3})
-            df = df.round({"cog": 3, "sog": 3, "local_cog": 3})
-
-            # Gera o arquivo de treinamento apropriado com cabecalho que define os parametros da simulacao
-            if not os.path.exists(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case)):
-                os.makedirs(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case))
-            if not os.path.exists(dt_out_path_compiled):
-                os.makedirs(dt_out_path_compiled)
-            f = open(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/" + file + dt_file_extension, "w+")
-            if case_global_count < 10:
-                str_case_num = "0" + str(case_global_count)
+'''
+Classe para renderizacao dos graficos de diagnostico reutilizando uma unica figura (backend Agg)
+'''
+class PlotRenderer:
+    # Quantidade maxima de pontos exibidos por grafico
+    max_points = 2000
+
+    # Construtor da classe
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def __init__(self):
+        self.fig = Figure()
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot(111)
+        self.line, = self.ax.plot([], [])
+
+    # Metodo para renderizar uma serie e salvar em .png
+    # Entrada:
+    #   path: caminho do arquivo .png
+    #   x: vetor com os valores do eixo x
+    #   y: vetor com os valores do eixo y
+    #   xlabel: nome do eixo x
+    #   ylabel: nome do eixo y
+    #   title: titulo do grafico
+    # Saida:
+    #   None
+    def render(self, path, x, y, xlabel, ylabel, title):
+        self.line.set_data(x, y)
+        self.ax.relim()
+        self.ax.autoscale_view()
+        self.ax.set(xlabel=xlabel, ylabel=ylabel, title=title)
+        self.fig.savefig(path)
+
+    # Metodo para reducao de uma serie longa mantendo o minimo e o maximo de cada intervalo
+    # Entrada:
+    #   x: vetor com os valores do eixo x
+    #   y: vetor com os valores do eixo y
+    #   max_points: quantidade maxima de pontos da serie reduzida
+    # Saida:
+    #   x e y reduzidos
+    @staticmethod
+    def downsample(x, y, max_points=None):
+        max_points = PlotRenderer.max_points if max_points is None else max_points
+        x = np.asarray(x)
+        y = np.asarray(y, dtype=float)
+        if len(x) <= max_points:
+            return x, y
+
+        # Divide em intervalos e mantem os indices do minimo e do maximo de cada um, em ordem
+        num_bins = max_points // 2
+        size = int(np.ceil(len(x) / num_bins))
+        pad = num_bins * size - len(x)
+        y_bins = np.concatenate([y, np.full(pad, np.nan)]).reshape(num_bins, size)
+        valid = ~np.all(np.isnan(y_bins), axis=1)
+        offset = np.arange(num_bins)[valid] * size
+        idx_min = offset + np.nanargmin(y_bins[valid], axis=1)
+        idx_max = offset + np.nanargmax(y_bins[valid], axis=1)
+        keep = np.sort(np.concatenate([idx_min, idx_max]))
+        return x[keep], y[keep]
+
+
+# Renderizador do processo atual, criado no primeiro uso
+_renderer = None
+
+
+# Renderizacao de uma lista de graficos com o renderizador do processo
+# Entrada:
+#   plots: lista de tuplas (caminho do .png, x, y, nome do eixo x, nome do eixo y, titulo)
+# Saida:
+#   None
+def render_plots(plots):
+    global _renderer
+    if _renderer is None:
+        _renderer = PlotRenderer()
+    for plot in plots:
+        _renderer.render(*plot)
+
+
+'''
+Metodos para assinatura das entradas de cada caso (reprocessamento incremental)
+'''
+# Hash do conteudo de um arquivo lido em blocos
+# Entrada:
+#   path: caminho do arquivo
+# Saida:
+#   String hexadecimal com o hash
+def _file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+# Assinatura de todas as entradas que definem a saida de um caso
+# Entrada:
+#   path_case: caminho do log do simulador
+#   path_p3d: caminho do arquivo p3d utilizado
+#   df_case: linha da planilha de casos correspondente ao caso
+#   buoys: vetor com as posicoes das boias
+#   target: coordenada cartesiana do target
+#   vel: objeto Velocity da embarcacao
+#   flag_lateral: modo de geracao das distancias
+#   channel: objeto Channel ou PolylineChannel do caso
+#   resample: tupla (periodo, modo) da reamostragem (None sem reamostragem)
+#   extra: parametros adicionais da saida, ex.: variantes e deteccao de comando oscilatorio (qualquer objeto com repr estavel)
+# Saida:
+#   String hexadecimal com a assinatura do caso
+def case_fingerprint(path_case, path_p3d, df_case, buoys, target, vel, flag_lateral, channel, resample=None, extra=None):
+    h = hashlib.sha1()
+    h.update(repr(fingerprint_version).encode())
+    h.update(_file_hash(path_case).encode())
+    h.update(_file_hash(path_p3d).encode())
+    h.update(df_case.to_csv(index=False).encode())
+    h.update(repr([(b.x, b.y) for b in buoys] + [(target.x, target.y)]).encode())
+    h.update(repr(sorted(vars(vel).items())).encode())
+    h.update(repr(flag_lateral).encode())
+    h.update(type(channel).__name__.encode())
+    h.update(repr(resample).encode())
+    h.update(repr(extra).encode())
+    return h.hexdigest()
+
+
+# Parametros da deteccao de comando oscilatorio que alteram o resultado de um caso
+# Entrada:
+#   config: objeto DatasetConfig
+#   spec: objeto CaseSpec
+# Saida:
+#   Lista com o perfil alternativo e os limites da deteccao (None se o caso nao possui perfil alternativo)
+def _oscillation_signature(config, spec):
+    if spec.oscillation_velocity is None:
+        return None
+    osc = config.oscillation
+    return [sorted(vars(spec.oscillation_velocity).items()), osc["min_step"], osc["min_reversals"], osc["reversals_per_minute"],
+            osc["detect"], spec.oscillation_override]
+
+
+'''
+Metodos de leitura e filtragem dos logs do simulador
+'''
+# Tipos das colunas lidas dos logs
+# Obs.: float32 altera a impressao dos valores repassados aos arquivos de treinamento (ex.: 0.0001 -> 1e-04), por isso float64
+log_dtypes = {"time_stamp": np.float64, "x": np.float64, "y": np.float64, "zz": np.float64, "vx": np.float64, "vy": np.float64,
+              "vzz": np.float64, "rudder_demanded_orientation_0": np.float64, "propeller_demanded_rpm_0": np.float64,
+              "propeller_demanded_0": np.float64}
+
+
+# Leitura de um log do simulador mantendo apenas as colunas utilizadas
+# Entrada:
+#   path: caminho do log do simulador
+#   columns: lista com as colunas a serem mantidas
+#   chunk_filter: funcao aplicada a cada bloco lido (None para nao filtrar)
+#   chunksize: quantidade de linhas por bloco (None para ler o arquivo inteiro de uma vez)
+# Saida:
+#   DataFrame com as colunas selecionadas, ja filtrado
+def read_simulation_log(path, columns, chunk_filter=None, chunksize=None):
+    reader = pd.read_csv(path, escapechar="%", skiprows=2, sep=r"\s+", usecols=lambda x: x.strip() in columns, chunksize=chunksize)
+    if chunksize is None:
+        reader = [reader]
+
+    chunks = []
+    for chunk in reader:
+        chunk.rename(columns=lambda x: x.strip(), inplace=True)
+        chunk = chunk[columns].astype({col: log_dtypes.get(col, np.float64) for col in columns})
+        if chunk_filter is not None:
+            chunk = chunk_filter(chunk)
+        chunks.append(chunk)
+    return pd.concat(chunks)
+
+
+# Leitura de um arquivo de treinamento gerado (cabecalho com os parametros da simulacao)
+# Entrada:
+#   path: caminho do arquivo de treinamento
+# Saida:
+#   DataFrame com os dados de treinamento
+def read_training_file(path):
+    with open(path, "rb") as f:
+        # Cabecalho terminado em \r\r\n: posiciona o arquivo no nome das colunas em vez de contar linhas
+        offset = 0
+        for line in f:
+            if line.startswith(b"time_stamp"):
+                break
+            offset = offset + len(line)
+        f.seek(offset)
+        return pd.read_csv(f, sep=" ")
+
+
+# Filtragem da trajetoria para manter apenas a entrada no canal
+# Entrada:
+#   df: DataFrame com as colunas do log do simulador
+#   buoys: vetor com as posicoes das boias
+#   target: coordenada cartesiana do target
+#   ship: objeto Ship da embarcacao
+#   metrics: objeto CaseMetrics para contagem das linhas em cada filtro (None para nao contar)
+# Saida:
+#   DataFrame filtrado
+def filter_trajectory(df, buoys, target, ship, metrics=None):
+    if metrics is not None:
+        metrics.count("log", len(df))
+    # Terceiro quadrante negativo para estar entrando no porto
+    df = df[((df["zz"] % 360 > 135) & (df["zz"] % 360 < 315))].copy()
+    if metrics is not None:
+        metrics.count("heading", len(df))
+    df["zz"] = np.where(df["zz"] > 0, df["zz"] - 360, df["zz"])
+    # Estar no meio dos pontos extremos para estar dentro do canal
+    x_ini = buoys[1].x - ship.length / 2
+    y_ini = buoys[0].y
+    x_end = target.x
+    y_end = buoys[len(buoys) - 1].y
+    df.drop(df[((df["x"] > x_ini) | (df["y"] > y_ini) | (df["x"] < x_end) | (df["y"] < y_end))].index, inplace=True)
+    if metrics is not None:
+        metrics.count("channel", len(df))
+    return df
+
+
+'''
+Classe para validacao vetorizada das trajetorias, com um relatorio agregado por caso
+'''
+class TrajectoryValidator:
+    # Construtor da classe
+    # Entrada:
+    #   buoys: vetor com as posicoes das boias
+    #   target: coordenada cartesiana do target
+    #   ship: objeto Ship da embarcacao
+    #   sample_period: intervalo esperado entre as amostras do log (s)
+    #   gap_factor: intervalo maximo aceito em multiplos de sample_period
+    # Saida:
+    #   None
+    def __init__(self, buoys, target, ship, sample_period=0.1, gap_factor=1.5):
+        self.x_ini = buoys[1].x - ship.length / 2  # Mesmos limites de filter_trajectory
+        self.y_ini = buoys[0].y
+        self.x_end = target.x
+        self.y_end = buoys[len(buoys) - 1].y
+        self.max_gap = sample_period * gap_factor
+        self.samples = 0
+        self.heading_out = 0  # Amostras no canal com direcao de saida
+        self.gaps = 0  # Intervalos de tempo acima do esperado ou tempo nao crescente
+        self.largest_gap = 0.0
+        self.outside_margins = 0  # Amostras com o casco alem das margens do canal
+        self.oscillation = None
+        self._last_time = None
+
+    # Metodo para verificacao de um bloco do log antes da filtragem
+    # Entrada:
+    #   chunk: DataFrame com as colunas do log (blocos em sequencia)
+    # Saida:
+    #   None
+    def update(self, chunk):
+        time_stamp = chunk["time_stamp"].values
+        x = chunk["x"].values
+        y = chunk["y"].values
+        heading = chunk["zz"].values % 360
+        inside = (x <= self.x_ini) & (y <= self.y_ini) & (x >= self.x_end) & (y >= self.y_end)
+        self.samples = self.samples + len(chunk)
+        self.heading_out = self.heading_out + int(np.count_nonzero(inside & ~((heading > 135) & (heading < 315))))
+
+        # Continuidade do tempo, inclusive entre blocos
+        if len(time_stamp) > 0:
+            if self._last_time is not None:
+                time_stamp = np.concatenate([[self._last_time], time_stamp])
+            dt = np.diff(time_stamp)
+            bad = (dt > self.max_gap) | (dt <= 0)
+            self.gaps = self.gaps + int(np.count_nonzero(bad))
+            if np.any(bad):
+                self.largest_gap = max(self.largest_gap, float(np.abs(dt[bad]).max()))
+            self._last_time = time_stamp[-1]
+
+    # Metodo para verificacao das margens do canal
+    # Entrada:
+    #   dpb: vetor de distancias a bombordo
+    #   dsb: vetor de distancias a boreste
+    # Saida:
+    #   None
+    def check_margins(self, dpb, dsb):
+        self.outside_margins = int(np.count_nonzero((np.asarray(dpb) < 0) | (np.asarray(dsb) < 0)))
+
+    # Metodo para deteccao de comando de maquina oscilatorio por inversoes de sentido das mudancas de comando
+    # Entrada:
+    #   time_stamp: vetor com o tempo das amostras no canal
+    #   command: vetor com o comando de maquina original
+    #   min_step: menor mudanca de comando considerada (abaixo e ruido)
+    #   min_reversals: quantidade minima de inversoes
+    #   reversals_per_minute: taxa minima de inversoes
+    # Saida:
+    #   True se o comando e oscilatorio
+    def check_oscillation(self, time_stamp, command, min_step, min_reversals, reversals_per_minute):
+        steps = np.diff(np.asarray(command, dtype=float))
+        steps = steps[np.abs(steps) > min_step]
+        reversals = int(np.count_nonzero(np.sign(steps[1:]) != np.sign(steps[:-1])))
+        minutes = (time_stamp[-1] - time_stamp[0]) / 60 if len(time_stamp) > 1 else 0
+        rate = float(reversals / minutes) if minutes > 0 else 0.0
+        oscillating = bool(reversals >= min_reversals and rate >= reversals_per_minute)
+        self.oscillation = {"reversals": reversals, "per_minute": rate, "oscillating": oscillating, "profile": None}
+        return oscillating
+
+    # Metodo para registro dos problemas encontrados (uma mensagem por tipo)
+    # Entrada:
+    #   control: objeto ErrorPrint que recebe os erros (None para o controle global)
+    # Saida:
+    #   None
+    def emit(self, control=None):
+        global err_control
+        if control is None:
+            control = err_control
+        if self.heading_out > 0:
+            control.eprint("Direcao da embarcacao em saida - " + str(self.heading_out) + " amostras no canal")
+        if self.gaps > 0:
+            control.eprint("Falha na sequencia de tempo - " + str(self.gaps) + " intervalos (maior %.2f s)" % self.largest_gap)
+        if self.outside_margins > 0:
+            control.eprint("Embarcacao alem das margens do canal - " + str(self.outside_margins) + " amostras")
+
+    # Metodo para o relatorio do caso
+    # Entrada:
+    #   None
+    # Saida:
+    #   Dicionario com as contagens da validacao
+    def report(self):
+        return {"samples": self.samples, "heading_out": self.heading_out, "time_gaps": self.gaps, "largest_gap": self.largest_gap,
+                "outside_margins": self.outside_margins, "oscillation": self.oscillation}
+
+
+# Reamostragem da trajetoria em uma taxa menor, preservando as mudancas de comando
+# Entrada:
+#   df: DataFrame com a trajetoria filtrada e as variaveis calculadas
+#   period: intervalo de reamostragem em segundos
+#   mode: "mean" para media de cada intervalo ou "decimate" para manter a primeira amostra de cada intervalo
+#   command_columns: colunas de comando (leme e maquina); uma mudanca de comando sempre inicia um novo intervalo
+#   angle_columns: colunas de angulo em graus, com media circular
+# Saida:
+#   DataFrame reamostrado
+def resample_trajectory(df, period, mode, command_columns, angle_columns):
+    if len(df) == 0:
+        return df
+    time_stamp = df["time_stamp"].values
+    slot = np.floor((time_stamp - time_stamp[0]) / period + 1e-9).astype(np.int64)
+    new_group = np.r_[True, slot[1:] != slot[:-1]]
+    for col in command_columns:
+        values = df[col].values
+        new_group[1:] |= values[1:] != values[:-1]
+    group = np.cumsum(new_group) - 1
+
+    if mode == "decimate":
+        return df[new_group]
+
+    # Media de cada intervalo: primeira amostra para tempo e comandos (constantes no intervalo), media circular para angulos
+    first = df[new_group]
+    out = df.groupby(group, sort=False).mean()
+    out.index = first.index
+    for col in ["time_stamp"] + list(command_columns):
+        out[col] = first[col].values
+    for col in angle_columns:
+        rad = np.radians(df[col].values)
+        s = np.bincount(group, np.sin(rad))
+        c = np.bincount(group, np.cos(rad))
+        ref = first[col].values
+        mean = np.degrees(np.arctan2(s, c))
+        out[col] = ref + (mean - ref + 180) % 360 - 180  # Mantem o mesmo ramo de angulo da primeira amostra
+    averaged = [col for col in df.columns if col not in command_columns and col != "time_stamp"]
+    out[averaged] = out[averaged].round(6)  # Remove o ruido de ponto flutuante das medias nos arquivos de texto
+    return out[df.columns]
+
+
+'''
+Metodos para o formato binario dos arquivos de treinamento
+'''
+# Parametros da simulacao de um caso, os mesmos escritos no cabecalho dos arquivos de treinamento
+# Entrada:
+#   params: dicionario com a lista de valores de cada parametro (CaseTable.params)
+#   mult_param_data: dicionario com a quantidade de colunas dos parametros com multiplos valores
+# Saida:
+#   Dicionario com o valor de cada parametro
+def case_metadata(params, mult_param_data):
+    metadata = {}
+    for p, values in params.items():
+        if mult_param_data.get(p) is None:
+            metadata[p] = values[0].strip()
+        else:
+            metadata[p] = " ".join(str(value) for value in values)
+    return metadata
+
+
+# Escrita de um caso em .npz nao comprimido, uma matriz tipada por coluna
+# Entrada:
+#   path: caminho do arquivo .npz
+#   df: DataFrame com os dados de treinamento
+#   metadata: dicionario com os parametros da simulacao
+# Saida:
+#   None
+def write_case_npz(path, df, metadata):
+    arrays = {col: df[col].values for col in df.columns}
+    arrays["__columns__"] = np.array(list(df.columns))
+    arrays["__metadata__"] = np.array(json.dumps(metadata, ensure_ascii=False))
+    np.savez(path, **arrays)
+
+
+# Leitura de um caso em .npz com as colunas mapeadas em memoria, sem conversao de texto
+# Entrada:
+#   path: caminho do arquivo .npz gerado por write_case_npz
+# Saida:
+#   metadata: dicionario com os parametros da simulacao
+#   columns: dicionario com as colunas (np.memmap) na ordem original
+def load_case_npz(path):
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            # Dados do membro comecam apos o cabecalho local do zip e o cabecalho .npy
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
             else:
-                str_case_num = str(case_global_count)
-            f_comp = open(dt_out_path_compiled + "Caso" + str_case_num + dt_file_extension, "w+")
-            for p in simul_data:
-                check = mult_param_data.get(p)
-                if check is None:
-                    f.write(p + ": " + df_case[df_case["Caso"] == num_case][p].to_string(index=False) + "\r\n")
-                    f_comp.write(p + ": " + df_case[df_case["Caso"] == num_case][p].to_string(index=False) + "\r\n")
-                else:
-                    pos = df_case.columns.get_loc(p)
-                    f.write(p + ": ")
-                    f_comp.write(p + ": ")
-                    for i in range(0, check):
-                        f.write(df_case[df_case["Caso"] == num_case].iloc[0, pos + i] + " ")
-                        f_comp.write(df_case[df_case["Caso"] == num_case].iloc[0, pos + i] + " ")
-                    f.write("\r\n")
-                    f_comp.write("\r\n")
-            f.write("\r\n")
-            f_comp.write("\r\n")
-            f.close()
-            f_comp.close()
-
-            # Plotagem dos graficos e salva em .png
-            # plt.interactive(True)
-            fig = df.plot(x='time_stamp', y=real_param[8], legend=False)
-            fig.set(xlabel="Tempo(s)", ylabel="Máquina(-)", title='Comando de máquina')
-            # plt.ioff()
-            plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/propeller.png")
-            # plt.show()
-
-            if flag_lateral == True:
-                fig = df.plot(x='time_stamp', y='distance_port', legend=False)
-                fig.set(xlabel="Tempo(s)", ylabel="Distância(m)", title='Distância da margem a bombordo')
-                plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/dist_port.png")
-
-                fig = df.plot(x='time_stamp', y='distance_starboard', legend=False)
-                fig.set(xlabel="Tempo(s)", ylabel="Distância(m)", title='Distância da margem a boreste')
-                plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/dist_star.png")
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[:-len(".npy")]
+            if len(shape) == 0 or dtype.kind == "U":
+                arrays[name] = np.fromfile(f, dtype=dtype, count=max(1, int(np.prod(shape)))).reshape(shape)
             else:
-                fig = df.plot(x='time_stamp', y='distance_midline', legend=False)
-                fig.set(xlabel="Tempo(s)", ylabel="Distância(m)", title='Distância da linha central')
-                plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/dist_mid.png")
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape,
+                                         order="F" if fortran_order else "C")
+
+    metadata = json.loads(str(arrays.pop("__metadata__")))
+    order = [str(col) for col in arrays.pop("__columns__")]
+    return metadata, {col: arrays[col] for col in order}
+
+
+# Formatacao de um arquivo de treinamento completo em memoria
+# Entrada:
+#   header: texto do cabecalho com os parametros da simulacao
+#   df: DataFrame com as colunas dos arquivos de treinamento
+# Saida:
+#   Bytes do arquivo, identicos a escrita do cabecalho em modo texto seguida de df.to_csv(mode='a')
+def format_training_file(header, df):
+    header = header.replace("\n", os.linesep).encode(locale.getpreferredencoding(False))
+    return header + df.to_csv(index=False, sep=' ').encode("utf-8")
+
+
+# Escrita de um mesmo conteudo em varios arquivos independentes (editar um arquivo nao altera os demais)
+# Entrada:
+#   paths: lista com os caminhos de destino
+#   data: bytes do arquivo
+# Saida:
+#   None
+def write_output(paths, data):
+    for path in paths:
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)  # Substituicao atomica, sem arquivo parcial em caso de falha
+
+
+'''
+Classe para escrita dos arquivos de treinamento em uma thread separada, em paralelo ao calculo dos proximos casos
+'''
+class OutputWriter:
+    # Construtor da classe
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.errors = {}  # Erros de escrita por caso
+        self.seconds = 0  # Tempo ocupado com a escrita
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    # Metodo para enfileirar os arquivos formatados de um caso
+    # Entrada:
+    #   key: nome do caso
+    #   outputs: lista de tuplas (paths, data) recebidas por emit em process_case
+    #   callback: funcao callback(errors) chamada na thread de escrita apos os arquivos do caso (None para nenhuma)
+    # Saida:
+    #   None
+    def submit(self, key, outputs, callback=None):
+        for paths, data in outputs:
+            self.jobs.put((key, paths, data))
+        if callback is not None:
+            self.jobs.put((key, None, callback))
+
+    # Metodo para aguardar a escrita de todos os arquivos enfileirados
+    # Entrada:
+    #   None
+    # Saida:
+    #   Dicionario com a lista de erros de escrita de cada caso
+    def close(self):
+        self.jobs.put(None)
+        self.thread.join()
+        return self.errors
+
+    # Laco da thread de escrita
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            key, paths, data = job
+            if paths is None:  # Todos os arquivos do caso ja escritos
+                data(self.errors.get(key, []))
+                continue
+            t0 = time.perf_counter()
+            try:
+                write_output(paths, data)
+            except Exception as e:
+                self.errors.setdefault(key, []).append("Falha na escrita do arquivo de treinamento - " + repr(e))
+            self.seconds = self.seconds + time.perf_counter() - t0
+
+
+'''
+Classe para esboco de quantis mesclavel (compactadores em niveis, cada valor do nivel i representa 2 ** i amostras)
+'''
+class QuantileSketch:
+    # Construtor da classe
+    # Entrada:
+    #   k: capacidade de cada nivel (erro de posicao da ordem de 1 / k)
+    # Saida:
+    #   None
+    def __init__(self, k=512):
+        self.k = k
+        self.levels = []
+        self.parity = 0  # Alterna a metade mantida em cada compactacao para nao enviesar os quantis
+
+    # Metodo para inclusao de um vetor de amostras
+    # Entrada:
+    #   values: vetor de amostras (nan desconsiderado)
+    # Saida:
+    #   None
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        self._add(0, values[~np.isnan(values)])
+
+    # Metodo para juncao com outro esboco
+    # Entrada:
+    #   other: objeto QuantileSketch
+    # Saida:
+    #   None
+    def merge(self, other):
+        for level, values in enumerate(other.levels):
+            self._add(level, values)
+
+    # Metodo para estimativa de quantis
+    # Entrada:
+    #   q: vetor de quantis entre 0 e 1
+    # Saida:
+    #   Vetor com os valores estimados (nan sem amostras)
+    def quantile(self, q):
+        q = np.asarray(q, dtype=float)
+        if sum(len(values) for values in self.levels) == 0:
+            return np.full(q.shape, np.nan)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(values), 2.0 ** level) for level, values in enumerate(self.levels)])
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        rank = np.cumsum(weights[order]) - weights[order] / 2  # Posicao central de cada valor na ordenacao
+        return np.interp(q * weights.sum(), rank, values)
+
+    # Metodo para compactacao dos niveis acima da capacidade
+    # Entrada:
+    #   level: nivel das amostras incluidas
+    #   values: vetor de amostras com peso 2 ** level
+    # Saida:
+    #   None
+    def _add(self, level, values):
+        while len(values) > 0:
+            while len(self.levels) <= level:
+                self.levels.append(np.empty(0))
+            buffer = np.concatenate([self.levels[level], values])
+            if len(buffer) <= self.k:
+                self.levels[level] = buffer
+                return
+            # Mantem um valor a cada dois no nivel seguinte (peso dobrado), sobra um valor se a quantidade for impar
+            buffer.sort()
+            rest = len(buffer) % 2
+            self.levels[level] = buffer[len(buffer) - rest:]
+            values = buffer[self.parity:len(buffer) - rest:2]
+            self.parity = 1 - self.parity
+            level = level + 1
 
-            fig = df.plot(x='time_stamp', y='distance_target', legend=False)
-            fig.set(xlabel="Tempo(s)", ylabel="Distância(m)", title='Distância ao final do canal')
-            plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/dist_target.png")
 
-            fig = df.plot(x='time_stamp', y='rudder_demanded_orientation_0', legend=False)
-            fig.set(xlabel="Tempo(s)", ylabel="Ângulo(rad)", title='Comando de leme')
-            plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/rudder.png")
+'''
+Classe para estatisticas de normalizacao acumuladas caso a caso (mescladas entre processos e shards)
+'''
+class FeatureStats:
+    # Construtor da classe
+    # Entrada:
+    #   class_column: coluna com as classes contadas para balanceamento
+    #   ignore: colunas sem estatisticas
+    #   k: capacidade de cada nivel dos esbocos de quantis
+    # Saida:
+    #   None
+    def __init__(self, class_column="propeller_demanded", ignore=("time_stamp",), k=512):
+        self.class_column = class_column
+        self.ignore = list(ignore)
+        self.k = k
+        self.features = {}  # Coluna -> [count, mean, m2, min, max, QuantileSketch]
+        self.classes = {}  # Classe -> quantidade de amostras
+
+    # Metodo para inclusao das amostras de um caso (momentos pelo algoritmo de Welford/Chan em bloco)
+    # Entrada:
+    #   df: DataFrame com as colunas dos arquivos de treinamento
+    # Saida:
+    #   None
+    def update(self, df):
+        for col in df.columns:
+            if col in self.ignore or col == self.class_column:
+                continue
+            values = df[col].values.astype(float)
+            values = values[~np.isnan(values)]
+            if len(values) == 0:
+                continue
+            sketch = QuantileSketch(self.k)
+            sketch.update(values)
+            mean = values.mean()
+            self._merge_feature(col, [len(values), mean, ((values - mean) ** 2).sum(), values.min(), values.max(), sketch])
+        if self.class_column in df.columns:
+            labels, counts = np.unique(df[self.class_column].values, return_counts=True)
+            for label, count in zip(labels, counts):
+                key = str(label.item())
+                self.classes[key] = self.classes.get(key, 0) + int(count)
+
+    # Metodo para juncao com as estatisticas de outros casos
+    # Entrada:
+    #   other: objeto FeatureStats
+    # Saida:
+    #   None
+    def merge(self, other):
+        for col, feature in other.features.items():
+            self._merge_feature(col, feature)
+        for key, count in other.classes.items():
+            self.classes[key] = self.classes.get(key, 0) + count
 
-            fig = df.plot(x='time_stamp', y='cog', legend=False)
-            fig.set(xlabel="Tempo(s)", ylabel="Cog(º)", title='Course over ground')
-            plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/cog.png")
+    # Metodo para resumo das estatisticas (desvio padrao populacional)
+    # Entrada:
+    #   quantiles: lista de quantis estimados
+    # Saida:
+    #   Dicionario com as estatisticas de cada coluna e a contagem das classes
+    def summary(self, quantiles=(0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)):
+        features = {}
+        for col, (count, mean, m2, low, high, sketch) in self.features.items():
+            features[col] = {"count": count, "mean": mean, "std": m.sqrt(m2 / count), "min": low, "max": high,
+                             "quantiles": {str(q): value for q, value in zip(quantiles, sketch.quantile(quantiles).tolist())}}
+        classes = {key: self.classes[key] for key in sorted(self.classes, key=float)}
+        return {"features": features, "classes": {self.class_column: classes}}
+
+    # Metodo para conversao em dicionario serializavel (estado completo, inclusive os esbocos)
+    # Entrada:
+    #   None
+    # Saida:
+    #   Dicionario para json
+    def to_dict(self):
+        features = {col: {"count": count, "mean": mean, "m2": m2, "min": low, "max": high,
+                          "levels": [values.tolist() for values in sketch.levels]}
+                    for col, (count, mean, m2, low, high, sketch) in self.features.items()}
+        return {"class_column": self.class_column, "k": self.k, "features": features, "classes": self.classes}
+
+    # Metodo para leitura do estado gerado por to_dict
+    # Entrada:
+    #   data: dicionario lido do json
+    # Saida:
+    #   Objeto FeatureStats
+    @staticmethod
+    def from_dict(data):
+        stats = FeatureStats(data["class_column"], k=data["k"])
+        for col, feature in data["features"].items():
+            sketch = QuantileSketch(data["k"])
+            sketch.levels = [np.array(values, dtype=float) for values in feature["levels"]]
+            stats.features[col] = [feature["count"], feature["mean"], feature["m2"], feature["min"], feature["max"], sketch]
+        stats.classes = dict(data["classes"])
+        return stats
+
+    # Metodo para juncao das estatisticas de uma coluna
+    # Entrada:
+    #   col: nome da coluna
+    #   feature: lista [count, mean, m2, min, max, QuantileSketch] com as estatisticas a incluir
+    # Saida:
+    #   None
+    def _merge_feature(self, col, feature):
+        count_b, mean_b, m2_b, low_b, high_b, sketch_b = feature
+        if col not in self.features:
+            sketch = QuantileSketch(self.k)
+            sketch.merge(sketch_b)
+            self.features[col] = [count_b, mean_b, m2_b, low_b, high_b, sketch]
+            return
+        current = self.features[col]
+        count_a, mean_a = current[0], current[1]
+        count = count_a + count_b
+        delta = mean_b - mean_a
+        current[0] = count
+        current[1] = mean_a + delta * count_b / count
+        current[2] = current[2] + m2_b + delta ** 2 * count_a * count_b / count
+        current[3] = min(current[3], low_b)
+        current[4] = max(current[4], high_b)
+        current[5].merge(sketch_b)
+
+
+'''
+Classe para suporte do conjunto de treinamento consolidado (todas as amostras em uma unica matriz)
+'''
+class TrainingDataset:
+    # Construtor da classe, com a matriz de amostras mapeada em memoria
+    # Entrada:
+    #   path: caminho da matriz .npy gerada por TrainingDataset.write (o indice fica em <nome>_index.json)
+    # Saida:
+    #   None
+    def __init__(self, path):
+        self.data = np.load(path, mmap_mode="r")
+        with open(os.path.splitext(path)[0] + "_index.json") as f:
+            index = json.load(f)
+        self.columns = index["columns"]
+        self.cases = index["cases"]
 
-            fig = df.plot(x='time_stamp', y='sog', legend=False)
-            fig.set(xlabel="Tempo(s)", ylabel="sog(m/s)", title='Speed over ground')
-            plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/sog.png")
+    # Metodo para escrita do conjunto consolidado a partir dos casos em .npz
+    # Entrada:
+    #   path: caminho da matriz .npy de saida
+    #   list_npz: lista de tuplas (numero do caso, caminho do .npz do caso) na ordem desejada
+    # Saida:
+    #   None
+    @staticmethod
+    def write(path, list_npz):
+        loaded = [(case_num, load_case_npz(path_npz)) for case_num, path_npz in list_npz]
+        columns = list(loaded[0][1][1].keys())
+        total = sum(len(cols[columns[0]]) for case_num, (metadata, cols) in loaded)
+
+        # Copia cada caso na sua faixa de linhas da matriz de saida
+        data = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(total, len(columns)))
+        cases = []
+        start = 0
+        for case_num, (metadata, cols) in loaded:
+            length = len(cols[columns[0]])
+            for j, col in enumerate(columns):
+                data[start:start + length, j] = cols[col]
+            cases.append(dict(metadata, case=case_num, start=start, length=length))
+            start = start + length
+        data.flush()
+        del data
+
+        with open(os.path.splitext(path)[0] + "_index.json", "w") as f:
+            json.dump({"columns": columns, "cases": cases}, f, indent=4, ensure_ascii=False)
+
+    # Metodo para acesso as amostras de um caso sem copia
+    # Entrada:
+    #   case_num: numero global do caso
+    # Saida:
+    #   Matriz com as amostras do caso (view da matriz consolidada)
+    def case(self, case_num):
+        for entry in self.cases:
+            if entry["case"] == case_num:
+                return self.data[entry["start"]:entry["start"] + entry["length"]]
+        return None
+
+    # Metodo para selecao dos casos pelos parametros da simulacao
+    # Entrada:
+    #   filters: parametros da simulacao e valores desejados (ex.: Navio="Aframax X")
+    # Saida:
+    #   Lista de matrizes com as amostras de cada caso selecionado (views da matriz consolidada)
+    def select(self, **filters):
+        return [self.data[entry["start"]:entry["start"] + entry["length"]] for entry in self.cases
+                if all(entry.get(key) == value for key, value in filters.items())]
 
-            fig = df.plot(x='time_stamp', y='local_cog', legend=False)
-            fig.set(xlabel="Tempo(s)", ylabel="Local Cog(º)", title='Course over ground - Local')
-            plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/local_cog.png")
+    # Metodo para amostragem aleatoria de janelas de amostras consecutivas de um mesmo caso
+    # Entrada:
+    #   num_samples: quantidade de janelas
+    #   length: tamanho de cada janela
+    #   rng: gerador numpy de numeros aleatorios
+    # Saida:
+    #   Lista de matrizes com as janelas (views da matriz consolidada)
+    def sample(self, num_samples, length, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+        valid = [entry for entry in self.cases if entry["length"] >= length]
+        windows = []
+        for k in rng.integers(0, len(valid), num_samples):
+            start = valid[k]["start"] + rng.integers(0, valid[k]["length"] - length + 1)
+            windows.append(self.data[start:start + length])
+        return windows
+
+    # Metodo para indice de uma coluna na matriz consolidada
+    # Entrada:
+    #   name: nome da coluna
+    # Saida:
+    #   Indice da coluna
+    def column(self, name):
+        return self.columns.index(name)
 
-            # ax = df.plot(x='time_stamp', y='original_propeller')
-            # df.plot(x='time_stamp', y='discrete_propeller', ax=ax)
-            # plt.savefig(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/original_discrete_propeller.png")
 
-            plt.close("all")
+'''
+Classe para suporte da planilha de casos (casos.xlsx) indexada pelo numero do caso
+'''
+class CaseTable:
+    # Construtor da classe
+    # Entrada:
+    #   path: caminho da planilha de casos
+    #   cache_dir: diretorio para a copia em pickle da planilha (None para sempre ler o Excel)
+    # Saida:
+    #   None
+    def __init__(self, path, cache_dir=None):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.df = self._load()
 
-            # Remove colunas auxiliares
-            df.drop(columns=['original_propeller', 'discrete_propeller', 'x', 'y'], inplace=True)
+    # Metodo para obter as linhas de um caso
+    # Entrada:
+    #   num_case: numero do caso na planilha
+    # Saida:
+    #   DataFrame com as linhas do caso (vazio se o caso nao existe)
+    def rows(self, num_case):
+        if num_case not in self.df.index:
+            return self.df.iloc[0:0]
+        return self.df.loc[[num_case]]
 
-            # Renomeia as colunas
-            df.rename(index=str, columns={real_param[8]: "propeller_demanded", "rudder_demanded_orientation_0": "rudder_demanded"}, inplace=True)
+    # Metodo para obter os parametros da simulacao de um caso, na forma escrita no cabecalho dos arquivos de treinamento
+    # Entrada:
+    #   rows: linhas do caso obtidas por rows()
+    #   simul_data: lista com os parametros da simulacao
+    #   mult_param_data: dicionario com a quantidade de colunas dos parametros com multiplos valores
+    # Saida:
+    #   Dicionario com a lista de valores de cada parametro
+    def params(self, rows, simul_data, mult_param_data):
+        params = {}
+        for p in simul_data:
+            check = mult_param_data.get(p)
+            if check is None:
+                params[p] = [rows[p].to_string(index=False)]
+            else:
+                pos = rows.columns.get_loc(p)
+                params[p] = [rows.iloc[0, pos + i] for i in range(0, check)]
+        return params
 
-            # Escreve o resto do arquivo com os dados de treinamento
-            df.to_csv(dt_out_path + dt_paths[idx] + dt_pos_path + str(num_case) + "/" + file + dt_file_extension, mode='a', index=False, sep=' ')
-            df.to_csv(dt_out_path_compiled + "Caso" + str_case_num + dt_file_extension, mode='a', index=False, sep=' ')
+    # Metodo para leitura da planilha, usando a copia em pickle se a planilha nao foi alterada
+    # Entrada:
+    #   None
+    # Saida:
+    #   DataFrame com os casos existentes indexado pela coluna "Caso"
+    def _load(self):
+        stat = os.stat(self.path)
+        key = [os.path.abspath(self.path), stat.st_mtime_ns, stat.st_size]
+        path_cache = None
+        if self.cache_dir is not None:
+            path_cache = self.cache_dir + hashlib.sha1(key[0].encode()).hexdigest() + ".pkl"
+            try:
+                with open(path_cache, "rb") as f:
+                    cached_key, df = pickle.load(f)
+                if cached_key == key:
+                    return df
+            except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+                pass
+
+        df = pd.read_excel(self.path, sheet_name="Plan1")
 
-            # Imprime o log de erro
-            if err_control.get_num_error() == 0:
+        # Limpeza dos dados para obter apenas casos existentes
+        if not df[df["Caso"].isnull()].empty:
+            end_idx = df[df["Caso"].isnull()].index.tolist()[0] - 1
+            df = df.loc[0:end_idx]
+        df = df.set_index("Caso", drop=False)
+        df.index.name = None
+
+        # Copia em pickle (substituicao atomica do arquivo)
+        if path_cache is not None:
+            if not os.path.exists(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp_path = path_cache + "." + str(os.getpid()) + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump((key, df), f)
+            os.replace(tmp_path, path_cache)
+        return df
+
+
+'''
+Classe para definicao de um caso com todas as entradas ja resolvidas
+'''
+class CaseSpec:
+    # Construtor da classe
+    # Entrada:
+    #   folder_idx: indice da pasta do caso na configuracao
+    #   folder: diretorio da pasta dos casos
+    #   num_case: numero do caso na pasta
+    #   case_num: numero global do caso nos arquivos compilados
+    #   df_case: linhas da planilha de casos correspondentes ao caso
+    # Saida:
+    #   None
+    def __init__(self, folder_idx, folder, num_case, case_num, df_case):
+        self.folder_idx = folder_idx
+        self.folder = folder
+        self.num_case = num_case
+        self.case_num = case_num
+        self.key = "Caso" + str(case_num).zfill(2)
+        self.df_case = df_case
+        self.params = {}  # Parametros da simulacao escritos no cabecalho
+        self.ship_fullname = None
+        self.file = None
+        self.path_case = None
+        self.path_p3d = None
+        self.columns = None
+        self.velocity = None
+        self.buoys = None
+        self.target = None
+        self.channel = None
+        self.errors = []  # Erros encontrados na resolucao das entradas
+        self.variants = []  # Tuplas (variante, arquivo de saida) das variantes que incluem o caso
+        self.path_stats = None
+        self.oscillation_profile = None  # Nome do perfil de velocidade para comando de maquina oscilatorio (None sem deteccao)
+        self.oscillation_velocity = None
+        self.oscillation_label = None  # True se marcado manualmente como oscilatorio (oscillation_labels), usado na calibracao
+        self.oscillation_override = False  # True se o perfil oscilatorio foi fixado por override de velocity
+
+
+'''
+Classe para suporte da configuracao declarativa dos casos (arquivo yaml)
+'''
+class DatasetConfig:
+    # Construtor da classe
+    # Entrada:
+    #   path: caminho do arquivo yaml de configuracao
+    # Saida:
+    #   None
+    def __init__(self, path):
+        with open(path, encoding="utf-8") as f:
+            data = yaml.safe_load(f)
+
+        self.root = data["root"]
+        self.case_prefix = data["case_prefix"]
+        self.file_extension = data["file_extension"]
+        self.out_path = data["out_path"]
+        self.out_path_compiled = data["out_path_compiled"]
+        self.flag_lateral = data["flag_lateral"]
+        self.columns = data["columns"]
+        self.simul_data = data["simul_data"]
+        self.mult_param_data = data["mult_param_data"]
+        self.velocities = {units: {name: Velocity(*values) for name, values in table.items()}
+                           for units, table in data["velocities"].items()}
+        self.full_name_velocities = data.get("full_name_velocities", [])
+        self.default_velocity = data["default_velocity"]
+
+        # Pastas com a geometria do canal calculada uma unica vez
+        self.folders = data["folders"]
+        for folder in self.folders:
+            folder["buoys"] = [Point(x, y) for x, y in folder["buoys"]]
+            folder["target"] = Point(*folder["target"])
+            if folder.get("channel_type", "sections") == "polyline":
+                folder["channel"] = PolylineChannel(folder["buoys"])
+            else:
+                folder["channel"] = Channel(folder["buoys"])
+            folder.setdefault("overrides", {})
+            folder.setdefault("oscillation_labels", [])
+
+        # Opcoes de execucao (definidas pela linha de comando)
+        self.chunksize = None
+        self.npz_output = False
+        self.plot_mode = "all"
+        self.p3d_cache_path = self.out_path + "p3d_cache/"
+        self.cases_cache_dir = self.out_path + "casos_cache/"
+        self.intermediate_dir = self.out_path + "intermedio/"  # Intermediarios completos de cada caso (None para nao guardar)
+        self.refresh_intermediate = False  # True para recalcular os intermediarios guardados
+        self.profile = False
+        self.trace_memory = False
+
+        # Reamostragem dos arquivos de treinamento (sem reamostragem por padrao, amostras do simulador a cada 0.1 s)
+        resample = data.get("resample") or {}
+        self.resample_period = resample.get("period")
+        self.resample_mode = resample.get("mode", "mean")
+
+        # Deteccao de comando de maquina oscilatorio: mudancas menores que min_step (fracao do comando maximo do perfil
+        # oscilatorio) sao ignoradas; com detect false o resultado vai apenas para o relatorio e o perfil fica o nominal
+        oscillation = data.get("oscillation") or {}
+        self.oscillation = {"min_step": oscillation.get("min_step", 0.02), "min_reversals": oscillation.get("min_reversals", 20),
+                            "reversals_per_minute": oscillation.get("reversals_per_minute", 2.0),
+                            "detect": bool(oscillation.get("detect", True)), "profiles": oscillation.get("profiles") or {}}
+
+        # Variantes do conjunto compilado geradas do mesmo intermediario (pasta em out_path, modo das distancias,
+        # colunas removidas e casos incluidos pelo numero global)
+        self.variants = data.get("variants") or []
+        for variant in self.variants:
+            variant.setdefault("lateral", self.flag_lateral)
+            variant.setdefault("drop", [])
+            variant.setdefault("cases", None)
+
+    # Metodo para resolucao de todos os casos antes da leitura dos dados
+    # Entrada:
+    #   None
+    # Saida:
+    #   specs: lista de CaseSpec na ordem da configuracao
+    #   folder_errors: lista com os erros de cada pasta
+    def plan(self):
+        specs = []
+        folder_errors = [[] for _ in self.folders]
+        case_num = 0
+        for idx, folder in enumerate(self.folders):
+            # Leitura da planilha de casos (uma unica vez por pasta)
+            path_xlsx = self.root + folder["path"] + folder["cases_file"]
+            try:
+                table = CaseTable(path_xlsx, self.cases_cache_dir)
+            except:
+                folder_errors[idx].append("Planilha de casos nao encontrada")
+                case_num = case_num + len(folder["cases"])
+                continue
+
+            for num_case in folder["cases"]:
+                case_num = case_num + 1
+                specs.append(self.resolve_case(idx, num_case, case_num, table))
+        return specs, folder_errors
+
+    # Metodo para resolucao das entradas de um caso: log do simulador, p3d, velocidades e canal
+    # Entrada:
+    #   idx: indice da pasta do caso
+    #   num_case: numero do caso na pasta
+    #   case_num: numero global do caso nos arquivos compilados
+    #   table: objeto CaseTable com a planilha de casos da pasta
+    # Saida:
+    #   Objeto CaseSpec
+    def resolve_case(self, idx, num_case, case_num, table):
+        folder = self.folders[idx]
+        override = folder["overrides"].get(num_case, {})
+        df_case = table.rows(num_case)
+        spec = CaseSpec(idx, folder["path"], num_case, case_num, df_case)
+        if df_case.empty:
+            spec.errors.append("Caso nao encontrado na planilha de casos")
+        else:
+            spec.params = table.params(df_case, self.simul_data, self.mult_param_data)
+        dir_case = self.root + folder["path"] + self.case_prefix + str(num_case)
+
+        # Obtem os arquivos de dados com os dados da manobra
+        spec.ship_fullname = df_case["Navio"].to_string(index=False)
+        ship_firstname = spec.ship_fullname.split(' ', 1)[0]
+        if "file" in override:
+            spec.file = override["file"]
+        elif "files_by_case" in folder:
+            spec.file = folder["files_by_case"].get(num_case)
+        else:
+            spec.file = folder["files_by_ship"].get(ship_firstname)
+        if spec.file is None:
+            spec.errors.append("Arquivo do caso nao definido")
+        else:
+            spec.path_case = dir_case + "/" + spec.file + self.file_extension
+            if not os.path.exists(spec.path_case):
+                spec.errors.append("Log do simulador inexistente")
+
+        # Procura o p3d do navio
+        if "p3d" in override:
+            list_paths = [os.path.join(dir_case, override["p3d"])]
+            list_paths = [path for path in list_paths if os.path.exists(path)]
+        elif os.path.isdir(dir_case):
+            list_paths = [os.path.join(dir_case, filep3d) for filep3d in os.listdir(dir_case) if filep3d.endswith(".p3d")]
+        else:
+            list_paths = []
+        if len(list_paths) != 1:
+            spec.errors.append("Multiplicidade de P3D")
+        if len(list_paths) > 0:
+            spec.path_p3d = list_paths[len(list_paths) - 1]  # Usa o ultimo P3D caso tenha multiplicidade
+
+        # Seleciona as colunas e o vetor de velocidades da embarcacao
+        spec.columns = self.columns[folder["units"]]
+        ship_velocity = self.velocities[folder["units"]]
+        velocity_name = ship_firstname
+        nominal_velocity = ship_velocity.get(ship_firstname)
+        if nominal_velocity is None or spec.ship_fullname in self.full_name_velocities:
+            velocity_name = spec.ship_fullname
+            nominal_velocity = ship_velocity.get(spec.ship_fullname)
+        if "velocity" in override:
+            spec.velocity = ship_velocity.get(override["velocity"])
+        else:
+            spec.velocity = nominal_velocity
+
+        # Perfil usado se o comando de maquina do log for oscilatorio (deteccao na leitura do caso); oscillation_labels e a
+        # marcacao manual usada apenas na calibracao, o override de velocity fixa o perfil e o caso nao troca pela deteccao
+        profile = self.oscillation["profiles"].get(folder["units"], {}).get(velocity_name)
+        if nominal_velocity is not None and profile is not None and override.get("velocity", profile) == profile:
+            spec.oscillation_profile = profile
+            spec.oscillation_velocity = ship_velocity.get(profile)
+            spec.oscillation_override = "velocity" in override
+            spec.oscillation_label = spec.oscillation_override or num_case in folder["oscillation_labels"]
+            if spec.oscillation_velocity is None:
+                spec.errors.append("Perfil de velocidade oscilatoria nao registrado - " + profile)
+        if spec.velocity is None:
+            spec.errors.append("Navio nao possui velocidade registrada - " + spec.ship_fullname)
+            spec.velocity = ship_velocity.get(self.default_velocity)
+
+        # Geometria do canal
+        spec.buoys = folder["buoys"]
+        spec.target = folder["target"]
+        spec.channel = folder["channel"]
+
+        # Arquivos de saida
+        dir_out = self.out_path + folder["path"] + self.case_prefix + str(num_case) + "/"
+        spec.path_fig = dir_out
+        spec.path_out = dir_out + str(spec.file) + self.file_extension
+        spec.path_out_compiled = self.out_path_compiled + spec.key + self.file_extension
+        spec.path_out_npz = self.out_path_compiled + spec.key + ".npz"
+        spec.path_stats = self.out_path + "stats/" + spec.key + ".json"
+        spec.variants = [(variant, self.out_path + variant["name"] + "/" + spec.key + self.file_extension)
+                         for variant in self.variants if variant["cases"] is None or case_num in variant["cases"]]
+        return spec
+
+
+# Configuracao padrao dos casos, ao lado do script
+# Entrada:
+#   None
+# Saida:
+#   Caminho do arquivo dataset.yaml
+def default_config_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), "dataset.yaml")
+
+
+# Relatorio da execucao com as metricas de cada caso e os totais por etapa e por tipo de erro
+# Entrada:
+#   path: caminho do arquivo json
+#   options: dicionario com as opcoes da execucao
+#   config: objeto DatasetConfig
+#   specs: lista de CaseSpec
+#   folder_errors: lista com os erros de cada pasta
+#   results: lista com o retorno de _run_case de cada caso
+#   run_stages: dicionario com o tempo das etapas globais da execucao
+#   seconds: tempo total da execucao
+# Saida:
+#   None
+def write_run_report(path, options, config, specs, folder_errors, results, run_stages, seconds):
+    cases = []
+    stages = {}
+    errors = {}
+    for idx, folder in enumerate(config.folders):
+        for text in folder_errors[idx]:
+            kind = text.split(" - ", 1)[0]
+            errors[kind] = errors.get(kind, 0) + 1
+    for spec, (case_errors, fingerprint, skipped, plots, report) in zip(specs, results):
+        if skipped:
+            status = "skipped"
+        elif fingerprint is None:
+            status = "failed"
+        elif len(case_errors) > 0:
+            status = "warning"
+        else:
+            status = "ok"
+        case = {"key": spec.key, "folder": spec.folder, "num_case": spec.num_case, "file": spec.file, "status": status}
+        case.update(report)
+        cases.append(case)
+        for name, value in report["stages"].items():
+            stages[name] = stages.get(name, 0) + value
+        for kind, value in report["errors"].items():
+            errors[kind] = errors.get(kind, 0) + value
+
+    run = {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "seconds": seconds, "options": options, "stages": run_stages,
+           "case_stages": stages, "errors": errors, "folder_errors": {folder["path"]: folder_errors[idx] for idx, folder in enumerate(config.folders)},
+           "slowest": [case["key"] for case in sorted(cases, key=lambda case: -case["seconds"])[:5]], "cases": cases}
+    report_dir = os.path.dirname(path)
+    if report_dir != "" and not os.path.exists(report_dir):
+        os.makedirs(report_dir)
+    with open(path, "w") as f:
+        json.dump(run, f, indent=4, ensure_ascii=False)
+
+
+'''
+Metodo principal
+'''
+def main(config_path=None, workers=None, force=False, chunksize=None, npz_output=False, consolidated=False, plot_mode="all",
+         report_path=None, profile=False, trace_memory=False, resample_period=None, resample_mode=None, shard=None, merge=None,
+         stale_seconds=600, calibrate=False):
+    global err_control
+    err_control = ErrorPrint()
+    run_start = time.perf_counter()
+    run_stages = {}
+
+    # Configuracao dos casos e opcoes de execucao
+    if config_path is None:
+        config_path = default_config_path()
+    config = DatasetConfig(config_path)
+    config.chunksize = chunksize
+    config.npz_output = npz_output or consolidated  # O conjunto consolidado e montado a partir dos casos em .npz
+    config.plot_mode = plot_mode
+    config.profile = profile
+    config.trace_memory = trace_memory
+    config.refresh_intermediate = force
+    if resample_period is not None:  # Linha de comando tem prioridade sobre o arquivo de configuracao
+        config.resample_period = resample_period
+    if resample_mode is not None:
+        config.resample_mode = resample_mode
+
+    # Lista de casos com numeracao global deterministica (ordem das pastas e casos da configuracao)
+    t0 = time.perf_counter()
+    specs, folder_errors = config.plan()
+    run_stages["plan"] = time.perf_counter() - t0
+
+    # Calibracao da deteccao de comando oscilatorio pelos casos marcados em oscillation_labels, sem gerar os arquivos de treinamento
+    if calibrate:
+        report = calibrate_oscillation(config, specs, workers)
+        for item in report["items"]:
+            status = "erro" if item["reversals"] is None else ("%d inversoes, %.2f/min" % (item["reversals"], item["per_minute"]))
+            print("\t" + item["key"] + " (" + item["folder"] + config.case_prefix + str(item["num_case"]) + "): " + status +
+                  (", marcado" if item["label"] else "") + (", detectado" if item["oscillating"] else ""))
+        for name in ["current", "suggested"]:
+            result = report[name]
+            print("Limites " + ("atuais" if name == "current" else "sugeridos") + ": min_reversals %d, reversals_per_minute %.2f"
+                  % (result["min_reversals"], result["reversals_per_minute"]) + " - " + str(result["confusion"]) +
+                  ("" if len(result["divergent"]) == 0 else ", divergentes: " + ", ".join(result["divergent"])))
+        return
+
+    # Manifesto com as assinaturas das entradas de cada caso da ultima execucao
+    path_manifest = config.out_path + "manifest.json"
+    manifest = {}
+    if os.path.exists(path_manifest):
+        try:
+            with open(path_manifest) as f:
+                manifest = json.load(f)
+        except json.JSONDecodeError:
+            err_control.eprint("Manifesto corrompido, todos os casos serao processados - " + path_manifest)
+            manifest = {}
+    previous = [None if force else manifest.get(spec.key) for spec in specs]
+
+    # Modo shard: processos independentes (inclusive em outras maquinas) reservam os casos por arquivos em out_path/shards/
+    # O manifesto, os graficos adiados, o conjunto consolidado e o relatorio ficam para a juncao (--merge)
+    if shard is not None:
+        if config.plot_mode == "defer":
+            config.plot_mode = "all"
+        shard_queue = ShardQueue(config.out_path + "shards/" + shard + "/", stale_seconds=stale_seconds)
+        print("Shard " + shard_queue.name + " na execucao " + shard + ":")
+        t0 = time.perf_counter()
+        processed = run_shard(config, specs, previous, shard_queue, workers)
+        run_stages["cases"] = time.perf_counter() - t0
+        summary = {"shard": shard_queue.name, "cases": processed, "seconds": time.perf_counter() - run_start, "stages": run_stages}
+        write_output([shard_queue.path + "shard_" + shard_queue.name + ".json"], json.dumps(summary, indent=4).encode("utf-8"))
+        print("\n*** Shard concluido: " + str(len(processed)) + " casos processados ***")
+        return
+
+    # Processa os casos em paralelo e imprime o log na ordem dos casos
+    # Os arquivos de treinamento sao escritos por uma thread enquanto os proximos casos sao calculados
+    t0 = time.perf_counter()
+    writer = OutputWriter()
+    results = []
+    if merge is not None:
+        results, shards, shard_stages = merge_shards(ShardQueue(config.out_path + "shards/" + merge + "/"), specs)
+        run_stages.update(shard_stages)
+        print("Juncao da execucao " + merge + ": " + ", ".join(name + " (" + str(count) + " casos)" for name, count in shards.items()))
+    elif workers == 1:
+        for spec, previous_fingerprint in zip(specs, previous):
+            results.append(_run_case(config, spec, previous_fingerprint))
+            writer.submit(spec.key, results[-1][5])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_run_case, config, spec, previous_fingerprint) for spec, previous_fingerprint in zip(specs, previous)]
+            for spec, future in zip(specs, futures):
+                results.append(future.result())
+                writer.submit(spec.key, results[-1][5])
+    write_errors = writer.close()
+    run_stages["cases"] = time.perf_counter() - t0
+    run_stages["write"] = writer.seconds
+    results = [_finish_result(result, write_errors.get(spec.key, [])) for spec, result in zip(specs, results)]
+
+    for spec, (errors, fingerprint, skipped, plots, report) in zip(specs, results):
+        if fingerprint is None:
+            manifest.pop(spec.key, None)
+        else:
+            manifest[spec.key] = fingerprint
+    if not os.path.exists(config.out_path):
+        os.makedirs(config.out_path)
+    write_output([path_manifest], json.dumps(manifest, indent=4, sort_keys=True).encode("utf-8"))
+
+    # Estatisticas de normalizacao do conjunto compilado, juntando os casos validos na ordem dos casos
+    t0 = time.perf_counter()
+    stats = FeatureStats()
+    stats_cases = []
+    for spec, result in zip(specs, results):
+        if result[1] is not None and os.path.exists(spec.path_stats):
+            with open(spec.path_stats, encoding="utf-8") as f:
+                stats.merge(FeatureStats.from_dict(json.load(f)))
+            stats_cases.append(spec.key)
+    if len(stats_cases) > 0:
+        write_output([config.out_path_compiled + "stats.json"],
+                     json.dumps(dict(stats.summary(), cases=stats_cases), indent=4).encode("utf-8"))
+    run_stages["stats"] = time.perf_counter() - t0
+
+    # Renderizacao dos graficos adiados, apos todos os arquivos de treinamento estarem prontos
+    deferred = [result[3] for result in results if len(result[3]) > 0]
+    t0 = time.perf_counter()
+    if len(deferred) > 0:
+        if workers == 1:
+            for plots in deferred:
+                render_plots(plots)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(render_plots, deferred))
+    run_stages["deferred_plots"] = time.perf_counter() - t0
+
+    # Conjunto de treinamento consolidado com os casos processados com sucesso
+    if consolidated:
+        list_npz = [(spec.case_num, spec.path_out_npz) for spec, result in zip(specs, results) if result[1] is not None]
+        if len(list_npz) > 0:
+            t0 = time.perf_counter()
+            TrainingDataset.write(config.out_path_compiled + "dataset.npy", list_npz)
+            run_stages["consolidated"] = time.perf_counter() - t0
+
+    for idx, folder in enumerate(config.folders):
+        print("Executando na pasta " + folder["path"] + ":")
+        for text in folder_errors[idx]:
+            err_control.eprint(text)
+        for spec, (errors, fingerprint, skipped, plots, report) in zip(specs, results):
+            if spec.folder_idx != idx:
+                continue
+            print("\tGerando caso " + str(spec.num_case) + "...")
+            for text in errors:
+                err_control.eprint(text)
+            if skipped:
+                print("\t\tOK: Entradas inalteradas, caso mantido")
+            elif len(errors) == 0:
                 print("\t\tOK: Sem erro de execucao")
             else:
-                print("\t\tDiretorio do teste: " + dt_root + dt_paths[idx] + dt_pos_path + str(num_case))
+                print("\t\tDiretorio do teste: " + config.root + spec.folder + config.case_prefix + str(spec.num_case))
+
+    # Relatorio da execucao em json
+    if report_path is None:
+        report_path = config.out_path + "run_report.json"
+    options = {"config": os.path.abspath(config_path), "workers": workers, "force": force, "chunksize": chunksize,
+               "npz_output": config.npz_output, "consolidated": consolidated, "plot_mode": plot_mode,
+               "profile": profile, "trace_memory": trace_memory, "resample_period": config.resample_period,
+               "resample_mode": config.resample_mode, "merge": merge}
+    write_run_report(report_path, options, config, specs, folder_errors, results, run_stages, time.perf_counter() - run_start)
 
     # Conclui o processamento
     print("\n*** Processamento concluido! ***")
     print("Quantidade total de erros encontrados: " + str(err_control.get_num_global_error()))
 
 
-main()
+# Inclusao dos erros de escrita no resultado de um caso
+# Entrada:
+#   result: tupla retornada por _run_case
+#   write_errors: lista com os erros de escrita dos arquivos do caso
+# Saida:
+#   Tupla (errors, fingerprint, skipped, plots, report), sem assinatura se a escrita falhou (processado novamente)
+def _finish_result(result, write_errors):
+    errors, fingerprint, skipped, plots, report = result[:5]
+    for text in write_errors:
+        errors.append(text)
+        kind = text.split(" - ", 1)[0]
+        report["errors"][kind] = report["errors"].get(kind, 0) + 1
+        fingerprint = None
+    return errors, fingerprint, skipped, plots, report
+
+
+'''
+Metodo para execucao de um caso isolado, com controle de erros proprio
+'''
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   spec: objeto CaseSpec com as entradas do caso
+#   previous_fingerprint: assinatura das entradas na ultima execucao (None para forcar o processamento)
+# Saida:
+#   errors: lista com as mensagens de erro do caso
+#   fingerprint: assinatura das entradas do caso (None em caso de falha)
+#   skipped: True se o caso nao mudou e nao foi processado novamente
+#   plots: lista com os graficos a serem renderizados posteriormente
+#   report: dicionario com as metricas do caso para o relatorio da execucao
+#   outputs: lista de tuplas (paths, data) com os arquivos de treinamento formatados, escritos pelo processo principal
+def _run_case(config, spec, previous_fingerprint=None):
+    global err_control
+    previous_control = err_control
+    err_control = ErrorPrint(echo=False)
+    profile_path = config.out_path + "profile/" + spec.key + ".prof" if config.profile else None
+    metrics = CaseMetrics(spec.key, profile_path, config.trace_memory)
+    fingerprint, skipped, plots = None, False, []
+    outputs = []
+    metrics.start()
+    try:
+        for text in spec.errors:  # Erros da resolucao das entradas
+            err_control.eprint(text)
+        fingerprint, skipped, plots = process_case(config, spec, previous_fingerprint, metrics,
+                                                   lambda paths, data: outputs.append((paths, data)))
+    except Exception as e:
+        err_control.eprint("Falha no processamento do caso - " + repr(e))
+    finally:
+        metrics.stop()
+        errors = err_control.get_messages()
+        report = metrics.to_dict()
+        report["errors"] = dict(err_control.get_kinds())
+        err_control = previous_control
+    return errors, fingerprint, skipped, plots, report, outputs
+
+
+'''
+Metodo de processamento de um caso: leitura, filtragem, calculo das distancias, graficos e arquivos de treinamento
+'''
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   spec: objeto CaseSpec com as entradas do caso
+#   previous_fingerprint: assinatura das entradas na ultima execucao (None para forcar o processamento)
+#   metrics: objeto CaseMetrics para tempos e contagens das etapas (None para nao registrar)
+#   emit: funcao emit(paths, data) que recebe os arquivos de treinamento formatados (None para escrever no momento)
+# Saida:
+#   fingerprint: assinatura das entradas do caso
+#   skipped: True se o caso nao mudou e nao foi processado novamente
+#   plots: lista com os graficos a serem renderizados posteriormente (vazia se plot_mode diferente de "defer")
+def process_case(config, spec, previous_fingerprint=None, metrics=None, emit=None):
+    if metrics is None:
+        metrics = CaseMetrics(spec.key)
+    flag_lateral = config.flag_lateral
+    npz_output = config.npz_output
+
+    # Cria o navio do teste com as dimensoes do p3d
+    with metrics.stage("p3d"):
+        ship_dim = P3D_file(spec.path_p3d, config.p3d_cache_path).find_dimensions()
+    ship = Ship(spec.ship_fullname, ship_dim, spec.velocity)
+
+    # Verifica se as entradas do caso mudaram desde a ultima execucao
+    with metrics.stage("fingerprint"):
+        resample = None if config.resample_period is None else (config.resample_period, config.resample_mode)
+        extra = [[variant for variant, _ in spec.variants], _oscillation_signature(config, spec)]
+        fingerprint = case_fingerprint(spec.path_case, spec.path_p3d, spec.df_case, spec.buoys, spec.target, spec.velocity,
+                                       flag_lateral, spec.channel, resample, extra)
+    # Caso mantido apenas se todas as saidas existem, inclusive os graficos (execucao anterior sem graficos ou interrompida
+    # antes dos graficos adiados)
+    outputs = [spec.path_out, spec.path_out_compiled, spec.path_stats] + [path for _, path in spec.variants]
+    if npz_output:
+        outputs.append(spec.path_out_npz)
+    if config.plot_mode != "none":
+        outputs.extend(plot[0] for plot in case_plots(spec, flag_lateral))
+    if fingerprint == previous_fingerprint and all(os.path.exists(path) for path in outputs):
+        return fingerprint, True, []
+
+    df = compute_case(config, spec, ship, metrics)
+    plots = write_case(config, spec, df, flag_lateral, metrics, emit)
+    return fingerprint, False, plots
+
+
+# Deteccao de comando de maquina oscilatorio com os limites da configuracao
+# Entrada:
+#   config: objeto DatasetConfig com os limites da deteccao
+#   spec: objeto CaseSpec com o perfil oscilatorio do caso (oscillation_velocity diferente de None)
+#   validator: objeto TrajectoryValidator que registra a deteccao no relatorio
+#   time_stamp: vetor com o tempo das amostras filtradas
+#   command: vetor com o comando de maquina original das amostras filtradas
+# Saida:
+#   True se o comando e oscilatorio
+def oscillation_verdict(config, spec, validator, time_stamp, command):
+    osc = config.oscillation
+    min_step = osc["min_step"] * np.abs(spec.oscillation_velocity.rpm_table).max()
+    oscillating = validator.check_oscillation(time_stamp, command, min_step, osc["min_reversals"], osc["reversals_per_minute"])
+    validator.oscillation["label"] = spec.oscillation_label
+    return oscillating
+
+
+# Embarcacao com o perfil de velocidade usado na discretizacao de um caso (perfil alternativo se a deteccao esta ativa e o
+# comando de maquina do log filtrado for oscilatorio)
+# Obs.: usado tambem por Augment_Data.py e Replay_Log.py, para que todos os caminhos discretizem com o mesmo perfil
+# Entrada:
+#   config: objeto DatasetConfig com os limites da deteccao
+#   spec: objeto CaseSpec com as entradas do caso
+#   ship: objeto Ship com o perfil de velocidade de spec.velocity
+#   time_stamp: vetor com o tempo das amostras filtradas
+#   command: vetor com o comando de maquina das amostras filtradas
+#   validator: objeto TrajectoryValidator que registra a deteccao no relatorio (None para nao registrar)
+# Saida:
+#   Objeto Ship com o perfil de velocidade do caso (o proprio ship se o perfil nao muda)
+def case_ship(config, spec, ship, time_stamp, command, validator=None):
+    if spec.oscillation_velocity is None:
+        return ship
+    if validator is None:
+        validator = TrajectoryValidator(spec.buoys, spec.target, ship)
+    oscillating = oscillation_verdict(config, spec, validator, time_stamp, command)
+    if spec.oscillation_override:  # Perfil oscilatorio ja definido pelo override
+        validator.oscillation["profile"] = spec.oscillation_profile
+        return ship
+    if not oscillating or not config.oscillation["detect"]:
+        return ship
+    ship = copy.copy(ship)
+    ship.velocity = spec.oscillation_velocity
+    validator.oscillation["profile"] = spec.oscillation_profile
+    return ship
+
+
+# Intermediario completo de um caso: todas as distancias, cog/sog/local_cog e comando de maquina original e discreto
+# Obs.: guardado em config.intermediate_dir com os erros da leitura, reaproveitado enquanto as entradas nao mudarem
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   spec: objeto CaseSpec com as entradas do caso
+#   ship: objeto Ship da embarcacao do caso
+#   metrics: objeto CaseMetrics para tempos e contagens das etapas (None para nao registrar)
+#   control: objeto ErrorPrint que recebe os erros do caso (None para o controle global)
+# Saida:
+#   DataFrame com as colunas do log e as variaveis calculadas, sem reamostragem e sem arredondamento
+def case_intermediate(config, spec, ship, metrics=None, control=None):
+    global err_control
+    if control is None:
+        control = err_control
+    if metrics is None:
+        metrics = CaseMetrics(spec.key)
+    real_param = spec.columns
+    buoys = spec.buoys
+    target = spec.target
+    channel = spec.channel
+
+    # Consulta o intermediario guardado pela assinatura das entradas (independente do modo das distancias)
+    path_cache = None
+    if config.intermediate_dir is not None:
+        path_cache = config.intermediate_dir + spec.key + ".npz"
+        with metrics.stage("fingerprint"):
+            fingerprint = case_fingerprint(spec.path_case, spec.path_p3d, spec.df_case, buoys, target, spec.velocity, "intermediate",
+                                           channel, extra=_oscillation_signature(config, spec))
+        if not config.refresh_intermediate and os.path.exists(path_cache):
+            try:
+                with metrics.stage("intermediate"):
+                    metadata, columns = load_case_npz(path_cache)
+                    df = pd.DataFrame({col: np.array(values) for col, values in columns.items()}) if metadata["fingerprint"] == fingerprint else None
+                if df is not None:
+                    for text in metadata["errors"]:  # Mesmos erros da leitura original
+                        control.eprint(text)
+                    metrics.validation = metadata["validation"]
+                    metrics.count("intermediate_cached", 1)
+                    return df
+            except Exception:
+                pass  # Intermediario corrompido e calculado novamente
+    first_error = len(control.get_messages())
+
+    # Leitura apenas das colunas utilizadas com validacao e filtragem dos dados a cada bloco
+    validator = TrajectoryValidator(buoys, target, ship)
+
+    def chunk_filter(chunk):
+        with metrics.stage("validate"):
+            validator.update(chunk)
+        with metrics.stage("filter"):
+            return filter_trajectory(chunk, buoys, target, ship, metrics)
+
+    with metrics.stage("read"):  # Inclui o tempo de validacao e filtragem
+        df = read_simulation_log(spec.path_case, real_param, chunk_filter, config.chunksize)
+
+    # Comando de maquina oscilatorio usa o perfil de velocidade alternativo
+    with metrics.stage("validate"):
+        ship = case_ship(config, spec, ship, df["time_stamp"].values, df[real_param[8]].values, validator)
+
+    # Calcula as distancias dos dois modos e discretiza a velocidade
+    with metrics.stage("geometry"):
+        x, y, zz = df["x"].values, df["y"].values, df["zz"].values
+        df["distance_port"], df["distance_starboard"], _ = ship.calc_dist_lateral_array(x, y, zz, channel, target, check_heading=False)
+        df["distance_midline"], df["distance_target"] = ship.calc_dist_midline_array(x, y, zz, channel, target, check_heading=False)
+        df["cog"], df["sog"], df["local_cog"] = ship.calc_cog_sog_array(x, y, zz, channel, df["vx"].values, df["vy"].values)
+    with metrics.stage("validate"):
+        validator.check_margins(df["distance_port"].values, df["distance_starboard"].values)
+        validator.emit(control)
+    metrics.validation = validator.report()
+    with metrics.stage("discretize"):
+        df["original_propeller"] = df[real_param[8]]
+        levels = ship.discrete_level_array(df[real_param[8]].values, control)
+        if levels.dtype.kind == "f":  # Amostras sem comando de maquina (reportadas na discretizacao) fora do treinamento
+            keep = ~np.isnan(levels)
+            metrics.count("propeller_nan", np.count_nonzero(~keep))
+            df = df[keep].reset_index(drop=True)
+            levels = levels[keep].astype(int)
+        df[real_param[8]] = levels
+        df["discrete_propeller"] = ship.corresp_vel_array(levels)
+
+    if path_cache is not None:
+        with metrics.stage("intermediate"):
+            if not os.path.exists(config.intermediate_dir):
+                os.makedirs(config.intermediate_dir, exist_ok=True)
+            path_tmp = path_cache[:-len(".npz")] + "_tmp.npz"
+            write_case_npz(path_tmp, df, {"fingerprint": fingerprint, "errors": control.get_messages()[first_error:],
+                                          "validation": metrics.validation})
+            os.replace(path_tmp, path_cache)
+    return df
+
+
+# Calculo das variaveis de treinamento de um caso, sem escrita em disco
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   spec: objeto CaseSpec com as entradas do caso
+#   ship: objeto Ship da embarcacao do caso
+#   metrics: objeto CaseMetrics para tempos e contagens das etapas (None para nao registrar)
+#   control: objeto ErrorPrint que recebe os erros do caso (None para o controle global)
+# Saida:
+#   DataFrame com as colunas do log e as variaveis calculadas nos dois modos de distancia (inclui as colunas auxiliares)
+def compute_case(config, spec, ship, metrics=None, control=None):
+    if metrics is None:
+        metrics = CaseMetrics(spec.key)
+    real_param = spec.columns
+    df = case_intermediate(config, spec, ship, metrics, control)
+
+    # Reamostragem opcional, mantendo as amostras de mudanca de comando de leme e maquina
+    if config.resample_period is not None:
+        with metrics.stage("resample"):
+            df = resample_trajectory(df, config.resample_period, config.resample_mode,
+                                     ["rudder_demanded_orientation_0", real_param[8]], ["zz", "cog", "local_cog"])
+        metrics.count("resampled", len(df))
+    df = df.round({"distance_port": 3, "distance_starboard": 3, "distance_midline": 3, "distance_target": 3})
+    df = df.round({"cog": 3, "sog": 3, "local_cog": 3})
+    return df
+
+
+# Conversao para as colunas dos arquivos de treinamento
+# Entrada:
+#   df: DataFrame gerado por compute_case
+#   spec: objeto CaseSpec com as entradas do caso
+#   flag_lateral: True para distancias bombordo e boreste, False para distancia a linha central
+# Saida:
+#   DataFrame sem as colunas auxiliares e com os nomes de rudder_demanded e propeller_demanded
+def training_frame(df, spec, flag_lateral):
+    distances = ["distance_midline"] if flag_lateral == True else ["distance_port", "distance_starboard"]
+    df = df.drop(columns=['original_propeller', 'discrete_propeller', 'x', 'y'] + distances)
+    return df.rename(index=str, columns={spec.columns[8]: "propeller_demanded", "rudder_demanded_orientation_0": "rudder_demanded"})
+
+
+# Graficos de diagnostico de um caso
+# Entrada:
+#   spec: objeto CaseSpec com as entradas do caso
+#   flag_lateral: True para distancias bombordo e boreste, False para distancia a linha central
+# Saida:
+#   Lista de tuplas (caminho do .png, coluna, nome do eixo y, titulo)
+def case_plots(spec, flag_lateral):
+    path_fig = spec.path_fig
+    list_plots = [(path_fig + "propeller.png", spec.columns[8], "Máquina(-)", "Comando de máquina")]
+    if flag_lateral == True:
+        list_plots.append((path_fig + "dist_port.png", "distance_port", "Distância(m)", "Distância da margem a bombordo"))
+        list_plots.append((path_fig + "dist_star.png", "distance_starboard", "Distância(m)", "Distância da margem a boreste"))
+    else:
+        list_plots.append((path_fig + "dist_mid.png", "distance_midline", "Distância(m)", "Distância da linha central"))
+    list_plots.append((path_fig + "dist_target.png", "distance_target", "Distância(m)", "Distância ao final do canal"))
+    list_plots.append((path_fig + "rudder.png", "rudder_demanded_orientation_0", "Ângulo(rad)", "Comando de leme"))
+    list_plots.append((path_fig + "cog.png", "cog", "Cog(º)", "Course over ground"))
+    list_plots.append((path_fig + "sog.png", "sog", "sog(m/s)", "Speed over ground"))
+    list_plots.append((path_fig + "local_cog.png", "local_cog", "Local Cog(º)", "Course over ground - Local"))
+    return list_plots
+
+
+# Escrita dos arquivos de treinamento e dos graficos de um caso
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   spec: objeto CaseSpec com as entradas do caso
+#   df: DataFrame gerado por compute_case
+#   flag_lateral: True para distancias bombordo e boreste, False para distancia a linha central
+#   metrics: objeto CaseMetrics para tempos e contagens das etapas (None para nao registrar)
+#   emit: funcao emit(paths, data) que recebe os arquivos de treinamento formatados (None para escrever no momento)
+# Saida:
+#   Lista com os graficos a serem renderizados posteriormente (vazia se plot_mode diferente de "defer")
+def write_case(config, spec, df, flag_lateral, metrics=None, emit=None):
+    if metrics is None:
+        metrics = CaseMetrics(spec.key)
+    simul_data = config.simul_data
+    mult_param_data = config.mult_param_data
+    plot_mode = config.plot_mode
+    real_param = spec.columns
+    path_out = spec.path_out
+    path_out_compiled = spec.path_out_compiled
+
+    # Gera o arquivo de treinamento apropriado com cabecalho que define os parametros da simulacao
+    if not os.path.exists(spec.path_fig):
+        os.makedirs(spec.path_fig)
+    if not os.path.exists(config.out_path_compiled):
+        os.makedirs(config.out_path_compiled)
+    lines = []
+    for p in simul_data:
+        if mult_param_data.get(p) is None:
+            lines.append(p + ": " + spec.params[p][0] + "\r\n")
+        else:
+            lines.append(p + ": " + "".join(value + " " for value in spec.params[p]) + "\r\n")
+    lines.append("\r\n")
+    header = "".join(lines)
+
+    # Plotagem dos graficos e salva em .png
+    list_plots = case_plots(spec, flag_lateral)
+
+    # Series reduzidas para exibicao, renderizadas agora ou devolvidas para renderizacao posterior
+    plots = []
+    if plot_mode != "none":
+        with metrics.stage("plots"):
+            for path_png, col, ylabel, title in list_plots:
+                x, y = PlotRenderer.downsample(df["time_stamp"].values, df[col].values)
+                plots.append((path_png, x, y, "Tempo(s)", ylabel, title))
+            if plot_mode == "all":
+                render_plots(plots)
+                plots = []
+
+    # Remove colunas auxiliares e renomeia as colunas
+    df_full = df
+    df = training_frame(df, spec, flag_lateral)
+
+    # Formata o arquivo uma unica vez, o mesmo conteudo vai para a pasta do caso e para a pasta de compilados
+    with metrics.stage("format"):
+        data = format_training_file(header, df)
+    outputs = [([path_out, path_out_compiled], data)]
+
+    # Estatisticas de normalizacao do caso, juntadas pelo processo principal em stats.json
+    with metrics.stage("stats"):
+        stats = FeatureStats()
+        stats.update(df)
+        if not os.path.exists(os.path.dirname(spec.path_stats)):
+            os.makedirs(os.path.dirname(spec.path_stats), exist_ok=True)
+        outputs.append(([spec.path_stats], json.dumps(stats.to_dict()).encode("utf-8")))
+
+    # Variantes nomeadas: projecao de colunas do mesmo intermediario, sem recalcular a geometria
+    for variant, path in spec.variants:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with metrics.stage("format"):
+            df_variant = training_frame(df_full, spec, variant["lateral"]).drop(columns=variant["drop"])
+            outputs.append(([path], format_training_file(header, df_variant)))
+
+    for paths, data in outputs:
+        if emit is None:
+            with metrics.stage("write"):
+                write_output(paths, data)
+        else:
+            emit(paths, data)
+
+    # Formato binario opcional com os parametros da simulacao como metadados
+    if config.npz_output:
+        with metrics.stage("npz"):
+            write_case_npz(spec.path_out_npz, df, case_metadata(spec.params, mult_param_data))
+
+    return plots
+
+
+'''
+Metodos de acesso preguicoso aos casos processados (consumo direto no treinamento, sem passar pelos arquivos)
+'''
+# Calculo isolado de um caso, com os erros registrados em um controle proprio (o controle global nao e alterado)
+# Obs.: executado na thread de antecipacao ou na thread de quem consome
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   spec: objeto CaseSpec com as entradas do caso
+#   flag_lateral: True para distancias bombordo e boreste, False para distancia a linha central
+#   write: True para escrever tambem os arquivos de treinamento do caso
+# Saida:
+#   errors: lista com as mensagens de erro do caso
+#   df: DataFrame com as colunas dos arquivos de treinamento (None em caso de falha)
+def _compute_item(config, spec, flag_lateral, write):
+    control = ErrorPrint(echo=False)
+    df = None
+    try:
+        for text in spec.errors:
+            control.eprint(text)
+        ship = Ship(spec.ship_fullname, P3D_file(spec.path_p3d, config.p3d_cache_path).find_dimensions(control), spec.velocity)
+        df = compute_case(config, spec, ship, control=control)
+        if write:
+            write_case(config, spec, df, flag_lateral)
+        df = training_frame(df, spec, flag_lateral)
+    except Exception as e:
+        control.eprint("Falha no processamento do caso - " + repr(e))
+        df = None
+    return control.get_messages(), df
+
+
+# Gerador dos casos processados sob demanda, com calculo antecipado dos proximos casos em uma thread separada
+# Entrada:
+#   config: objeto DatasetConfig ou caminho do arquivo yaml (None para dataset.yaml ao lado do script)
+#   lateral: True para distancias bombordo e boreste, False para linha central (None para flag_lateral da configuracao)
+#   prefetch: quantidade de casos calculados antes do consumo (0 para calcular apenas quando solicitado)
+#   arrays: True para entregar dicionarios de vetores numpy em vez de DataFrames
+#   write: True para escrever tambem os arquivos de treinamento, variantes e graficos (e os caches de p3d, planilhas e intermediarios)
+# Saida:
+#   Gerador de tuplas (CaseSpec, DataFrame ou dicionario de vetores), na ordem da configuracao
+def iter_cases(config=None, lateral=None, prefetch=1, arrays=False, write=False):
+    global err_control
+    if err_control is None:
+        err_control = ErrorPrint()
+    control = err_control  # Os erros dos casos sao registrados no controle de quem consome
+    if not isinstance(config, DatasetConfig):
+        config = DatasetConfig(config if config is not None else default_config_path())
+    if not write:
+        config = copy.copy(config)
+        config.p3d_cache_path = None
+        config.cases_cache_dir = None
+        config.intermediate_dir = None
+    flag_lateral = config.flag_lateral if lateral is None else lateral
+
+    specs, folder_errors = config.plan()
+    for folder, errors in zip(config.folders, folder_errors):
+        for text in errors:
+            control.eprint(folder["path"] + ": " + text)
+
+    # Producao dos casos em uma thread separada, no maximo prefetch casos a frente do consumo
+    # Cada caso registra os erros no proprio controle, que volta junto com o resultado
+    executor = None
+    if prefetch > 0:
+        executor = ThreadPoolExecutor(max_workers=1)
+        futures = [executor.submit(_compute_item, config, spec, flag_lateral, write) for spec in specs[:prefetch]]
+
+        def produce():
+            for idx, spec in enumerate(specs):
+                if idx + prefetch < len(specs):
+                    futures.append(executor.submit(_compute_item, config, specs[idx + prefetch], flag_lateral, write))
+                yield spec, futures[idx].result()
+
+        results = produce()
+    else:
+        results = ((spec, _compute_item(config, spec, flag_lateral, write)) for spec in specs)
+
+    try:
+        for spec, (errors, df) in results:
+            for text in errors:
+                control.eprint(spec.key + ": " + text)
+            if df is None:
+                continue
+            if arrays:
+                yield spec, {col: df[col].values for col in df.columns}
+            else:
+                yield spec, df
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+'''
+Classe para fila de casos em arquivos compartilhados entre processos e maquinas (modo shard, sem servicos externos)
+'''
+class ShardQueue:
+    # Construtor da classe
+    # Obs.: cada caso e reservado por um arquivo <caso>.lock criado de forma atomica e renovado periodicamente;
+    # reservas nao renovadas ha mais de stale_seconds sao de shards interrompidos e podem ser assumidas
+    # Entrada:
+    #   path: diretorio da execucao compartilhado pelos shards
+    #   name: nome do shard (None para maquina-pid)
+    #   stale_seconds: tempo sem renovacao para considerar uma reserva abandonada
+    # Saida:
+    #   None
+    def __init__(self, path, name=None, stale_seconds=600):
+        self.path = path
+        self.name = name if name is not None else socket.gethostname() + "-" + str(os.getpid())
+        self.stale_seconds = stale_seconds
+        os.makedirs(path, exist_ok=True)
+        self.held = {}  # Reservas deste shard: caso -> identificacao gravada no arquivo de reserva
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None  # Renovacao iniciada na primeira reserva
+
+    # Metodo para verificar se um caso ja foi concluido por algum shard
+    # Entrada:
+    #   key: nome do caso
+    # Saida:
+    #   True se o caso possui resultado
+    def is_done(self, key):
+        return os.path.exists(self.path + key + ".json")
+
+    # Metodo para reservar um caso
+    # Entrada:
+    #   key: nome do caso
+    # Saida:
+    #   True se o caso foi reservado por este shard
+    def claim(self, key):
+        path_lock = self.path + key + ".lock"
+        token = self.name + "|" + str(time.time())
+        for _ in range(3):
+            try:
+                fd = os.open(path_lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                observed = self._read_lock(path_lock)
+                if observed is None:
+                    continue  # Reserva liberada durante a verificacao
+                if not self._is_stale(observed[1]):
+                    return False
+                # Reserva abandonada: outro shard pode ter assumido e criado uma reserva nova entre a verificacao e a
+                # renomeacao, entao o arquivo renomeado so e descartado se ainda for a reserva abandonada observada
+                path_stale = path_lock + "." + self.name + ".stale"
+                try:
+                    os.rename(path_lock, path_stale)
+                except OSError:
+                    return False
+                if self._read_lock(path_stale) != observed:
+                    self._restore_lock(path_stale, path_lock)
+                    return False
+                os.remove(path_stale)
+                continue
+            with os.fdopen(fd, "w") as f:
+                f.write(token)
+            with self.lock:
+                self.held[key] = token
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._heartbeat, daemon=True)
+                    self.thread.start()
+            if self.is_done(key):  # Concluido por outro shard entre a verificacao e a reserva
+                self.release(key)
+                return False
+            return True
+        return False
+
+    # Metodo para registrar o resultado de um caso e liberar a reserva
+    # Entrada:
+    #   key: nome do caso
+    #   result: tupla (errors, fingerprint, skipped, plots, report) do caso
+    # Saida:
+    #   None
+    def complete(self, key, result):
+        errors, fingerprint, skipped, plots, report = result
+        data = {"shard": self.name, "errors": errors, "fingerprint": fingerprint, "skipped": skipped, "report": report}
+        write_output([self.path + key + ".json"], json.dumps(data, indent=4, ensure_ascii=False).encode("utf-8"))
+        self.release(key)
+
+    # Metodo para leitura do resultado de um caso
+    # Entrada:
+    #   key: nome do caso
+    # Saida:
+    #   Tupla (errors, fingerprint, skipped, plots, report) e nome do shard que processou o caso
+    def result(self, key):
+        with open(self.path + key + ".json", encoding="utf-8") as f:
+            data = json.load(f)
+        return (data["errors"], data["fingerprint"], data["skipped"], [], data["report"]), data["shard"]
+
+    # Metodo para liberar a reserva de um caso (apenas se ainda pertence a este shard)
+    # Entrada:
+    #   key: nome do caso
+    # Saida:
+    #   None
+    def release(self, key):
+        with self.lock:
+            token = self.held.pop(key, None)
+        path_lock = self.path + key + ".lock"
+        try:
+            with open(path_lock) as f:
+                owner = f.read()
+            if owner == token:
+                os.remove(path_lock)
+        except OSError:
+            pass
+
+    # Metodo para encerrar a renovacao e liberar as reservas restantes
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        for key in list(self.held):
+            self.release(key)
+        try:
+            os.remove(self.path + "clock_" + self.name)
+        except OSError:
+            pass
+
+    # Metodo para leitura de um arquivo de reserva
+    # Entrada:
+    #   path_lock: caminho do arquivo de reserva
+    # Saida:
+    #   Tupla (identificacao do shard, ultima renovacao) ou None se o arquivo nao existe
+    def _read_lock(self, path_lock):
+        try:
+            with open(path_lock) as f:
+                return f.read(), os.fstat(f.fileno()).st_mtime
+        except FileNotFoundError:
+            return None
+
+    # Metodo para devolver uma reserva renomeada por engano, sem sobrescrever uma reserva criada nesse intervalo
+    # Entrada:
+    #   path_stale: caminho do arquivo renomeado
+    #   path_lock: caminho original do arquivo de reserva
+    # Saida:
+    #   None
+    def _restore_lock(self, path_stale, path_lock):
+        try:
+            os.link(path_stale, path_lock)
+        except FileExistsError:
+            pass  # Caso reservado por um terceiro shard nesse intervalo: processado duas vezes, com as mesmas saidas atomicas
+        except OSError:
+            if not os.path.exists(path_lock):  # Sistema de arquivos sem hard link
+                os.rename(path_stale, path_lock)
+                return
+        os.remove(path_stale)
+
+    # Metodo para verificar se uma reserva esta abandonada, pelo relogio do sistema de arquivos compartilhado
+    # Entrada:
+    #   mtime: ultima renovacao do arquivo de reserva
+    # Saida:
+    #   True se a reserva nao foi renovada ha mais de stale_seconds
+    def _is_stale(self, mtime):
+        path_clock = self.path + "clock_" + self.name
+        with open(path_clock, "w"):
+            pass
+        return os.stat(path_clock).st_mtime - mtime > self.stale_seconds
+
+    # Laco de renovacao das reservas deste shard
+    # Entrada:
+    #   None
+    # Saida:
+    #   None
+    def _heartbeat(self):
+        while not self.stop.wait(self.stale_seconds / 4):
+            with self.lock:
+                keys = list(self.held)
+            for key in keys:
+                try:
+                    os.utime(self.path + key + ".lock")
+                except OSError:
+                    pass
+
+
+# Execucao de um shard: reserva e processa casos ate nao restar caso livre
+# Entrada:
+#   config: objeto DatasetConfig com a configuracao e as opcoes de execucao
+#   specs: lista de CaseSpec
+#   previous: lista com a assinatura de cada caso na ultima execucao consolidada
+#   shard_queue: objeto ShardQueue da execucao
+#   workers: quantidade de processos em paralelo (1 para execucao sequencial)
+# Saida:
+#   Lista com o nome dos casos processados por este shard
+def run_shard(config, specs, previous, shard_queue, workers=None):
+    writer = OutputWriter()
+    processed = []
+
+    # Resultado registrado apos a escrita dos arquivos do caso
+    def finish(spec, result):
+        def callback(write_errors):
+            shard_queue.complete(spec.key, _finish_result(result, write_errors))
+        writer.submit(spec.key, result[5], callback)
+        processed.append(spec.key)
+        status = "erro" if result[1] is None else ("mantido" if result[2] else "OK")
+        print("\t" + spec.key + " (" + spec.folder + config.case_prefix + str(spec.num_case) + "): " + status)
+
+    # Novas passagens enquanto houver casos livres ou reservas abandonadas
+    max_workers = workers if workers is not None else (os.cpu_count() or 1)
+    progressed = True
+    while progressed:
+        progressed = False
+        if max_workers == 1:
+            for spec, previous_fingerprint in zip(specs, previous):
+                if shard_queue.is_done(spec.key) or not shard_queue.claim(spec.key):
+                    continue
+                progressed = True
+                finish(spec, _run_case(config, spec, previous_fingerprint))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                running = {}
+                for spec, previous_fingerprint in zip(specs, previous):
+                    while len(running) >= max_workers:  # Reserva apenas quando ha processo livre
+                        finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            finish(running.pop(future), future.result())
+                    if shard_queue.is_done(spec.key) or not shard_queue.claim(spec.key):
+                        continue
+                    progressed = True
+                    running[executor.submit(_run_case, config, spec, previous_fingerprint)] = spec
+                for future in as_completed(running):
+                    finish(running[future], future.result())
+    writer.close()
+    shard_queue.close()
+    return processed
+
+
+# Juncao dos resultados de todos os shards de uma execucao
+# Entrada:
+#   shard_queue: objeto ShardQueue da execucao
+#   specs: lista de CaseSpec
+# Saida:
+#   results: lista com a tupla (errors, fingerprint, skipped, plots, report) de cada caso
+#   shards: dicionario com a quantidade de casos de cada shard
+#   run_stages: soma dos tempos das etapas gerais dos shards
+def merge_shards(shard_queue, specs):
+    results = []
+    shards = {}
+    for spec in specs:
+        if shard_queue.is_done(spec.key):
+            result, name = shard_queue.result(spec.key)
+            shards[name] = shards.get(name, 0) + 1
+        else:
+            text = "Caso nao processado pelos shards"
+            report = CaseMetrics(spec.key).to_dict()
+            report["errors"] = {text: 1}
+            result = ([text], None, False, [], report)
+        results.append(result)
+
+    run_stages = {}
+    for file in sorted(os.listdir(shard_queue.path)):
+        if file.startswith("shard_") and file.endswith(".json"):
+            with open(shard_queue.path + file, encoding="utf-8") as f:
+                for name, value in json.load(f)["stages"].items():
+                    run_stages["shards_" + name] = run_stages.get("shards_" + name, 0) + value
+    return results, shards, run_stages
+
+
+'''
+Metodos de calibracao da deteccao de comando de maquina oscilatorio (casos marcados manualmente em oscillation_labels)
+'''
+# Inversoes do comando de maquina de um caso com perfil oscilatorio, com os erros registrados separadamente
+# Entrada:
+#   config: objeto DatasetConfig com os limites da deteccao
+#   spec: objeto CaseSpec com oscillation_velocity diferente de None
+# Saida:
+#   Dicionario com o caso, a marcacao manual, as inversoes, a taxa por minuto, o resultado da deteccao e os erros
+def _calibration_item(config, spec):
+    control = ErrorPrint(echo=False)
+    item = {"key": spec.key, "folder": spec.folder, "num_case": spec.num_case, "label": spec.oscillation_label,
+            "reversals": None, "per_minute": None, "oscillating": None}
+    try:
+        for text in spec.errors:
+            control.eprint(text)
+        ship = Ship(spec.ship_fullname, P3D_file(spec.path_p3d, config.p3d_cache_path).find_dimensions(control), spec.velocity)
+        df = case_intermediate(config, spec, ship, control=control)  # Comando original guardado no intermediario
+        validator = TrajectoryValidator(spec.buoys, spec.target, ship)
+        item["oscillating"] = oscillation_verdict(config, spec, validator, df["time_stamp"].values, df["original_propeller"].values)
+        item["reversals"] = validator.oscillation["reversals"]
+        item["per_minute"] = validator.oscillation["per_minute"]
+    except Exception as e:
+        control.eprint("Falha no processamento do caso - " + repr(e))
+    item["errors"] = control.get_messages()
+    return item
+
+
+# Comparacao da deteccao com a marcacao manual e limites sugeridos que separam os casos marcados dos demais
+# Obs.: cada limite sugerido fica entre o maior valor dos casos nao marcados e o menor valor dos casos marcados; sem
+# separacao pela medida o limite atual e mantido
+# Entrada:
+#   items: lista de dicionarios com label, reversals e per_minute de cada caso
+#   min_reversals: quantidade minima de inversoes atual
+#   reversals_per_minute: taxa minima de inversoes atual
+# Saida:
+#   Dicionario com a matriz de confusao dos limites atuais e dos sugeridos e os casos divergentes
+def oscillation_calibration(items, min_reversals, reversals_per_minute):
+    items = [item for item in items if item["reversals"] is not None]
+
+    # Matriz de confusao e casos divergentes de um par de limites
+    def evaluate(limit_reversals, limit_rate):
+        confusion = {"tp": 0, "fp": 0, "fn": 0, "tn": 0}
+        divergent = []
+        for item in items:
+            detected = item["reversals"] >= limit_reversals and item["per_minute"] >= limit_rate
+            confusion[("t" if detected == item["label"] else "f") + ("p" if detected else "n")] += 1
+            if detected != item["label"]:
+                divergent.append(item["key"])
+        return {"min_reversals": limit_reversals, "reversals_per_minute": limit_rate, "confusion": confusion, "divergent": divergent}
+
+    suggested = {"min_reversals": min_reversals, "reversals_per_minute": reversals_per_minute}
+    separable = {}
+    for name in suggested:
+        measure = "reversals" if name == "min_reversals" else "per_minute"
+        positive = [item[measure] for item in items if item["label"]]
+        negative = [item[measure] for item in items if not item["label"]]
+        separable[name] = len(positive) > 0 and len(negative) > 0 and min(positive) > max(negative)
+        if separable[name]:
+            if name == "min_reversals":
+                suggested[name] = (min(positive) + max(negative)) // 2 + 1
+            else:
+                suggested[name] = (min(positive) + max(negative)) / 2
+    return {"cases": len(items), "labeled": sum(1 for item in items if item["label"]),
+            "current": evaluate(min_reversals, reversals_per_minute),
+            "suggested": dict(evaluate(suggested["min_reversals"], suggested["reversals_per_minute"]), separable=separable)}
+
+
+# Calibracao da deteccao pelos casos com perfil oscilatorio da configuracao
+# Entrada:
+#   config: objeto DatasetConfig com os limites da deteccao
+#   specs: lista de CaseSpec
+#   workers: quantidade de processos em paralelo (1 para execucao sequencial)
+# Saida:
+#   Dicionario gravado em out_path/oscillation_calibration.json
+def calibrate_oscillation(config, specs, workers=None):
+    specs = [spec for spec in specs if spec.oscillation_velocity is not None]
+    if workers == 1:
+        items = [_calibration_item(config, spec) for spec in specs]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            items = list(executor.map(_calibration_item, [config] * len(specs), specs))
+    osc = config.oscillation
+    report = dict(oscillation_calibration(items, osc["min_reversals"], osc["reversals_per_minute"]),
+                  min_step=osc["min_step"], detect=osc["detect"], items=items)
+    if not os.path.exists(config.out_path):
+        os.makedirs(config.out_path)
+    write_output([config.out_path + "oscillation_calibration.json"],
+                 json.dumps(report, indent=4, ensure_ascii=False).encode("utf-8"))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera os arquivos de treinamento a partir dos logs do simulador")
+    parser.add_argument("--config", default=None, help="arquivo yaml com a configuracao dos casos (padrao: dataset.yaml ao lado do script)")
+    parser.add_argument("--workers", type=int, default=None, help="quantidade de processos em paralelo (1 para execucao sequencial)")
+    parser.add_argument("--force", action="store_true", help="processa todos os casos mesmo sem alteracao nas entradas (recalcula tambem os intermediarios)")
+    parser.add_argument("--chunksize", type=int, default=None, help="le os logs do simulador em blocos com essa quantidade de linhas")
+    parser.add_argument("--npz", action="store_true", help="gera tambem os casos compilados no formato binario .npz")
+    parser.add_argument("--consolidated", action="store_true", help="gera tambem um unico conjunto de treinamento com indice dos casos")
+    parser.add_argument("--plots", choices=["all", "defer", "none"], default="all",
+                        help="graficos gerados junto com cada caso, apos todos os casos ou nao gerados")
+    parser.add_argument("--report", default=None, help="arquivo json do relatorio da execucao (padrao: ../Output/run_report.json)")
+    parser.add_argument("--profile", action="store_true", help="captura o perfil de cada caso com cProfile (../Output/profile/)")
+    parser.add_argument("--tracemalloc", action="store_true", help="mede o pico de memoria alocada em cada caso")
+    parser.add_argument("--resample", type=float, default=None, help="reamostra as trajetorias com esse intervalo em segundos")
+    parser.add_argument("--resample-mode", choices=["mean", "decimate"], default=None,
+                        help="media de cada intervalo ou primeira amostra do intervalo (mudancas de comando sempre mantidas)")
+    parser.add_argument("--shard", default=None, metavar="EXECUCAO",
+                        help="processa como um shard da execucao, reservando os casos por arquivos compartilhados em out_path/shards/")
+    parser.add_argument("--merge", default=None, metavar="EXECUCAO",
+                        help="junta os resultados dos shards da execucao (manifesto, graficos adiados, consolidado e relatorio)")
+    parser.add_argument("--stale", type=float, default=600,
+                        help="segundos sem renovacao para assumir a reserva de um shard interrompido")
+    parser.add_argument("--calibrate-oscillation", action="store_true",
+                        help="compara a deteccao de comando oscilatorio com os casos marcados em oscillation_labels e sugere limites "
+                             "(../Output/oscillation_calibration.json), sem gerar os arquivos de treinamento")
+    args = parser.parse_args()
+    main(config_path=args.config, workers=args.workers, force=args.force, chunksize=args.chunksize, npz_output=args.npz,
+         consolidated=args.consolidated, plot_mode=args.plots, report_path=args.report, profile=args.profile,
+         trace_memory=args.tracemalloc, resample_period=args.resample, resample_mode=args.resample_mode, shard=args.shard,
+         merge=args.merge, stale_seconds=args.stale, calibrate=args.calibrate_oscillation)
@@ -0,0 +1,202 @@
+'''
+Codigo para avaliacao em lote das trajetorias simuladas pela rede (simulation_log_*) contra as manobras originais
+Uso: python Evaluate_Model.py <pasta do modelo com os simulation_log_*.txt> [--align time|distance] [--out resumo.csv]
+'''
+
+'''
+Importacao das bibliotecas a serem utilizadas
+'''
+import pandas as pd
+import numpy as np
+import argparse
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+import Data_Filter as df_lib
+
+
+'''
+Variaveis globais
+'''
+sample_period = 0.1  # Intervalo entre as amostras dos logs de simulacao (s)
+case_pattern = re.compile(r"_Caso(\d+)_")  # Numero do caso compilado no nome do log de simulacao
+metric_columns = {"midline": "distance_midline", "heading": "zz", "rudder": "rudder_demanded"}
+
+
+'''
+Metodos de avaliacao
+'''
+# Relacao entre o numero do caso compilado e o arquivo de treinamento original (mesma numeracao de Data_Filter.py)
+# Entrada:
+#   config: objeto DatasetConfig
+# Saida:
+#   Dicionario com o caminho do arquivo original de cada caso compilado
+def case_folder_relation(config):
+    specs, folder_errors = config.plan()
+    relation = {}
+    for spec in specs:
+        if spec.file is not None:
+            relation[spec.case_num] = spec.path_out
+    return relation
+
+
+# Alinhamento das duas trajetorias em uma base comum
+# Entrada:
+#   df_orig: DataFrame da manobra original
+#   df_simul: DataFrame da manobra simulada
+#   align: "time" pelo tempo desde o inicio ou "distance" pelo avanco em direcao ao target
+# Saida:
+#   base: vetor com a base comum (s ou m)
+#   orig: dicionario com as colunas originais interpoladas na base
+#   simul: dicionario com as colunas simuladas interpoladas na base
+def align_trajectories(df_orig, df_simul, align):
+    columns = list(metric_columns.values())
+    if align == "time":
+        t_orig = df_orig["time_stamp"].values - df_orig["time_stamp"].values[0]
+        t_simul = np.arange(len(df_simul)) * sample_period
+        base = t_simul[t_simul <= t_orig[-1]]
+        orig = {col: np.interp(base, t_orig, df_orig[col].values) for col in columns}
+        simul = {col: df_simul[col].values[:len(base)] for col in columns}
+    else:
+        # Avanco monotono: menor distancia ao target ja alcancada
+        p_orig = -np.minimum.accumulate(df_orig["distance_target"].values)
+        p_simul = -np.minimum.accumulate(df_simul["distance_target"].values)
+        start = max(p_orig[0], p_simul[0])
+        end = min(p_orig[-1], p_simul[-1])
+        base = np.linspace(start, end, max(min(len(df_orig), len(df_simul)), 2)) if end > start else np.empty(0)
+        orig = {col: _interp_progress(base, p_orig, df_orig[col].values) for col in columns}
+        simul = {col: _interp_progress(base, p_simul, df_simul[col].values) for col in columns}
+        base = -base
+    return base, orig, simul
+
+
+# Interpolacao por avanco (mantem a primeira amostra de cada trecho parado)
+# Entrada:
+#   base: vetor com o avanco de referencia
+#   progress: vetor nao decrescente com o avanco de cada amostra
+#   values: vetor com os valores de cada amostra
+# Saida:
+#   Vetor com os valores interpolados
+def _interp_progress(base, progress, values):
+    progress, first = np.unique(progress, return_index=True)
+    return np.interp(base, progress, values[first])
+
+
+# Tempo ate alcancar a distancia ao target
+# Entrada:
+#   time: vetor com o tempo de cada amostra
+#   distance_target: vetor com a distancia ao target de cada amostra
+#   reference: distancia ao target considerada chegada
+# Saida:
+#   Tempo da primeira amostra dentro da distancia (nan se nao alcancada)
+def time_to_target(time, distance_target, reference):
+    reached = np.flatnonzero(distance_target <= reference)
+    return time[reached[0]] if len(reached) > 0 else np.nan
+
+
+# Avaliacao de um log de simulacao
+# Entrada:
+#   path_simul: caminho do log de simulacao
+#   path_orig: caminho do arquivo de treinamento original
+#   align: "time" ou "distance"
+#   target_distance: distancia ao target considerada chegada (None para a distancia final da manobra original)
+# Saida:
+#   Dicionario com as metricas do caso
+def evaluate_case(path_simul, path_orig, align, target_distance=None):
+    df_orig = df_lib.read_training_file(path_orig)
+    df_simul = pd.read_csv(path_simul, sep=" ")
+    base, orig, simul = align_trajectories(df_orig, df_simul, align)
+
+    result = {"samples": len(base)}
+    for name, col in metric_columns.items():
+        diff = simul[col] - orig[col]
+        if col == "zz":
+            diff = (diff + 180) % 360 - 180  # Diferenca angular
+        result["rmse_" + name] = np.sqrt(np.mean(diff ** 2)) if len(base) > 0 else np.nan
+
+    # Tempo ate o target nas duas manobras
+    reference = df_orig["distance_target"].values[-1] if target_distance is None else target_distance
+    t_orig = df_orig["time_stamp"].values - df_orig["time_stamp"].values[0]
+    t_simul = np.arange(len(df_simul)) * sample_period
+    result["time_target_orig"] = time_to_target(t_orig, df_orig["distance_target"].values, reference)
+    result["time_target_simul"] = time_to_target(t_simul, df_simul["distance_target"].values, reference)
+    result["time_target_diff"] = result["time_target_simul"] - result["time_target_orig"]
+    return result
+
+
+# Execucao isolada de um caso, com o erro registrado no resultado
+# Entrada:
+#   item: tupla (log de simulacao, arquivo original, alinhamento, distancia ao target)
+# Saida:
+#   Dicionario com as metricas do caso ou com a mensagem de erro
+def _run_evaluation(item):
+    path_simul, path_orig, align, target_distance = item
+    try:
+        return evaluate_case(path_simul, path_orig, align, target_distance)
+    except Exception as e:
+        return {"error": repr(e)}
+
+
+'''
+Metodo principal
+'''
+def main(model_path, config_path=None, align="time", target_distance=None, out_path=None, workers=None):
+    df_lib.err_control = df_lib.ErrorPrint()
+    config = df_lib.DatasetConfig(config_path if config_path is not None else df_lib.default_config_path())
+    relation = case_folder_relation(config)
+
+    # Logs de simulacao do modelo e o caso original correspondente
+    items = []
+    rows = []
+    for file in sorted(os.listdir(model_path)):
+        match = case_pattern.search(file)
+        if not file.startswith("simulation_log") or not file.endswith(".txt") or match is None:
+            continue
+        case_num = int(match.group(1))
+        key = "Caso" + str(case_num).zfill(2)
+        path_orig = relation.get(case_num)
+        if path_orig is None or not os.path.exists(path_orig):
+            path_orig = config.out_path_compiled + key + config.file_extension  # Mesmo conteudo do arquivo da pasta
+        rows.append({"log": file, "case": key, "original": os.path.relpath(path_orig, config.out_path)})
+        items.append((os.path.join(model_path, file), path_orig, align, target_distance))
+    if len(items) == 0:
+        df_lib.err_control.eprint("Nenhum log de simulacao encontrado em " + model_path)
+        return None
+
+    # Avaliacao dos casos em paralelo
+    if workers == 1:
+        results = [_run_evaluation(item) for item in items]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_evaluation, items))
+    for row, result in zip(rows, results):
+        row.update(result)
+        if "error" in result:
+            df_lib.err_control.eprint("Falha na avaliacao de " + row["log"] + " - " + result["error"])
+
+    # Tabela resumo com a media dos casos
+    summary = pd.DataFrame(rows)
+    numeric = summary.select_dtypes(include=[np.number]).columns
+    summary = pd.concat([summary, pd.DataFrame([dict(summary[numeric].mean(), log="media")])], ignore_index=True)
+    if out_path is None:
+        out_path = os.path.join(model_path, "evaluation_" + align + ".csv")
+    summary.to_csv(out_path, index=False, sep=";", float_format="%.4f")
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(summary.drop(columns=["original"]).to_string(index=False, float_format=lambda v: "%.3f" % v))
+    print("\nResumo salvo em " + out_path)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara os logs de simulacao de um modelo com as manobras originais")
+    parser.add_argument("model_path", help="pasta com os simulation_log_*.txt do modelo")
+    parser.add_argument("--config", default=None, help="arquivo yaml com a configuracao dos casos (padrao: dataset.yaml ao lado do script)")
+    parser.add_argument("--align", choices=["time", "distance"], default="time",
+                        help="alinhamento pelo tempo desde o inicio ou pela distancia ao target")
+    parser.add_argument("--target-distance", type=float, default=None,
+                        help="distancia ao target considerada chegada (padrao: distancia final da manobra original)")
+    parser.add_argument("--out", default=None, help="arquivo csv do resumo (padrao: evaluation_<align>.csv na pasta do modelo)")
+    parser.add_argument("--workers", type=int, default=None, help="quantidade de processos em paralelo (1 para execucao sequencial)")
+    args = parser.parse_args()
+    main(args.model_path, args.config, args.align, args.target_distance, args.out, args.workers)
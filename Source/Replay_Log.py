@@ -0,0 +1,169 @@
+'''
+Codigo para reproduzir logs do simulador amostra a amostra no calculo online das variaveis de treinamento (OnlineFeatures)
+Uso: python Replay_Log.py <pasta> <caso> [--socket] [--realtime]
+'''
+
+'''
+Importacao das bibliotecas a serem utilizadas
+'''
+import pandas as pd
+import numpy as np
+import argparse
+import socket
+import threading
+import time
+import Data_Filter as df_lib
+
+
+'''
+Metodos de leitura da telemetria
+'''
+# Indices das colunas de interesse no cabecalho do log do simulador
+# Entrada:
+#   path: caminho do log do simulador
+#   columns: lista com as colunas lidas (mesma ordem de OnlineFeatures.update)
+# Saida:
+#   Lista com o indice de cada coluna nas linhas do log
+def log_columns(path, columns):
+    header = pd.read_csv(path, escapechar="%", skiprows=2, sep=r"\s+", nrows=0).columns
+    header = [col.strip() for col in header]
+    return [header.index(col) for col in columns]
+
+
+# Leitura do log linha a linha, como uma alimentacao ao vivo
+# Entrada:
+#   lines: iteravel com as linhas de dados do log (sem o cabecalho)
+#   idx: indices das colunas de interesse
+#   realtime: True para respeitar o intervalo entre as amostras
+# Saida:
+#   Gerador de listas de float na ordem das colunas
+def replay_lines(lines, idx, realtime=False):
+    start = None
+    for line in lines:
+        values = line.split()
+        if len(values) == 0:
+            continue
+        sample = [float(values[i]) for i in idx]
+        if realtime:
+            if start is None:
+                start = (time.perf_counter(), sample[0])
+            delay = (sample[0] - start[1]) - (time.perf_counter() - start[0])
+            if delay > 0:
+                time.sleep(delay)
+        yield sample
+
+
+# Leitura do log direto do arquivo
+# Entrada:
+#   path: caminho do log do simulador
+#   idx: indices das colunas de interesse
+#   realtime: True para respeitar o intervalo entre as amostras
+# Saida:
+#   Gerador de amostras
+def replay_file(path, idx, realtime=False):
+    with open(path) as f:
+        for _ in range(3):  # Duas linhas de cabecalho e o nome das colunas
+            f.readline()
+        yield from replay_lines(f, idx, realtime)
+
+
+# Leitura do log por um socket TCP local, com o envio das linhas em uma thread separada
+# Entrada:
+#   path: caminho do log do simulador
+#   idx: indices das colunas de interesse
+#   realtime: True para respeitar o intervalo entre as amostras
+# Saida:
+#   Gerador de amostras
+def replay_socket(path, idx, realtime=False):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def send():
+        conn, _ = server.accept()
+        with conn, open(path, "rb") as f:
+            for _ in range(3):
+                f.readline()
+            for line in f:
+                conn.sendall(line)
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    client = socket.create_connection(server.getsockname())
+    try:
+        with client.makefile("r") as stream:
+            yield from replay_lines(stream, idx, realtime)
+    finally:
+        client.close()
+        server.close()
+        sender.join()
+
+
+'''
+Metodo principal
+'''
+def main(folder, num_case, config_path=None, use_socket=False, realtime=False):
+    df_lib.err_control = df_lib.ErrorPrint()
+
+    # Resolve o caso pela mesma configuracao de Data_Filter.py
+    config = df_lib.DatasetConfig(config_path if config_path is not None else df_lib.default_config_path())
+    specs, folder_errors = config.plan()
+    specs = [spec for spec in specs if spec.folder == folder and spec.num_case == num_case]
+    if len(specs) == 0:
+        df_lib.err_control.eprint("Caso nao encontrado na configuracao")
+        return
+    spec = specs[0]
+    for text in spec.errors:
+        df_lib.err_control.eprint(text)
+    ship = df_lib.Ship(spec.ship_fullname, df_lib.P3D_file(spec.path_p3d, config.p3d_cache_path).find_dimensions(), spec.velocity)
+
+    # Referencia: processamento em lote do mesmo log, que tambem define o perfil de velocidade do caso (comando oscilatorio)
+    columns = spec.columns
+    df = df_lib.read_simulation_log(spec.path_case, columns, lambda chunk: df_lib.filter_trajectory(chunk, spec.buoys, spec.target, ship))
+    validator = df_lib.TrajectoryValidator(spec.buoys, spec.target, ship)
+    ship = df_lib.case_ship(config, spec, ship, df["time_stamp"].values, df[columns[8]].values, validator)
+    online = df_lib.OnlineFeatures(ship, spec.channel, spec.target, config.flag_lateral)
+
+    # Reproducao da telemetria com medicao da latencia de cada amostra
+    idx = log_columns(spec.path_case, columns)
+    samples = replay_socket(spec.path_case, idx, realtime) if use_socket else replay_file(spec.path_case, idx, realtime)
+    rows = []
+    latency = []
+    for sample in samples:
+        t0 = time.perf_counter_ns()
+        row = online.update(*sample)
+        latency.append(time.perf_counter_ns() - t0)
+        if online.inside:
+            rows.append(row)
+    latency = np.array(latency) / 1000
+
+    if config.flag_lateral == True:
+        batch = ship.calc_dist_lateral_array(df["x"].values, df["y"].values, df["zz"].values, spec.channel, spec.target)
+    else:
+        batch = ship.calc_dist_midline_array(df["x"].values, df["y"].values, df["zz"].values, spec.channel, spec.target)
+    batch = list(batch) + list(ship.calc_cog_sog_array(df["x"].values, df["y"].values, df["zz"].values, spec.channel, df["vx"].values, df["vy"].values))
+    batch = np.column_stack([ship.discrete_level_array(df[columns[8]].values)] + batch)
+    online_rows = np.array(rows)[:, online.names.index("propeller_demanded"):] if len(rows) > 0 else np.empty((0, batch.shape[1]))
+
+    print(folder + config.case_prefix + str(num_case) + " (" + ("socket" if use_socket else "arquivo") + "):")
+    if validator.oscillation is not None:
+        print("\tComando de maquina: %d inversoes (%.2f/min), perfil de velocidade %s" % (validator.oscillation["reversals"],
+              validator.oscillation["per_minute"], validator.oscillation["profile"] or "nominal"))
+    print("\tAmostras: " + str(len(latency)) + ", na entrada do canal: " + str(len(rows)) + " (lote: " + str(len(batch)) + ")")
+    print("\tLatencia por amostra (us): media %.2f, p50 %.2f, p99 %.2f, max %.2f" %
+          (latency.mean(), np.percentile(latency, 50), np.percentile(latency, 99), latency.max()))
+    if online_rows.shape == batch.shape:
+        print("\tMaior diferenca para o processamento em lote: %.3g" % np.abs(online_rows - batch).max())
+    else:
+        df_lib.err_control.eprint("Quantidade de amostras diferente do processamento em lote")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reproduz um log do simulador no calculo online das variaveis de treinamento")
+    parser.add_argument("folder", help="pasta dos casos como na configuracao (ex.: Suape_2017/RT/)")
+    parser.add_argument("case", type=int, help="numero do caso na pasta")
+    parser.add_argument("--config", default=None, help="arquivo yaml com a configuracao dos casos (padrao: dataset.yaml ao lado do script)")
+    parser.add_argument("--socket", action="store_true", help="envia o log por um socket TCP local em vez de ler o arquivo")
+    parser.add_argument("--realtime", action="store_true", help="respeita o intervalo entre as amostras do log")
+    args = parser.parse_args()
+    main(args.folder, args.case, config_path=args.config, use_socket=args.socket, realtime=args.realtime)
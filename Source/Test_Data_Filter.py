@@ -0,0 +1,1451 @@
+'''
+Testes de Data_Filter.py: cada operacao vetorizada ou otimizada comparada com o caminho escalar ou com uma execucao de referencia
+Uso: python Test_Data_Filter.py [-k nome] (ou python -m pytest Test_Data_Filter.py)
+'''
+
+'''
+Importacao das bibliotecas a serem utilizadas
+'''
+import pandas as pd
+import numpy as np
+import argparse
+import atexit
+import contextlib
+import io
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import traceback
+import warnings
+import yaml
+from concurrent.futures import ProcessPoolExecutor
+import Data_Filter as df_lib
+
+
+'''
+Variaveis globais
+'''
+# Canal de Suape_2017/RT e embarcacao Suezmax, os mesmos de dataset.yaml
+suape_buoys = [df_lib.Point(11722.4553, 5583.4462), df_lib.Point(11771.3626, 5379.2566), df_lib.Point(9189.9177, 4969.4907),
+               df_lib.Point(9237.9939, 4765.5281), df_lib.Point(6895.1451, 4417.3749), df_lib.Point(6954.9285, 4225.9083),
+               df_lib.Point(5540.617, 4088.186), df_lib.Point(5809.4056, 3767.7633)]
+suape_target = df_lib.Point(5790.0505, 3944.9947)
+suape_dim = [50.0, 25.0, 274.0]
+suape_velocity = [0, 28.77, 32.88, 57.54, 65.76]
+
+# Arquivos gerados pelo processamento que dependem do momento da execucao (desconsiderados nas comparacoes)
+volatile_outputs = ["run_report.json", "p3d_cache", "casos_cache", "intermedio"]
+
+_dataset_root = None  # Dados sinteticos compartilhados pelos testes do processo
+
+
+'''
+Metodos auxiliares
+'''
+# Posicoes aleatorias ao longo do canal, com desvio lateral da linha central e aproamento de entrada
+# Entrada:
+#   n: quantidade de amostras
+#   seed: semente do gerador aleatorio
+# Saida:
+#   x, y, zz, vx, vy: vetores das amostras
+def channel_samples(n, seed=0):
+    rng = np.random.default_rng(seed)
+    mid_x = np.array([(suape_buoys[i].x + suape_buoys[i + 1].x) / 2 for i in range(0, len(suape_buoys), 2)])
+    mid_y = np.array([(suape_buoys[i].y + suape_buoys[i + 1].y) / 2 for i in range(0, len(suape_buoys), 2)])
+    x = rng.uniform(suape_target.x + 50, mid_x[0] - 150, n)
+    y = np.interp(-x, -mid_x, mid_y) + rng.normal(0, 40, n)
+    zz = rng.uniform(-200, -150, n)
+    return x, y, zz, rng.normal(4, 0.5, n), rng.normal(0, 0.3, n)
+
+
+# Log sintetico de entrada no canal com a mesma estrutura dos logs do simulador
+# Entrada:
+#   path: caminho do arquivo
+#   rows: quantidade de amostras
+#   units: "rpm" ou "kn" (nome da coluna do comando de maquina)
+#   oscillating: True para comando de maquina alternando entre dois valores a cada 3 s (ou intervalo da alternancia em s)
+#   seed: semente do gerador aleatorio
+# Saida:
+#   None
+def write_synthetic_log(path, rows, units="rpm", oscillating=False, seed=0):
+    rng = np.random.default_rng(seed)
+    s = np.linspace(0, 1, rows)
+    mid_x = np.array([(suape_buoys[i].x + suape_buoys[i + 1].x) / 2 for i in range(0, len(suape_buoys), 2)])
+    mid_y = np.array([(suape_buoys[i].y + suape_buoys[i + 1].y) / 2 for i in range(0, len(suape_buoys), 2)])
+    x = 11600 - s * 5700
+    zz = -165 + 5 * np.sin(s * 7)
+    cols = {"time_stamp": 300 + np.arange(rows) * 0.1, "x": x,
+            "y": np.interp(-x, -mid_x, mid_y) + 20 * np.sin(s * 20) + rng.normal(0, 1, rows),
+            "zz": np.where(rng.uniform(size=rows) < 0.01, zz + 360, zz),  # Angulos positivos tambem aparecem nos logs
+            "vx": 4 + 0.5 * np.sin(s * 3), "vy": 0.2 * np.sin(s * 11), "vzz": 0.05 * np.cos(s * 5),
+            "rudder_demanded_orientation_0": np.round(0.3 * np.sin(s * 13), 2)}
+    if units == "rpm":
+        cols["propeller_demanded_rpm_0"] = np.where(s < 0.3, 57.54, np.where(s < 0.8, 32.88, 0.0)) + rng.normal(0, 0.5, rows)
+    elif oscillating:
+        interval = 30 if oscillating is True else int(round(oscillating * 10))
+        cols["propeller_demanded_0"] = np.where((np.arange(rows) // interval) % 2 == 0, 400.0, 200.0)
+    else:
+        cols["propeller_demanded_0"] = np.where(s < 0.5, 1431.78, 730.1)
+    for i in range(5):
+        cols["extra_" + str(i)] = rng.normal(size=rows)
+    with open(path, "w") as f:
+        f.write("Simulador\nLog sintetico\n")
+        pd.DataFrame(cols).to_csv(f, sep=" ", index=False, float_format="%.4f")
+
+
+# Dados sinteticos no formato das pastas do Dropbox: Suape_2017/RT (rpm, 3 casos) e Suape_Aframax/RT (kn, 2 casos, o caso 1
+# com comando de maquina oscilatorio)
+# Entrada:
+#   root: diretorio raiz dos dados
+# Saida:
+#   None
+def build_dataset(root):
+    folders = [("Suape_2017/RT/", "Suezmax T150", "smh_v00004", "rpm", [50, 274], [1, 2, 3]),
+               ("Suape_Aframax/RT/", "Aframax X", "smh_v00036", "kn", [42, 245], [1, 2])]
+    for path, ship, file, units, (beam, length), cases in folders:
+        rows = []
+        for num_case in cases:
+            dir_case = root + path + "Caso" + str(num_case) + "/"
+            os.makedirs(dir_case)
+            write_synthetic_log(dir_case + file + ".txt", 1000 + 300 * num_case, units, units == "kn" and num_case == 1, num_case)
+            with open(dir_case + "navio.p3d", "w") as f:
+                f.write("HEADER\n  SCALE = 1.00\nVESSEL\n  NAME = X\n  BEAM = %.2f\n  DRAFT = 10.00\n  HEIGHT = 25.00\n"
+                        "  LENGTH = %.2f\nEND\n" % (beam, length))
+            rows.append([num_case, ship, "Médio", "Entrada", "N", "0.5nó", "SE", "15nós", "1.0m", "8s", "SE"])
+        pd.DataFrame(rows, columns=["Caso", "Navio", "Cenário", "Manobra", "Corrente", "c2", "Vento", "v2", "Onda", "o2", "o3"]) \
+            .to_excel(root + path + "casos.xlsx", sheet_name="Plan1", index=False)
+
+
+# Diretorio dos dados sinteticos, gerados uma unica vez por processo
+# Entrada:
+#   None
+# Saida:
+#   Caminho do diretorio raiz dos dados
+def dataset_root():
+    global _dataset_root
+    if _dataset_root is None:
+        path = tempfile.mkdtemp(prefix="test_data_filter_")
+        atexit.register(shutil.rmtree, path, True)
+        build_dataset(path + "/dados/")
+        _dataset_root = path + "/dados/"
+    return _dataset_root
+
+
+# Configuracao dataset.yaml apontando para os dados sinteticos
+# Entrada:
+#   out_path: diretorio de saida
+#   changes: chaves da configuracao substituidas
+# Saida:
+#   Caminho do arquivo yaml gerado em out_path
+def fixture_config(out_path, **changes):
+    with open(df_lib.default_config_path(), encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data.update(root=dataset_root(), out_path=out_path, out_path_compiled=out_path + "Compilado/", variants=[])
+    for folder, cases in zip(data["folders"], [[1, 2, 3], [1, 2]] + [[]] * len(data["folders"])):
+        folder["cases"] = cases
+        folder["overrides"] = {}
+    data.update(changes)
+    os.makedirs(out_path, exist_ok=True)
+    path = out_path + "dataset.yaml"
+    with open(path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, allow_unicode=True)
+    return path
+
+
+# Deteccao de comando oscilatorio da configuracao padrao com chaves substituidas
+# Entrada:
+#   changes: chaves de oscillation substituidas (ex.: detect=True)
+# Saida:
+#   Dicionario para a chave oscillation de fixture_config
+def oscillation_config(**changes):
+    with open(df_lib.default_config_path(), encoding="utf-8") as f:
+        oscillation = yaml.safe_load(f)["oscillation"]
+    oscillation.update(changes)
+    return oscillation
+
+
+# Execucao completa de Data_Filter.main sem a impressao do log
+# Entrada:
+#   config_path: arquivo yaml da configuracao
+#   options: argumentos de Data_Filter.main
+# Saida:
+#   Texto impresso pela execucao
+def run_main(config_path, **options):
+    options.setdefault("workers", 1)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        df_lib.main(config_path=config_path, **options)
+    return out.getvalue()
+
+
+# Conteudo de todos os arquivos de um diretorio de saida
+# Entrada:
+#   path: diretorio de saida
+#   exclude: nomes de arquivos ou pastas desconsiderados
+# Saida:
+#   Dicionario caminho relativo -> bytes
+def read_tree(path, exclude=volatile_outputs):
+    files = {}
+    for dir_path, dir_names, file_names in os.walk(path):
+        dir_names[:] = [name for name in dir_names if name not in exclude]
+        for name in file_names:
+            if name not in exclude and name != "dataset.yaml":
+                full = os.path.join(dir_path, name)
+                with open(full, "rb") as f:
+                    files[os.path.relpath(full, path)] = f.read()
+    return files
+
+
+# Situacao de cada caso no relatorio da ultima execucao
+# Entrada:
+#   out_path: diretorio de saida
+# Saida:
+#   Dicionario caso -> status (ok, warning, skipped ou failed)
+def case_status(out_path):
+    with open(out_path + "run_report.json", encoding="utf-8") as f:
+        return {case["key"]: case["status"] for case in json.load(f)["cases"]}
+
+
+# Diretorio temporario de saida de um teste
+# Entrada:
+#   None
+# Saida:
+#   Caminho do diretorio (terminado em /)
+def temp_output():
+    path = tempfile.mkdtemp(prefix="test_out_")
+    atexit.register(shutil.rmtree, path, True)
+    return path + "/"
+
+
+# Controle de erros silencioso para os testes
+# Entrada:
+#   None
+# Saida:
+#   Objeto ErrorPrint instalado em Data_Filter
+def quiet_errors():
+    df_lib.err_control = df_lib.ErrorPrint(echo=False)
+    return df_lib.err_control
+
+
+'''
+Testes da geometria vetorizada (equivalencia com os metodos amostra a amostra de Ship)
+'''
+def test_geometry_arrays_match_scalar():
+    quiet_errors()
+    channel = df_lib.Channel(suape_buoys)
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+    x, y, zz, vx, vy = channel_samples(500)
+
+    dml, dtg = ship.calc_dist_midline_array(x, y, zz, channel, suape_target)
+    dpb, dsb, _ = ship.calc_dist_lateral_array(x, y, zz, channel, suape_target)
+    cog, sog, local_cog = ship.calc_cog_sog_array(x, y, zz, channel, vx, vy)
+    for i in range(len(x)):
+        center = df_lib.Point(x[i], y[i])
+        np.testing.assert_allclose(ship.calc_dist_midline(center, zz[i], suape_buoys, suape_target).values, [dml[i], dtg[i]], atol=1e-6)
+        np.testing.assert_allclose(ship.calc_dist_lateral(center, zz[i], suape_buoys, suape_target).values[:2], [dpb[i], dsb[i]], atol=1e-6)
+        np.testing.assert_allclose(ship.calc_cog_sog(center, zz[i], suape_buoys, vx[i], vy[i]).values, [cog[i], sog[i], local_cog[i]], atol=1e-9)
+
+
+def test_channel_section_matches_scalar():
+    quiet_errors()
+    channel = df_lib.Channel(suape_buoys)
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+    # Inclui pontos antes da entrada, depois do target e exatamente nos limites das secoes
+    x = np.concatenate([np.linspace(4000, 13000, 2000), channel.mid_x])
+    section = channel.section_array(x)
+    expected = [ship._determine_section(df_lib.Point(v, 0), suape_buoys) // 2 for v in x]
+    np.testing.assert_array_equal(section, expected)
+
+
+def test_heading_check_aggregated():
+    control = quiet_errors()
+    channel = df_lib.Channel(suape_buoys)
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+    x, y, zz, _, _ = channel_samples(10)
+    zz[:3] = 10  # Direcao de saida
+    ship.calc_dist_midline_array(x, y, zz, channel, suape_target)
+    assert control.get_messages() == ["Direcao da embarcacao em saida - 3 amostras"]
+    ship.calc_dist_midline_array(x, y, zz, channel, suape_target, check_heading=False)
+    assert control.get_num_error() == 1
+
+
+'''
+Testes da execucao em paralelo
+'''
+def test_parallel_matches_sequential():
+    out_seq = temp_output()
+    out_par = temp_output()
+    run_main(fixture_config(out_seq), workers=1)
+    run_main(fixture_config(out_par), workers=2)
+    sequential = read_tree(out_seq)
+    assert len([path for path in sequential if path.startswith("Compilado")]) == 6  # 5 casos e stats.json
+    assert read_tree(out_par) == sequential
+
+
+
+'''
+Testes do reprocessamento incremental
+'''
+def test_unchanged_cases_skipped():
+    out_path = temp_output()
+    run_main(fixture_config(out_path))
+    first = read_tree(out_path)
+    run_main(fixture_config(out_path))
+    assert set(case_status(out_path).values()) == {"skipped"}
+    assert read_tree(out_path) == first
+
+    # Nova tabela de velocidades do Aframax: apenas os casos de Suape_Aframax sao processados novamente
+    with open(df_lib.default_config_path(), encoding="utf-8") as f:
+        velocities = yaml.safe_load(f)["velocities"]
+    velocities["kn"]["Aframax"][4] = 1800.0
+    run_main(fixture_config(out_path, velocities=velocities))
+    status = case_status(out_path)
+    assert [status[key] for key in sorted(status)] == ["skipped", "skipped", "skipped", "ok", "ok"]
+
+    run_main(fixture_config(out_path), force=True)
+    assert "skipped" not in case_status(out_path).values()
+    assert read_tree(out_path) == first
+
+
+def test_corrupt_manifest_rebuilds_cases():
+    out_path = temp_output()
+    run_main(fixture_config(out_path))
+    first = read_tree(out_path)
+    with open(out_path + "manifest.json", "rb") as f:
+        manifest = f.read()
+    with open(out_path + "manifest.json", "wb") as f:  # Execucao interrompida durante a escrita do manifesto
+        f.write(manifest[:len(manifest) // 2])
+    run_main(fixture_config(out_path))
+    assert "skipped" not in case_status(out_path).values()
+    assert [text for text in df_lib.err_control.get_messages() if text.startswith("Manifesto corrompido")] != []
+    assert read_tree(out_path) == first
+    assert not os.path.exists(out_path + "manifest.json.tmp")
+
+
+def test_missing_plots_not_skipped():
+    out_path = temp_output()
+    run_main(fixture_config(out_path))
+    first = read_tree(out_path)
+    plots = sorted(path for path in first if path.endswith(".png"))
+    assert len(plots) == 5 * 7  # Distancia a linha central na configuracao padrao
+
+    # Execucao sem graficos marca os casos como atualizados, mas a execucao seguinte refaz os graficos
+    for path in plots:
+        os.remove(os.path.join(out_path, path))
+    run_main(fixture_config(out_path), force=True, plot_mode="none")
+    assert not any(path.endswith(".png") for path in read_tree(out_path))
+    run_main(fixture_config(out_path))
+    assert "skipped" not in case_status(out_path).values()
+    assert read_tree(out_path) == first
+
+    # Execucao com graficos adiados interrompida: apenas o caso sem os graficos e processado novamente
+    os.remove(os.path.join(out_path, plots[0]))
+    run_main(fixture_config(out_path), plot_mode="defer")
+    assert list(case_status(out_path).values()).count("skipped") == 4
+    assert read_tree(out_path) == first
+    run_main(fixture_config(out_path), plot_mode="none")
+    assert set(case_status(out_path).values()) == {"skipped"}
+
+
+
+'''
+Testes da leitura dos logs
+'''
+def test_chunked_read_matches_full_read():
+    quiet_errors()
+    path = dataset_root() + "Suape_2017/RT/Caso2/smh_v00004.txt"
+    columns = list(df_lib.log_dtypes)[:9]
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+
+    # Referencia: leitura de todas as colunas do log e selecao posterior
+    full = pd.read_csv(path, escapechar="%", skiprows=2, sep=r"\s+")[columns]
+    with warnings.catch_warnings():  # Sem opcoes de leitura obsoletas (delim_whitespace foi removido no pandas 3)
+        warnings.simplefilter("error", FutureWarning)
+        np.testing.assert_array_equal(df_lib.read_simulation_log(path, columns).values, full.values)
+        import Replay_Log
+        assert Replay_Log.log_columns(path, columns) == [list(pd.read_csv(path, skiprows=2, sep=r"\s+", nrows=0).columns).index(col)
+                                                         for col in columns]
+
+    def chunk_filter(chunk):
+        return df_lib.filter_trajectory(chunk, suape_buoys, suape_target, ship)
+    expected = df_lib.filter_trajectory(full, suape_buoys, suape_target, ship)
+    for chunksize in [None, 137, 10 ** 6]:
+        pd.testing.assert_frame_equal(df_lib.read_simulation_log(path, columns, chunk_filter, chunksize), expected)
+
+
+def test_chunked_run_matches_full_run():
+    out_full = temp_output()
+    out_chunk = temp_output()
+    run_main(fixture_config(out_full))
+    run_main(fixture_config(out_chunk), chunksize=250)
+    assert read_tree(out_chunk) == read_tree(out_full)
+
+
+
+'''
+Testes dos formatos binarios
+'''
+def test_npz_matches_text_output():
+    out_path = temp_output()
+    run_main(fixture_config(out_path), npz_output=True)
+    for num_case in range(1, 6):
+        path = out_path + "Compilado/Caso" + str(num_case).zfill(2)
+        text = df_lib.read_training_file(path + ".txt")
+        metadata, columns = df_lib.load_case_npz(path + ".npz")
+        assert list(columns) == list(text.columns)
+        for col, values in columns.items():
+            assert isinstance(values, np.memmap)
+            np.testing.assert_array_equal(values, text[col].values)
+        with open(path + ".txt", encoding="latin-1") as f:
+            assert f.readline().strip() == "Navio: " + metadata["Navio"]
+
+
+
+def test_consolidated_matches_cases():
+    out_path = temp_output()
+    run_main(fixture_config(out_path), consolidated=True)
+    dataset = df_lib.TrainingDataset(out_path + "Compilado/dataset.npy")
+    frames = {}
+    for num_case in range(1, 6):
+        frames[num_case] = df_lib.read_training_file(out_path + "Compilado/Caso" + str(num_case).zfill(2) + ".txt")
+        assert dataset.columns == list(frames[num_case].columns)
+        np.testing.assert_array_equal(dataset.case(num_case), frames[num_case].values)
+    assert len(dataset.data) == sum(len(df) for df in frames.values())
+    assert [len(case) for case in dataset.select(Navio="Aframax X")] == [len(frames[4]), len(frames[5])]
+
+    # Janelas de amostras consecutivas de um unico caso
+    col = dataset.column("time_stamp")
+    for window in dataset.sample(20, 50, np.random.default_rng(0)):
+        assert np.allclose(np.diff(window[:, col]), 0.1)
+
+
+
+'''
+Testes da leitura dos arquivos p3d
+'''
+# Leitura das dimensoes de varios p3d com um cache em disco compartilhado (executado em outro processo)
+# Entrada:
+#   item: tupla (lista de caminhos dos p3d, diretorio do cache)
+# Saida:
+#   Lista com as dimensoes de cada p3d
+def _p3d_worker(item):
+    paths, cache_path = item
+    df_lib.err_control = df_lib.ErrorPrint(echo=False)
+    df_lib.P3D_file.memory_cache.clear()
+    return [list(df_lib.P3D_file(path, cache_path).find_dimensions()) for path in paths]
+
+
+def test_p3d_dimensions_match_regex():
+    quiet_errors()
+    tmp = temp_output()
+    contents = ["HEADER\n  BEAM = 1.00\nVESSEL\n  NAME = X\n  BEAM = 42.00\n  DRAFT = 10.00\n  HEIGHT = 25.50\n  LENGTH = 245.00\n",
+                "VESSEL BEAM = 32.26 HEIGHT = 18.00 LENGTH = 199.90\nEND\n",
+                "VESSEL\n  BEAM = 50.00\n" + "  POINT = 1.0 2.0 3.0\n" * 5000 + "  HEIGHT = 25.00\n  LENGTH = 274.00\n"]
+    regex = re.compile(r"VESSEL[\s\S\n]*?(?<=BEAM = )(\d+.\d+)[\s\S\n]*?(?<=HEIGHT = )(\d+.\d+)[\s\S\n]*?(?<=LENGTH = )(\d+.\d+)")
+    for i, content in enumerate(contents):
+        path = tmp + str(i) + ".p3d"
+        with open(path, "w") as f:
+            f.write(content)
+        expected = [float(value) for value in regex.findall(content)[0]]
+        assert list(df_lib.P3D_file(path).find_dimensions()) == expected
+
+    # Sem o bloco VESSEL: erro registrado e dimensoes invalidas
+    control = quiet_errors()
+    with open(tmp + "vazio.p3d", "w") as f:
+        f.write("HEADER\n  BEAM = 1.00\n")
+    assert df_lib.P3D_file(tmp + "vazio.p3d").find_dimensions() == [-1, -1, -1]
+    assert control.get_messages() == ["Dimensoes da embarcacao nao encontradas"]
+
+
+def test_p3d_disk_cache_shared_by_processes():
+    quiet_errors()
+    tmp = temp_output()
+    paths = []
+    for i in range(40):
+        paths.append(tmp + str(i) + ".p3d")
+        with open(paths[-1], "w") as f:
+            f.write("VESSEL\n  BEAM = %d.00\n  HEIGHT = 20.00\n  LENGTH = %d.00\n" % (30 + i, 200 + i))
+    expected = [[30.0 + i, 20.0, 200.0 + i] for i in range(40)]
+
+    # Processos em paralelo gravando entradas diferentes ao mesmo tempo: nenhuma entrada perdida
+    cache_path = tmp + "p3d_cache/"
+    with ProcessPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(_p3d_worker, [(paths[k::4], cache_path) for k in range(4)]))
+    assert sorted(sum(results, [])) == expected
+    assert len(os.listdir(cache_path)) == 40
+
+    # Nova leitura sem cache em memoria usa apenas o cache em disco
+    parse = df_lib.P3D_file._parse_dimensions
+    df_lib.P3D_file.memory_cache.clear()
+    df_lib.P3D_file._parse_dimensions = None
+    try:
+        assert [list(df_lib.P3D_file(path, cache_path).find_dimensions()) for path in paths] == expected
+    finally:
+        df_lib.P3D_file._parse_dimensions = parse
+
+    # Arquivo alterado invalida a entrada
+    with open(paths[0], "w") as f:
+        f.write("VESSEL\n  BEAM = 99.00\n  DRAFT = 12.00\n  HEIGHT = 20.00\n  LENGTH = 300.00\n")
+    assert list(df_lib.P3D_file(paths[0], cache_path).find_dimensions()) == [99.0, 20.0, 300.0]
+
+
+'''
+Testes da discretizacao do comando de maquina
+'''
+def test_discrete_levels_match_scalar():
+    control = quiet_errors()
+    with open(df_lib.default_config_path(), encoding="utf-8") as f:
+        velocities = yaml.safe_load(f)["velocities"]
+    for units in velocities:
+        for name, table in velocities[units].items():
+            ship = df_lib.Ship(name, suape_dim, df_lib.Velocity(*table))
+            edges = ship.discrete_velocity()
+            # Amostras aleatorias e exatamente nos limites (intervalos fechados a esquerda como em pd.cut com right=False)
+            values = np.concatenate([np.random.default_rng(0).uniform(edges[0], edges[-1], 2000), edges[:-1]])
+            expected = pd.cut(pd.Series(values), edges, right=False, labels=list(range(-4, 5))).astype(int).to_numpy()
+            levels = ship.discrete_level_array(values)
+            np.testing.assert_array_equal(levels, expected)
+            np.testing.assert_array_equal(ship.corresp_vel_array(levels), [ship.corresp_vel(idx) for idx in expected])
+    assert control.get_num_error() == 0
+
+    # Valores fora dos limites saturados no comando mais proximo e reportados em uma unica mensagem
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+    edges = ship.discrete_velocity()
+    levels = ship.discrete_level_array(np.array([edges[0] - 1, 0.0, edges[-1], edges[-1] + 1]))
+    np.testing.assert_array_equal(levels, [-4, 0, 4, 4])
+    assert control.get_messages() == ["Velocidade fora dos limites de discretizacao - 3 amostras"]
+
+    # Velocidade sem valor reportada separadamente e mantida sem comando, como em pd.cut (antes saturada em toda forca)
+    control = quiet_errors()
+    levels = ship.discrete_level_array(np.array([np.nan, edges[0] - 1, 0.0, np.nan, edges[-1] + 1]))
+    np.testing.assert_array_equal(levels, [np.nan, -4, 0, np.nan, 4])
+    np.testing.assert_array_equal(ship.corresp_vel_array(levels), [np.nan, ship.corresp_vel(-4), 0, np.nan, ship.corresp_vel(4)])
+    assert control.get_messages() == ["Velocidade fora dos limites de discretizacao - 2 amostras",
+                                      "Velocidade sem valor (nan) - 2 amostras"]
+    online = df_lib.OnlineFeatures(ship, df_lib.Channel(suape_buoys), suape_target)
+    assert np.isnan(online._discrete_level(np.nan)) and online._discrete_level(edges[-1] + 1) == 4
+
+
+def test_nan_propeller_samples_dropped():
+    # Log do Caso2 de Suape_2017 com comando de maquina sem valor em amostras no meio do canal
+    root = temp_output() + "dados/"
+    shutil.copytree(dataset_root(), root)
+    path = root + "Suape_2017/RT/Caso2/smh_v00004.txt"
+    with open(path) as f:
+        lines = f.read().split("\n")
+    col = lines[2].split().index("propeller_demanded_rpm_0")
+    times = []
+    for i in range(700, 705):
+        values = lines[3 + i].split(" ")
+        values[col] = "nan"
+        times.append(float(values[0]))
+        lines[3 + i] = " ".join(values)
+    with open(path, "w") as f:
+        f.write("\n".join(lines))
+
+    out_path = temp_output()
+    run_main(fixture_config(out_path))
+    out_nan = temp_output()
+    run_main(fixture_config(out_nan, root=root))
+    with open(out_nan + "run_report.json", encoding="utf-8") as f:
+        case = [case for case in json.load(f)["cases"] if case["key"] == "Caso02"][0]
+    assert case["errors"] == {"Velocidade sem valor (nan)": 1}
+    assert case["rows"]["propeller_nan"] == 5
+
+    # Referencia: arquivo do log original sem as amostras alteradas
+    expected = df_lib.read_training_file(out_path + "Compilado/Caso02.txt")
+    assert expected["time_stamp"].isin(times).sum() == 5
+    expected = expected[~expected["time_stamp"].isin(times)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(df_lib.read_training_file(out_nan + "Compilado/Caso02.txt"), expected)
+    import Augment_Data
+    config = df_lib.DatasetConfig(out_nan + "dataset.yaml")
+    case, errors = Augment_Data.load_base_case(config, [spec for spec in config.plan()[0] if spec.key == "Caso02"][0])
+    np.testing.assert_array_equal(case.arrays["propeller"], expected["propeller_demanded"].values)
+    for key in ["Caso01", "Caso03", "Caso04", "Caso05"]:
+        with open(out_path + "Compilado/" + key + ".txt", "rb") as f, open(out_nan + "Compilado/" + key + ".txt", "rb") as g:
+            assert f.read() == g.read()
+
+
+'''
+Testes da configuracao declarativa dos casos
+'''
+def test_config_plan_matches_hardcoded_rules():
+    # Casos especiais que eram tratados no codigo de main() em Suape_2017/RT
+    root = temp_output() + "dados/"
+    ships = {1: "Suezmax T150", 4: "Suezmax T172", 5: "Suezmax L280B50T17", 6: "Desconhecido Y", 28: "Conteneiro L336"}
+    files = {1: ["smh_v00004.txt", "navio.p3d"], 4: ["smh_v00004.txt", "Suez_T150.p3d", "Suez_T172_2Reb_Suape.p3d"],
+             5: ["smh_v00004.txt", "navio.p3d"], 6: [], 28: ["smh_v00030.txt", "navio.p3d"]}
+    path = root + "Suape_2017/RT/"
+    for num_case, names in files.items():
+        os.makedirs(path + "Caso" + str(num_case))
+        for name in names:
+            open(path + "Caso" + str(num_case) + "/" + name, "w").close()
+    rows = [[num_case, ship, "Médio", "Entrada", "N", "0.5nó", "SE", "15nós", "1.0m", "8s", "SE"] for num_case, ship in ships.items()]
+    pd.DataFrame(rows, columns=["Caso", "Navio", "Cenário", "Manobra", "Corrente", "c2", "Vento", "v2", "Onda", "o2", "o3"]) \
+        .to_excel(path + "casos.xlsx", sheet_name="Plan1", index=False)
+
+    out_path = temp_output()
+    config_path = fixture_config(out_path, root=root)
+    with open(config_path, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data["folders"][0]["cases"] = [1, 4, 5, 6, 7, 28]
+    data["folders"][0]["overrides"] = {4: {"p3d": "Suez_T172_2Reb_Suape.p3d"}, 28: {"file": "smh_v00030", "velocity": "Conteneiro L366B51"}}
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, allow_unicode=True)
+    specs, folder_errors = df_lib.DatasetConfig(config_path).plan()
+
+    # Resultado esperado pelas regras de main() original: arquivo pelo primeiro nome do navio, p3d unico da pasta,
+    # velocidade pelo primeiro nome (ou nome completo) e Aframax quando o navio nao possui velocidade
+    case_dir = root + "Suape_2017/RT/Caso"
+    expected = [(1, "Caso01", "smh_v00004", case_dir + "1/navio.p3d", [0, 28.77, 32.88, 57.54, 65.76], []),
+                (4, "Caso02", "smh_v00004", case_dir + "4/Suez_T172_2Reb_Suape.p3d", [0, 28.77, 32.88, 57.54, 65.76], []),
+                (5, "Caso03", "smh_v00004", case_dir + "5/navio.p3d", [0, 29, 41, 58, 74], []),
+                (6, "Caso04", None, None, [0, 19.2, 38.4, 57.6, 76.8],
+                 ["Arquivo do caso nao definido", "Multiplicidade de P3D", "Navio nao possui velocidade registrada - Desconhecido Y"]),
+                (28, "Caso06", "smh_v00030", case_dir + "28/navio.p3d", [0, 20.4, 40.8, 61.2, 81.6], [])]
+    found = [spec for spec in specs if spec.num_case != 7]
+    assert len(found) == len(expected)
+    for spec, (num_case, key, file, path_p3d, velocity, errors) in zip(found, expected):
+        assert (spec.num_case, spec.key, spec.file, spec.path_p3d, spec.errors) == (num_case, key, file, path_p3d, errors)
+        np.testing.assert_array_equal(spec.velocity.rpm_table[4:], velocity)
+        assert spec.columns[8] == "propeller_demanded_rpm_0"
+        assert spec.path_out == out_path + "Suape_2017/RT/Caso" + str(num_case) + "/" + str(file) + ".txt"
+        assert spec.path_out_compiled == out_path + "Compilado/" + key + ".txt"
+    assert found[0].params["Corrente"] == ["N", "0.5nó"] and found[0].params["Navio"] == ["Suezmax T150"]
+
+    # Caso fora da planilha e pastas sem planilha: numeracao global mantida
+    missing = [spec for spec in specs if spec.num_case == 7][0]
+    assert missing.key == "Caso05" and missing.errors[0] == "Caso nao encontrado na planilha de casos"
+    assert folder_errors[0] == [] and folder_errors[1] == ["Planilha de casos nao encontrada"]
+    assert len(specs) == 6
+
+
+'''
+Testes da planilha de casos indexada
+'''
+def test_case_table_matches_filtering():
+    tmp = temp_output()
+    path_xlsx = tmp + "casos.xlsx"
+    rows = [[num_case, "Navio " + str(num_case), "Médio", "Entrada", "N", "0.5nó", "SE", str(num_case) + "nós", "1.0m", "8s", "SE"]
+            for num_case in [3, 1, 2]]
+    rows.append([None] * 11)  # Linhas apos o primeiro caso vazio sao desconsideradas
+    rows.append([9, "Navio 9", "Médio", "Entrada", "N", "0.5nó", "SE", "9nós", "1.0m", "8s", "SE"])
+    columns = ["Caso", "Navio", "Cenário", "Manobra", "Corrente", "c2", "Vento", "v2", "Onda", "o2", "o3"]
+    pd.DataFrame(rows, columns=columns).to_excel(path_xlsx, sheet_name="Plan1", index=False)
+    simul_data = ["Navio", "Cenário", "Manobra", "Corrente", "Vento", "Onda"]
+    mult_param_data = {"Corrente": 2, "Vento": 2, "Onda": 3}
+
+    # Referencia: filtragem de main() original a cada acesso
+    df_case = pd.read_excel(path_xlsx, sheet_name="Plan1")
+    df_case = df_case.loc[0:df_case[df_case["Caso"].isnull()].index.tolist()[0] - 1]
+    table = df_lib.CaseTable(path_xlsx, tmp + "cache/")
+    for num_case in [1, 2, 3]:
+        reference = df_case[df_case["Caso"] == num_case]
+        rows_case = table.rows(num_case)
+        assert rows_case["Navio"].to_string(index=False) == reference["Navio"].to_string(index=False)
+        params = table.params(rows_case, simul_data, mult_param_data)
+        for p in simul_data:
+            if p in mult_param_data:
+                pos = reference.columns.get_loc(p)
+                assert params[p] == [reference.iloc[0, pos + i] for i in range(mult_param_data[p])]
+            else:
+                assert params[p] == [reference[p].to_string(index=False)]
+    assert table.rows(9).empty and table.rows(4).empty
+
+    # Segunda leitura pela copia em pickle, sem abrir o Excel
+    read_excel = pd.read_excel
+    pd.read_excel = None
+    try:
+        cached = df_lib.CaseTable(path_xlsx, tmp + "cache/")
+    finally:
+        pd.read_excel = read_excel
+    pd.testing.assert_frame_equal(cached.df, table.df)
+
+    # Planilha alterada invalida a copia
+    rows[0][1] = "Navio alterado"
+    pd.DataFrame(rows, columns=columns).to_excel(path_xlsx, sheet_name="Plan1", index=False)
+    os.utime(path_xlsx, ns=(0, os.stat(path_xlsx).st_mtime_ns + 10 ** 9))
+    assert df_lib.CaseTable(path_xlsx, tmp + "cache/").rows(3)["Navio"].to_string(index=False) == "Navio alterado"
+
+
+'''
+Testes do calculo online das variaveis de treinamento
+'''
+def test_online_features_match_batch():
+    quiet_errors()
+    path = temp_output() + "log.txt"
+    write_synthetic_log(path, 3000)
+    columns = ["time_stamp", "x", "y", "zz", "vx", "vy", "vzz", "rudder_demanded_orientation_0", "propeller_demanded_rpm_0"]
+    log = df_lib.read_simulation_log(path, columns)
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+    for channel in [df_lib.Channel(suape_buoys), df_lib.PolylineChannel(suape_buoys)]:
+        for flag_lateral in [False, True]:
+            # Referencia: filtragem e geometria vetorizada do processamento em lote
+            df = df_lib.filter_trajectory(log, suape_buoys, suape_target, ship)
+            x, y, zz = df["x"].values, df["y"].values, df["zz"].values
+            if flag_lateral:
+                distances = list(ship.calc_dist_lateral_array(x, y, zz, channel, suape_target))
+            else:
+                distances = list(ship.calc_dist_midline_array(x, y, zz, channel, suape_target))
+            batch = np.column_stack([df[columns].values[:, [0, 3, 4, 5, 6, 7]], ship.discrete_level_array(df[columns[8]].values)] +
+                                    distances + list(ship.calc_cog_sog_array(x, y, zz, channel, df["vx"].values, df["vy"].values)))
+
+            online = df_lib.OnlineFeatures(ship, channel, suape_target, flag_lateral)
+            rows = []
+            for sample in log.values.tolist():
+                row = online.update(*sample)
+                if online.inside:
+                    rows.append(row)
+            assert len(online.names) == batch.shape[1]
+            np.testing.assert_allclose(np.array(rows), batch, atol=1e-6)
+
+
+def test_replay_log_matches_batch():
+    import Replay_Log
+    out_path = temp_output()
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        Replay_Log.main("Suape_2017/RT/", 2, config_path=fixture_config(out_path))
+    match = re.search(r"Maior diferenca para o processamento em lote: (\S+)", out.getvalue())
+    assert match is not None and float(match.group(1)) < 1e-6
+    assert df_lib.err_control.get_num_global_error() == 0
+
+
+'''
+Testes do benchmark
+'''
+def test_benchmark_runs_and_compares():
+    import Benchmark
+    tmp = temp_output()
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        regressions = Benchmark.main([2000], repeat=1, save=tmp + "bench.json")
+    with open(tmp + "bench.json") as f:
+        results = json.load(f)["results"]
+    stages = ["ingest", "filter", "dist_midline", "dist_lateral", "dist_polyline", "cog_sog", "discretize", "plot", "write"]
+    assert regressions == 0 and [r["stage"] for r in results] == stages
+    assert all(r["rows"] == 2000 and r["seconds"] >= 0 for r in results)
+
+    # Trajetoria sintetica dentro do canal: as etapas de geometria medem praticamente todas as amostras informadas
+    df = df_lib.filter_trajectory(Benchmark.synthetic_trajectory(2000), Benchmark.bench_buoys, Benchmark.bench_target,
+                                  df_lib.Ship("Suezmax", Benchmark.bench_dim, df_lib.Velocity(*Benchmark.bench_velocity)))
+    assert len(df) > 1900
+
+    # Referencia com metade do tempo em uma etapa: apenas essa etapa e reportada como regressao
+    for r in results:
+        r["seconds"] = r["seconds"] / 2 if r["stage"] == "filter" else r["seconds"] * 10
+    with open(tmp + "ref.json", "w") as f:
+        json.dump({"results": results}, f)
+    with open(tmp + "bench.json") as f:
+        current = json.load(f)["results"]
+    with contextlib.redirect_stdout(out):
+        assert Benchmark.compare_results(current, tmp + "ref.json", 0.1) == 1
+    assert "REGRESSAO" in out.getvalue()
+
+
+'''
+Testes do relatorio da execucao
+'''
+def test_run_report_matches_outputs():
+    out_path = temp_output()
+    config_path = fixture_config(out_path)
+    with open(config_path, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data["folders"][0]["cases"] = [1, 2, 9]  # Caso 9 fora da planilha
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, allow_unicode=True)
+    run_main(config_path)
+    with open(out_path + "run_report.json", encoding="utf-8") as f:
+        report = json.load(f)
+
+    cases = {case["key"]: case for case in report["cases"]}
+    assert [cases[key]["status"] for key in sorted(cases)] == ["ok", "ok", "failed", "ok", "ok"]
+    assert not os.path.exists(out_path + "Compilado/Caso03.txt")
+    for key, case in cases.items():
+        if case["status"] == "failed":
+            continue
+        # Contagens de linhas iguais ao log lido e ao arquivo de treinamento escrito
+        with open(dataset_root() + case["folder"] + "Caso" + str(case["num_case"]) + "/" + case["file"] + ".txt") as f:
+            num_lines = sum(1 for _ in f) - 3  # Duas linhas de cabecalho e o nome das colunas
+        assert case["rows"]["log"] == num_lines == 1000 + 300 * case["num_case"]
+        assert case["rows"]["channel"] == len(df_lib.read_training_file(out_path + "Compilado/" + key + ".txt"))
+        assert case["validation"]["samples"] == case["rows"]["log"]
+
+    # Totais iguais a soma dos casos e das pastas
+    assert cases["Caso03"]["errors"]["Caso nao encontrado na planilha de casos"] == 1
+    errors = {}
+    for case in report["cases"]:
+        for kind, value in case["errors"].items():
+            errors[kind] = errors.get(kind, 0) + value
+    for folder_errors in report["folder_errors"].values():
+        for text in folder_errors:
+            errors[text] = errors.get(text, 0) + 1
+    assert report["errors"] == errors
+    for name, value in report["case_stages"].items():
+        assert abs(value - sum(case["stages"].get(name, 0) for case in report["cases"])) < 1e-9
+    assert sorted(report["slowest"]) == sorted(cases)
+
+
+'''
+Testes da avaliacao dos logs de simulacao
+'''
+def test_evaluate_model_known_errors():
+    import Evaluate_Model
+    out_path = temp_output()
+    config_path = fixture_config(out_path)
+    run_main(config_path)
+
+    # Logs de simulacao gerados das manobras originais: identico, com desvio constante na linha central e com aproamento
+    # deslocado de uma volta (diferenca angular nula)
+    model_path = temp_output()
+    changes = {1: {}, 2: {"distance_midline": 2.0}, 4: {"zz": 360.0}}
+    for case_num, offsets in changes.items():
+        df = df_lib.read_training_file(out_path + "Compilado/Caso" + str(case_num).zfill(2) + ".txt")
+        for col, value in offsets.items():
+            df[col] = df[col] + value
+        df.to_csv(model_path + "simulation_log_Caso" + str(case_num).zfill(2) + "_modelo.txt", sep=" ", index=False)
+
+    for align in ["time", "distance"]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = Evaluate_Model.main(model_path, config_path=config_path, align=align, workers=1)
+        summary = summary.set_index("case")
+        assert "error" not in summary.columns
+        expected = {"Caso01": [0, 0, 0], "Caso02": [2.0, 0, 0], "Caso04": [0, 0, 0]}
+        for key, (midline, heading, rudder) in expected.items():
+            np.testing.assert_allclose(summary.loc[key, ["rmse_midline", "rmse_heading", "rmse_rudder"]].astype(float),
+                                       [midline, heading, rudder], atol=1e-9)
+            assert abs(summary.loc[key, "time_target_diff"]) < 1e-6
+        assert summary.loc[key, "original"] == os.path.join("Suape_Aframax", "RT", "Caso1", "smh_v00036.txt")
+
+
+'''
+Testes do canal por polilinha
+'''
+def test_polyline_channel_matches_sections():
+    quiet_errors()
+    ship = df_lib.Ship("Suezmax", suape_dim, df_lib.Velocity(*suape_velocity))
+    channel = df_lib.Channel(suape_buoys)
+    polyline = df_lib.PolylineChannel(suape_buoys)
+    x, y, zz, vx, vy = channel_samples(3000)
+
+    # Secao da grade igual ao segmento da linha central mais proximo por busca exaustiva
+    section = polyline.section_array(x, y)
+    for i in range(len(x)):
+        t = np.clip(((x[i] - polyline._x1) * polyline._dx + (y[i] - polyline._y1) * polyline._dy) / polyline._len2, 0, 1)
+        dist = np.hypot(polyline._x1 + t * polyline._dx - x[i], polyline._y1 + t * polyline._dy - y[i])
+        assert dist[section[i]] <= dist.min() + 1e-9
+
+    # Mesmas distancias do canal por secoes onde as duas definicoes de secao coincidem (Suape e monotono em x)
+    same = section == channel.section_array(x)
+    assert same.mean() > 0.99
+    dml, dtg = ship.calc_dist_midline_array(x, y, zz, channel, suape_target)
+    pml, ptg = ship.calc_dist_midline_array(x, y, zz, polyline, suape_target)
+    np.testing.assert_allclose(pml[same], dml[same], atol=1e-6)
+    np.testing.assert_allclose(ptg, dtg, atol=1e-6)
+
+    # Canal girado: distancias e local_cog invariantes
+    theta = np.radians(130)
+    rotate = lambda px, py: (px * np.cos(theta) - py * np.sin(theta), px * np.sin(theta) + py * np.cos(theta))
+    buoys = [df_lib.Point(*rotate(b.x, b.y)) for b in suape_buoys]
+    target = df_lib.Point(*rotate(suape_target.x, suape_target.y))
+    rotated = df_lib.PolylineChannel(buoys)
+    rx, ry = rotate(x, y)
+    np.testing.assert_allclose(ship.calc_dist_midline_array(rx, ry, zz + 130, rotated, target, check_heading=False), [pml, ptg], atol=1e-6)
+    np.testing.assert_allclose(ship.calc_dist_lateral_array(rx, ry, zz + 130, rotated, target, check_heading=False)[:2],
+                               ship.calc_dist_lateral_array(x, y, zz, polyline, suape_target)[:2], atol=1e-6)
+    local_cog = ship.calc_cog_sog_array(rx, ry, zz + 130, rotated, vx, vy)[2] - ship.calc_cog_sog_array(x, y, zz, polyline, vx, vy)[2]
+    np.testing.assert_allclose((local_cog + 180) % 360 - 180, 0, atol=1e-6)
+
+
+def test_fingerprint_covers_channel_and_resample():
+    spec = df_lib.DatasetConfig(fixture_config(temp_output())).plan()[0][0]
+    args = [spec.path_case, spec.path_p3d, spec.df_case, spec.buoys, spec.target, spec.velocity, False]
+    base = df_lib.case_fingerprint(*args, df_lib.Channel(spec.buoys))
+    assert df_lib.case_fingerprint(*args, df_lib.Channel(spec.buoys)) == base
+    changed = [df_lib.case_fingerprint(*args, df_lib.PolylineChannel(spec.buoys)),
+               df_lib.case_fingerprint(*args, df_lib.Channel(spec.buoys), (1.0, "mean")),
+               df_lib.case_fingerprint(*args, df_lib.Channel(spec.buoys), (1.0, "decimate")),
+               df_lib.case_fingerprint(*args, df_lib.Channel(spec.buoys), extra=[[], None]),
+               df_lib.case_fingerprint(*args[:-1], True, df_lib.Channel(spec.buoys))]
+    version = df_lib.fingerprint_version
+    df_lib.fingerprint_version = version + 1
+    try:
+        changed.append(df_lib.case_fingerprint(*args, df_lib.Channel(spec.buoys)))
+    finally:
+        df_lib.fingerprint_version = version
+    assert len(set(changed + [base])) == len(changed) + 1
+
+
+'''
+Testes da reamostragem das trajetorias
+'''
+def test_resample_matches_loop():
+    rng = np.random.default_rng(3)
+    n = 2000
+    df = pd.DataFrame({"time_stamp": 300 + np.arange(n) * 0.1, "zz": -170 + np.cumsum(rng.normal(0, 2, n)),
+                       "vx": rng.normal(4, 0.5, n), "rudder": np.repeat(rng.choice([-0.3, 0, 0.3], n // 50), 50),
+                       "propeller": np.repeat(rng.choice([-1, 0, 2], n // 70 + 1), 70)[:n], "cog": rng.uniform(-200, -160, n)})
+    df.loc[df.index[::137], "zz"] += 360  # Angulos em ramos diferentes dentro do mesmo intervalo
+
+    # Referencia amostra a amostra: novo intervalo a cada periodo ou mudanca de comando
+    groups = []
+    for i in range(n):
+        slot = int(np.floor((df["time_stamp"].values[i] - df["time_stamp"].values[0]) / 1.0 + 1e-9))
+        command = (df["rudder"].values[i], df["propeller"].values[i])
+        if i == 0 or slot != groups[-1][0] or command != groups[-1][1]:
+            groups.append((slot, command, []))
+        groups[-1][2].append(i)
+
+    decimated = df_lib.resample_trajectory(df, 1.0, "decimate", ["rudder", "propeller"], ["zz", "cog"])
+    assert list(decimated.index) == [rows[0] for _, _, rows in groups]
+
+    averaged = df_lib.resample_trajectory(df, 1.0, "mean", ["rudder", "propeller"], ["zz", "cog"])
+    assert list(averaged.columns) == list(df.columns) and len(averaged) == len(groups)
+    for (_, _, rows), (_, out) in zip(groups, averaged.iterrows()):
+        part = df.iloc[rows]
+        assert out["time_stamp"] == part["time_stamp"].values[0]
+        assert (out["rudder"], out["propeller"]) == (part["rudder"].values[0], part["propeller"].values[0])
+        assert abs(out["vx"] - part["vx"].mean()) < 1e-6
+        for col in ["zz", "cog"]:
+            rad = np.radians(part[col].values)
+            mean = np.degrees(np.arctan2(np.sin(rad).sum(), np.cos(rad).sum()))
+            assert abs((out[col] - mean + 180) % 360 - 180) < 1e-5
+            assert abs(out[col] - part[col].values[0]) <= 180
+
+
+def test_resampled_run_matches_full_run():
+    out_full = temp_output()
+    out_dec = temp_output()
+    run_main(fixture_config(out_full))
+    run_main(fixture_config(out_dec), resample_period=1.0, resample_mode="decimate")
+    for key in ["Caso01", "Caso04"]:
+        full = df_lib.read_training_file(out_full + "Compilado/" + key + ".txt")
+        dec = df_lib.read_training_file(out_dec + "Compilado/" + key + ".txt")
+        assert 0 < len(dec) < len(full) / 2
+        # Decimacao mantem linhas inteiras do arquivo sem reamostragem, inclusive todas as mudancas de comando
+        pd.testing.assert_frame_equal(dec, full[full["time_stamp"].isin(dec["time_stamp"])].reset_index(drop=True))
+        changes = full[(full[["rudder_demanded", "propeller_demanded"]].diff() != 0).any(axis=1)]
+        assert changes["time_stamp"].isin(dec["time_stamp"]).all()
+
+
+'''
+Testes do aumento de dados
+'''
+def test_augment_without_noise_matches_training_files():
+    import Augment_Data
+    out_path = temp_output()
+    config_path = fixture_config(out_path, oscillation=oscillation_config(detect=True))
+    run_main(config_path)
+    config = df_lib.DatasetConfig(config_path)
+
+    # Controle de erros do processo principal preservado na leitura sequencial
+    control = df_lib.ErrorPrint(echo=False)
+    df_lib.err_control = control
+    cases = Augment_Data.load_base_cases(config, workers=1)
+    assert df_lib.err_control is control
+    assert all(text.endswith(": Planilha de casos nao encontrada") for text in control.get_messages())  # Apenas as pastas sem dados
+    assert [case.key for case in cases] == ["Caso01", "Caso02", "Caso03", "Caso04", "Caso05"]
+    assert np.abs(cases[3].ship.velocity.rpm_table).max() == 800  # Aframax_Osc
+
+    # Variante sem desvios, ruido ou espelhamento igual ao arquivo de treinamento (inclusive o perfil oscilatorio do Caso04)
+    augmenter = Augment_Data.TrajectoryAugmenter(config.flag_lateral, 0, 0, sensor_std={name: 0 for name in Augment_Data.default_sensor_std},
+                                                 target_std=0, mirror_prob=0, seed=0)
+    for case in cases:
+        frame = augmenter.frame(case, 2)
+        training = df_lib.read_training_file(out_path + "Compilado/" + case.key + ".txt")
+        for variant in range(2):
+            part = frame[frame["variant"] == variant].drop(columns=["case", "variant"]).reset_index(drop=True)
+            assert list(part.columns) == list(training.columns)
+            np.testing.assert_allclose(part.values, training.values, atol=5e-4)
+
+    # Espelhamento duas vezes e a identidade (exceto amostras cujo espelho cai em outra secao do canal)
+    case = cases[0]
+    mirrored = Augment_Data.BaseCase(case.key, case.case_num, case.ship, case.channel, case.target, augmenter.mirror(case))
+    twice = augmenter.mirror(mirrored)
+    same = case.channel.section_array(case.arrays["x"], case.arrays["y"]) == \
+        case.channel.section_array(mirrored.arrays["x"], mirrored.arrays["y"])
+    assert same.mean() > 0.99
+    for name in Augment_Data.log_names:
+        np.testing.assert_allclose(twice[name][same], case.arrays[name][same], atol=1e-6)
+    assert np.abs(mirrored.arrays["y"] - case.arrays["y"]).max() > 1
+
+
+'''
+Testes do acesso preguicoso aos casos
+'''
+def test_iter_cases_matches_training_files():
+    out_path = temp_output()
+    config_path = fixture_config(out_path)
+    run_main(config_path)
+    with open(config_path, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data["folders"][0]["cases"] = [1, 9, 2, 3]  # Caso 9 fora da planilha
+    config_iter = temp_output() + "dataset.yaml"
+    with open(config_iter, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, allow_unicode=True)
+    expected = {"Caso01": "Caso01", "Caso03": "Caso02", "Caso04": "Caso03", "Caso05": "Caso04", "Caso06": "Caso05"}
+
+    for prefetch in [0, 2]:
+        control = df_lib.ErrorPrint(echo=False)
+        df_lib.err_control = control
+        keys = []
+        for spec, df in df_lib.iter_cases(config_iter, prefetch=prefetch):
+            assert df_lib.err_control is control  # Controle de quem consome nunca substituido durante a iteracao
+            training = df_lib.read_training_file(out_path + "Compilado/" + expected[spec.key] + ".txt")
+            pd.testing.assert_frame_equal(df.reset_index(drop=True), training, check_dtype=False, atol=1e-9)
+            keys.append(spec.key)
+        assert keys == sorted(expected)
+
+        # Erros registrados com o caso de origem
+        case_errors = [text for text in control.get_messages() if text.startswith("Caso")]
+        assert case_errors and all(text.startswith("Caso02: ") for text in case_errors)
+        assert "Caso02: Caso nao encontrado na planilha de casos" in case_errors
+
+    # Antecipacao em thread: funciona sem processos e a thread de antecipacao nao usa o controle global
+    threads = set()
+
+    class ThreadControl(df_lib.ErrorPrint):
+        def eprint(self, text):
+            threads.add(threading.get_ident())
+            super().eprint(text)
+
+    def no_process(*args, **kwargs):
+        raise OSError("Processos indisponiveis")
+
+    df_lib.err_control = ThreadControl(echo=False)
+    process_pool = df_lib.ProcessPoolExecutor
+    df_lib.ProcessPoolExecutor = no_process
+    try:
+        keys = [spec.key for spec, df in df_lib.iter_cases(config_iter, prefetch=3)]
+    finally:
+        df_lib.ProcessPoolExecutor = process_pool
+    assert keys == sorted(expected)
+    assert threads == {threading.get_ident()}
+
+    # Vetores numpy e consumo interrompido
+    for spec, columns in df_lib.iter_cases(config_iter, prefetch=1, arrays=True):
+        np.testing.assert_allclose(columns["distance_midline"], df_lib.read_training_file(out_path + "Compilado/Caso01.txt")["distance_midline"])
+        break
+
+
+'''
+Testes da escrita dos arquivos de treinamento
+'''
+def test_written_files_match_text_writer():
+    out_path = temp_output()
+    run_main(fixture_config(out_path))
+    spec = df_lib.DatasetConfig(out_path + "dataset.yaml").plan()[0][0]
+    for path in [spec.path_out, spec.path_out_compiled]:
+        assert os.stat(path).st_nlink == 1  # Arquivos independentes, sem hard link entre a pasta do caso e o compilado
+
+    # Referencia: escrita do main() original, cabecalho em modo texto seguido de df.to_csv(mode='a')
+    with open(spec.path_out, "rb") as f:
+        data = f.read()
+    header = data[:data.index(b"time_stamp")].decode(df_lib.locale.getpreferredencoding(False)).replace(os.linesep, "\n")
+    df = df_lib.read_training_file(spec.path_out)
+    path_ref = out_path + "referencia.txt"
+    with open(path_ref, "w+") as f:
+        f.write(header)
+    df.to_csv(path_ref, mode='a', index=False, sep=' ')
+    with open(path_ref, "rb") as f:
+        assert f.read() == data
+    assert df_lib.format_training_file(header, df) == data
+
+    # Alteracao de um arquivo nao altera o outro
+    with open(spec.path_out, "ab") as f:
+        f.write(b"0 0 0\n")
+    with open(spec.path_out_compiled, "rb") as f:
+        assert f.read() == data
+
+
+'''
+Testes das variantes geradas do intermediario (equivalencia com execucoes separadas do script)
+'''
+def test_variants_match_separate_runs():
+    variants = [{"name": "Compilado_Lateral", "lateral": True}, {"name": "Compilado_SemSogCog", "drop": ["cog", "sog", "local_cog"]},
+                {"name": "CompiladoCaso02", "cases": [2]}]
+    out_path = temp_output()
+    run_main(fixture_config(out_path, variants=variants))
+    out_lateral = temp_output()  # Referencia: execucao separada com flag_lateral alterado
+    run_main(fixture_config(out_lateral, flag_lateral=True))
+
+    specs = df_lib.DatasetConfig(out_path + "dataset.yaml").plan()[0]
+    assert len(specs) == 5
+    for spec in specs:
+        paths = {variant["name"]: path for variant, path in spec.variants}
+        with open(paths["Compilado_Lateral"], "rb") as f, open(out_lateral + "Compilado/" + spec.key + ".txt", "rb") as g:
+            assert f.read() == g.read()
+
+        # Colunas removidas: mesmo cabecalho e mesmos valores do arquivo completo
+        with open(spec.path_out, "rb") as f, open(paths["Compilado_SemSogCog"], "rb") as g:
+            full, reduced = f.read(), g.read()
+        assert reduced[:reduced.index(b"time_stamp")] == full[:full.index(b"time_stamp")]
+        df_full = df_lib.read_training_file(spec.path_out).drop(columns=["cog", "sog", "local_cog"])
+        pd.testing.assert_frame_equal(df_lib.read_training_file(paths["Compilado_SemSogCog"]), df_full)
+
+        # Subconjunto de casos pelo numero global
+        assert ("CompiladoCaso02" in paths) == (spec.key == "Caso02")
+    assert os.listdir(out_path + "CompiladoCaso02") == ["Caso02.txt"]
+    with open(out_path + "CompiladoCaso02/Caso02.txt", "rb") as f, open(out_path + "Compilado/Caso02.txt", "rb") as g:
+        assert f.read() == g.read()
+
+    # Saidas refeitas a partir do intermediario guardado iguais as calculadas do log
+    expected = read_tree(out_path)
+    for name in ["Compilado", "Compilado_Lateral", "Compilado_SemSogCog", "CompiladoCaso02"]:
+        shutil.rmtree(out_path + name)
+    run_main(out_path + "dataset.yaml")
+    with open(out_path + "run_report.json", encoding="utf-8") as f:
+        cases = json.load(f)["cases"]
+    assert all(case["rows"].get("intermediate_cached") == 1 for case in cases)
+    assert read_tree(out_path) == expected
+
+
+'''
+Testes da execucao distribuida em shards (reservas exclusivas e equivalencia com a execucao em um unico processo)
+'''
+def _stale_lock(path, key, age=3600):
+    with open(path + key + ".lock", "w") as f:
+        f.write("interrompido|0")
+    past = os.stat(path + key + ".lock").st_mtime - age
+    os.utime(path + key + ".lock", (past, past))
+
+
+def test_stale_lock_claimed_by_one_shard():
+    path = temp_output()
+    first, second = df_lib.ShardQueue(path, "a", stale_seconds=60), df_lib.ShardQueue(path, "b", stale_seconds=60)
+    try:
+        _stale_lock(path, "Caso01")
+        assert first.claim("Caso01")
+        assert not second.claim("Caso01")
+        with open(path + "Caso01.lock") as f:
+            assert f.read() == first.held["Caso01"]
+    finally:
+        first.close()
+        second.close()
+
+
+def test_stale_takeover_race_keeps_new_owner():
+    path = temp_output()
+    first, second = df_lib.ShardQueue(path, "a", stale_seconds=60), df_lib.ShardQueue(path, "b", stale_seconds=60)
+    try:
+        # O shard b observa a reserva abandonada; antes da renomeacao o shard a assume o caso e cria uma reserva nova
+        _stale_lock(path, "Caso01")
+        is_stale = second._is_stale
+
+        def race(mtime):
+            assert first.claim("Caso01")
+            return is_stale(mtime)
+        second._is_stale = race
+        assert not second.claim("Caso01")
+        with open(path + "Caso01.lock") as f:
+            assert f.read() == first.held["Caso01"]
+        assert not [name for name in os.listdir(path) if name.endswith(".stale")]
+
+        # Reserva renovada pelo dono entre a verificacao e a renomeacao tambem e devolvida
+        second._is_stale = is_stale
+        _stale_lock(path, "Caso02")
+        observed = second._read_lock(path + "Caso02.lock")
+        os.utime(path + "Caso02.lock")
+        second._read_lock = lambda path_lock: observed if path_lock.endswith(".lock") else df_lib.ShardQueue._read_lock(second, path_lock)
+        assert not second.claim("Caso02")
+        with open(path + "Caso02.lock") as f:
+            assert f.read() == "interrompido|0"
+    finally:
+        first.close()
+        second.close()
+
+
+def test_sharded_run_matches_single_run():
+    out_single = temp_output()
+    run_main(fixture_config(out_single))
+    out_sharded = temp_output()
+    config_path = fixture_config(out_sharded)
+    run_main(config_path, shard="exec")
+    run_main(config_path, shard="exec")  # Segundo shard sem casos livres
+    run_main(config_path, merge="exec")
+    exclude = volatile_outputs + ["shards"]
+    assert read_tree(out_sharded, exclude) == read_tree(out_single, exclude)
+
+
+'''
+Testes das estatisticas de normalizacao (equivalencia com numpy sobre todos os arquivos compilados)
+'''
+# Verifica se cada quantil estimado esta a menos de eps da posicao exata na ordenacao das amostras
+# Entrada:
+#   values: vetor com todas as amostras
+#   estimates: dicionario quantil -> valor estimado
+#   eps: erro de posicao admitido (fracao das amostras)
+# Saida:
+#   None
+def _check_quantiles(values, estimates, eps):
+    for q, value in estimates.items():
+        assert np.mean(values < value) - eps <= float(q) <= np.mean(values <= value) + eps, (q, value)
+
+
+# Estado serializavel das estatisticas de um unico DataFrame, como gravado em out_path/stats/ por cada caso
+# Entrada:
+#   df: DataFrame com as colunas dos arquivos de treinamento
+# Saida:
+#   Dicionario gerado por FeatureStats.to_dict
+def _stats_dict(df):
+    stats = df_lib.FeatureStats()
+    stats.update(df)
+    return stats.to_dict()
+
+
+def test_stats_match_numpy():
+    out_path = temp_output()
+    run_main(fixture_config(out_path))
+    specs = df_lib.DatasetConfig(out_path + "dataset.yaml").plan()[0]
+    frames = [df_lib.read_training_file(spec.path_out_compiled) for spec in specs]
+    df = pd.concat(frames, ignore_index=True)
+    with open(out_path + "Compilado/stats.json", encoding="utf-8") as f:
+        stats = json.load(f)
+
+    assert stats["cases"] == [spec.key for spec in specs]
+    assert set(stats["features"]) == set(df.columns) - {"time_stamp", "propeller_demanded"}
+    for col, feature in stats["features"].items():
+        values = df[col].values.astype(float)
+        assert feature["count"] == len(values)
+        assert np.isclose(feature["mean"], values.mean(), rtol=1e-9, atol=1e-9)
+        assert np.isclose(feature["std"], values.std(), rtol=1e-7, atol=1e-9)
+        assert feature["min"] == values.min() and feature["max"] == values.max()
+        _check_quantiles(values, feature["quantiles"], 2.0 / 512)
+    counts = df["propeller_demanded"].value_counts()
+    assert stats["classes"]["propeller_demanded"] == {str(label): int(count) for label, count in sorted(counts.items())}
+
+    # Juncao caso a caso igual a uma unica passagem, inclusive apos a serializacao
+    single = df_lib.FeatureStats()
+    single.update(df)
+    merged = df_lib.FeatureStats()
+    for frame in frames:
+        merged.merge(df_lib.FeatureStats.from_dict(json.loads(json.dumps(_stats_dict(frame)))))
+    expected, summary = single.summary(), merged.summary()
+    assert expected["classes"] == summary["classes"]
+    for col, feature in expected["features"].items():
+        for name in ["count", "mean", "std", "min", "max"]:
+            assert np.isclose(summary["features"][col][name], feature[name], rtol=1e-9, atol=1e-9)
+
+
+def test_quantile_sketch_error_bound():
+    rng = np.random.default_rng(3)
+    values = np.concatenate([rng.normal(0, 1, 60000), rng.exponential(5, 40000)])
+    sketches = []
+    for part in np.array_split(values, 10):  # Esbocos de varios processos juntados
+        sketch = df_lib.QuantileSketch(128)
+        for chunk in np.array_split(part, 7):
+            sketch.update(chunk)
+        sketches.append(sketch)
+    merged = df_lib.QuantileSketch(128)
+    for sketch in sketches:
+        merged.merge(sketch)
+    assert sum(len(level) for level in merged.levels) < len(values) / 50
+    q = [0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99]
+    _check_quantiles(values, dict(zip(q, merged.quantile(q))), 4.0 / 128)
+    assert np.isnan(df_lib.QuantileSketch().quantile([0.5])).all()
+
+
+'''
+Testes da deteccao de comando de maquina oscilatorio (equivalencia com a marcacao manual nos overrides)
+'''
+# Fixa o perfil oscilatorio de casos de Suape_Aframax/RT por override de velocity (marcacao manual, sem deteccao)
+# Entrada:
+#   config_path: arquivo yaml gerado por fixture_config
+#   cases: numeros dos casos na pasta
+# Saida:
+#   None
+def _label_oscillating(config_path, cases):
+    with open(config_path, encoding="utf-8") as f:
+        data = yaml.safe_load(f)
+    data["folders"][1]["overrides"] = {num_case: {"velocity": "Aframax_Osc"} for num_case in cases}
+    with open(config_path, "w", encoding="utf-8") as f:
+        yaml.safe_dump(data, f, allow_unicode=True)
+
+
+# Resultado da deteccao de cada caso no relatorio da ultima execucao
+# Entrada:
+#   out_path: diretorio de saida
+# Saida:
+#   Dicionario caso -> (oscillating, profile) ou None para casos sem perfil oscilatorio
+def _oscillation_report(out_path):
+    with open(out_path + "run_report.json", encoding="utf-8") as f:
+        cases = json.load(f)["cases"]
+    return {case["key"]: None if case["validation"]["oscillation"] is None else
+            (case["validation"]["oscillation"]["oscillating"], case["validation"]["oscillation"]["profile"]) for case in cases}
+
+
+# Logs sinteticos de todos os casos da pasta Suape_Aframax/RT de dataset.yaml: comando alternando em poucos segundos nos
+# casos marcados em oscillation_labels, manobras lentas ou comando constante nos demais e o caso 11 com navio Suezmax
+# Entrada:
+#   root: diretorio raiz dos dados
+# Saida:
+#   Item de folders de dataset.yaml da pasta Suape_Aframax/RT
+def build_aframax_dataset(root):
+    with open(df_lib.default_config_path(), encoding="utf-8") as f:
+        folder = [folder for folder in yaml.safe_load(f)["folders"] if folder["path"] == "Suape_Aframax/RT/"][0]
+    intervals = dict(zip(folder["oscillation_labels"], [3, 5, 8, 4]))  # Alternancia das manobras marcadas (s)
+    intervals.update({6: 45, 9: 60, 13: 40, 16: 50})  # Manobras lentas
+    rows = []
+    for num_case in folder["cases"]:
+        ship = "Suezmax Y" if num_case == 11 else "Aframax X"
+        dir_case = root + folder["path"] + "Caso" + str(num_case) + "/"
+        os.makedirs(dir_case)
+        write_synthetic_log(dir_case + folder["files_by_ship"][ship.split()[0]] + ".txt", 1500 + 100 * num_case, "kn",
+                            intervals.get(num_case, False), num_case)
+        with open(dir_case + "navio.p3d", "w") as f:
+            f.write("HEADER\n  SCALE = 1.00\nVESSEL\n  NAME = X\n  BEAM = 42.00\n  DRAFT = 10.00\n  HEIGHT = 25.00\n"
+                    "  LENGTH = 245.00\nEND\n")
+        rows.append([num_case, ship, "Médio", "Entrada", "N", "0.5nó", "SE", "15nós", "1.0m", "8s", "SE"])
+    pd.DataFrame(rows, columns=["Caso", "Navio", "Cenário", "Manobra", "Corrente", "c2", "Vento", "v2", "Onda", "o2", "o3"]) \
+        .to_excel(root + folder["path"] + folder["cases_file"], sheet_name="Plan1", index=False)
+    return folder
+
+
+def test_oscillation_detection_pins_fixture_cases():
+    # Deteccao ativa (padrao) sem overrides: apenas o Caso04 (Suape_Aframax caso 1, comando alternando a cada 3 s) troca de perfil
+    out_detect = temp_output()
+    run_main(fixture_config(out_detect))
+    assert _oscillation_report(out_detect) == {"Caso01": None, "Caso02": None, "Caso03": None,
+                                                "Caso04": (True, "Aframax_Osc"), "Caso05": (False, None)}
+
+    # Referencia: perfil do caso 1 fixado por override, sem deteccao
+    out_label = temp_output()
+    config_path = fixture_config(out_label, oscillation=oscillation_config(detect=False))
+    _label_oscillating(config_path, [1])
+    run_main(config_path)
+    assert _oscillation_report(out_label)["Caso04"] == (True, "Aframax_Osc")
+    assert read_tree(out_detect + "Compilado/", ["stats.json"]) == read_tree(out_label + "Compilado/", ["stats.json"])
+
+    # Deteccao desativada: resultado apenas no relatorio, perfil nominal igual ao de uma execucao sem perfis
+    out_nominal = temp_output()
+    run_main(fixture_config(out_nominal, oscillation=oscillation_config(detect=False)))
+    assert _oscillation_report(out_nominal)["Caso04"] == (True, None)
+    out_plain = temp_output()
+    run_main(fixture_config(out_plain, oscillation=oscillation_config(profiles={})))
+    assert _oscillation_report(out_plain)["Caso04"] is None
+    assert read_tree(out_nominal + "Compilado/", ["stats.json"]) == read_tree(out_plain + "Compilado/", ["stats.json"])
+    nominal = df_lib.read_training_file(out_nominal + "Compilado/Caso04.txt")["propeller_demanded"]
+    detected = df_lib.read_training_file(out_detect + "Compilado/Caso04.txt")["propeller_demanded"]
+    assert not nominal.equals(detected)
+
+
+def test_aframax_profiles_detected_without_overrides():
+    # Pasta Suape_Aframax/RT de dataset.yaml sem alteracoes: limites atuais separam os casos marcados em oscillation_labels
+    root = temp_output()
+    folder = build_aframax_dataset(root)
+    out_detect = temp_output()
+    config_path = fixture_config(out_detect, root=root, folders=[folder])
+    run_main(config_path, calibrate=True)
+    with open(out_detect + "oscillation_calibration.json", encoding="utf-8") as f:
+        report = json.load(f)
+    assert report["current"]["divergent"] == []
+    assert report["current"]["confusion"] == {"tp": 4, "fp": 0, "fn": 0, "tn": 11}
+
+    # Perfil oscilatorio apenas nos casos 1/3/4/5, os mesmos dos antigos overrides manuais
+    run_main(config_path)
+    keys = {spec.num_case: spec.key for spec in df_lib.DatasetConfig(config_path).plan()[0]}
+    report = _oscillation_report(out_detect)
+    assert [num_case for num_case, key in keys.items() if report[key] is not None and report[key][1] == "Aframax_Osc"] == [1, 3, 4, 5]
+    assert report[keys[11]] is None  # Override de velocity com perfil Suezmax: fora da deteccao
+
+    # Referencia: overrides manuais de dataset.yaml antes da deteccao, sem deteccao
+    out_label = temp_output()
+    overrides = {**folder["overrides"], **{num_case: {"velocity": "Aframax_Osc"} for num_case in folder["oscillation_labels"]}}
+    run_main(fixture_config(out_label, root=root, folders=[dict(folder, overrides=overrides)],
+                            oscillation=oscillation_config(detect=False)))
+    assert read_tree(out_detect + "Compilado/", ["stats.json"]) == read_tree(out_label + "Compilado/", ["stats.json"])
+
+
+def test_oscillation_calibration_against_labels():
+    # Marcacao de oscillation_labels em dataset.yaml: caso 1 de Suape_Aframax marcado, caso 2 nao
+    out_path = temp_output()
+    run_main(fixture_config(out_path), calibrate=True)
+    with open(out_path + "oscillation_calibration.json", encoding="utf-8") as f:
+        report = json.load(f)
+    assert [(item["key"], item["label"], item["oscillating"]) for item in report["items"]] == \
+        [("Caso04", True, True), ("Caso05", False, False)]
+    assert report["current"]["confusion"] == {"tp": 1, "fp": 0, "fn": 0, "tn": 1}
+    assert report["suggested"]["separable"] == {"min_reversals": True, "reversals_per_minute": True}
+    assert report["suggested"]["divergent"] == []
+    assert not os.path.exists(out_path + "Compilado")  # Calibracao nao gera os arquivos de treinamento
+
+    # Mesmas inversoes da deteccao na execucao completa
+    run_main(fixture_config(out_path))
+    with open(out_path + "run_report.json", encoding="utf-8") as f:
+        validation = {case["key"]: case["validation"]["oscillation"] for case in json.load(f)["cases"]}
+    for item in report["items"]:
+        assert (item["reversals"], item["per_minute"]) == (validation[item["key"]]["reversals"], validation[item["key"]]["per_minute"])
+
+    # Marcacao que contradiz os logs: casos divergentes e limites sem separacao
+    items = [dict(item, label=not item["label"]) for item in report["items"]]
+    result = df_lib.oscillation_calibration(items, 20, 2.0)
+    assert result["current"]["confusion"] == {"tp": 0, "fp": 1, "fn": 1, "tn": 0}
+    assert result["current"]["divergent"] == ["Caso04", "Caso05"]
+    assert result["suggested"]["separable"] == {"min_reversals": False, "reversals_per_minute": False}
+
+    # Limites sugeridos entre o maior valor dos nao marcados e o menor dos marcados
+    items = [{"key": "a", "label": True, "reversals": 30, "per_minute": 5.0}, {"key": "b", "label": True, "reversals": 25, "per_minute": 3.0},
+             {"key": "c", "label": False, "reversals": 21, "per_minute": 2.5}, {"key": "d", "label": False, "reversals": None, "per_minute": None}]
+    result = df_lib.oscillation_calibration(items, 20, 2.0)
+    assert result["cases"] == 3 and result["current"]["divergent"] == ["c"]
+    assert (result["suggested"]["min_reversals"], result["suggested"]["reversals_per_minute"]) == (24, 2.75)
+    assert result["suggested"]["confusion"] == {"tp": 2, "fp": 0, "fn": 0, "tn": 1}
+
+
+def test_replay_log_uses_case_profile():
+    import Replay_Log
+    out_path = temp_output()
+    config_path = fixture_config(out_path, oscillation=oscillation_config(detect=True))
+    run_main(config_path)
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        Replay_Log.main("Suape_Aframax/RT/", 1, config_path=config_path)
+    assert "perfil de velocidade Aframax_Osc" in out.getvalue()
+    match = re.search(r"Maior diferenca para o processamento em lote: (\S+)", out.getvalue())
+    assert match is not None and float(match.group(1)) < 1e-6
+
+    # Comando discreto online igual ao do arquivo de treinamento do caso
+    config = df_lib.DatasetConfig(config_path)
+    spec = [spec for spec in config.plan()[0] if spec.key == "Caso04"][0]
+    ship = df_lib.Ship(spec.ship_fullname, df_lib.P3D_file(spec.path_p3d).find_dimensions(), spec.velocity)
+    df = df_lib.read_simulation_log(spec.path_case, spec.columns, lambda chunk: df_lib.filter_trajectory(chunk, spec.buoys, spec.target, ship))
+    ship = df_lib.case_ship(config, spec, ship, df["time_stamp"].values, df[spec.columns[8]].values)
+    online = df_lib.OnlineFeatures(ship, spec.channel, spec.target, config.flag_lateral)
+    rows = []
+    for sample in df_lib.read_simulation_log(spec.path_case, spec.columns).values.tolist():
+        row = online.update(*sample)
+        if online.inside:
+            rows.append(row[online.names.index("propeller_demanded")])
+    training = df_lib.read_training_file(out_path + "Compilado/Caso04.txt")
+    np.testing.assert_array_equal(np.array(rows), training["propeller_demanded"].values)
+
+
+'''
+Metodo principal
+'''
+def main(pattern=None):
+    tests = [(name, func) for name, func in globals().items() if name.startswith("test_") and callable(func)]
+    if pattern is not None:
+        tests = [(name, func) for name, func in tests if pattern in name]
+    failures = 0
+    for name, func in tests:
+        try:
+            func()
+            print("OK     " + name)
+        except Exception:
+            failures = failures + 1
+            print("FALHA  " + name)
+            traceback.print_exc()
+    print("\n" + str(len(tests) - failures) + " de " + str(len(tests)) + " testes sem falha")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Executa os testes de Data_Filter.py")
+    parser.add_argument("-k", dest="pattern", default=None, help="executa apenas os testes com esse trecho no nome")
+    args = parser.parse_args()
+    sys.exit(1 if main(args.pattern) > 0 else 0)